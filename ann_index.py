@@ -0,0 +1,509 @@
+"""
+ANN Index
+
+Nearest-neighbour indices over normalised embeddings, implemented on NumPy behind a small
+pluggable interface: build once, persist to disk, load and query in batches. Scores are inner
+products, i.e. cosine similarities for unit-length vectors.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from retrieval_ranking import block_rows_for_budget
+
+
+def merge_top_k(best_scores, best_indices, scores, indices, k):
+    """
+    Merges candidate (score, index) lists row-wise and keeps the k best per row, best first.
+
+    Args:
+        best_scores (np.ndarray): Current best scores, shape (n, a)
+        best_indices (np.ndarray): Corpus ids of the current best, shape (n, a)
+        scores (np.ndarray): New candidate scores, shape (n, b)
+        indices (np.ndarray): Corpus ids of the new candidates, shape (n, b)
+        k (int): Number of entries to keep
+
+    Returns:
+        tuple: (scores, indices) of shape (n, min(k, a + b))
+    """
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    all_indices = np.concatenate([best_indices, indices], axis=1)
+    rows = np.arange(len(all_scores))[:, None]
+    if all_scores.shape[1] > k:
+        keep = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        all_scores = all_scores[rows, keep]
+        all_indices = all_indices[rows, keep]
+    order = np.argsort(-all_scores, axis=1, kind="stable")
+    return all_scores[rows, order], all_indices[rows, order]
+
+
+class VectorIndex:
+    """
+    Interface of the index backends.
+
+    Subclasses implement build, search, save and load; `name` identifies the backend in
+    INDEX_BACKENDS and in saved files.
+    """
+
+    name = None
+
+    def build(self, embeddings):
+        """Index the given (normalised) embeddings; their row numbers become the result ids."""
+        raise NotImplementedError
+
+    def search(self, queries, k):
+        """
+        Returns (scores, ids), both of shape (len(queries), k), best match first.
+        """
+        raise NotImplementedError
+
+    def save(self, path):
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, path):
+        raise NotImplementedError
+
+    @property
+    def memory_bytes(self):
+        """Bytes of index data held in memory."""
+        raise NotImplementedError
+
+
+class FlatIndex(VectorIndex):
+    """
+    Exact search over all vectors, scoring queries in memory-bounded blocks.
+    """
+
+    name = "flat"
+
+    def __init__(self, max_block_bytes=256 * 1024 ** 2):
+        self.max_block_bytes = max_block_bytes
+        self.vectors = None
+
+    def build(self, embeddings):
+        self.vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        return self
+
+    def search(self, queries, k):
+        queries = np.asarray(queries, dtype=np.float32)
+        k = min(k, len(self.vectors))
+        block_size = block_rows_for_budget(len(self.vectors), self.max_block_bytes)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        ids = np.empty((len(queries), k), dtype=np.int64)
+
+        for start in range(0, len(queries), block_size):
+            end = min(start + block_size, len(queries))
+            block_scores = queries[start:end] @ self.vectors.T
+            candidates = np.argpartition(-block_scores, k - 1, axis=1)[:, :k]
+            rows = np.arange(end - start)[:, None]
+            candidate_scores = block_scores[rows, candidates]
+            order = np.argsort(-candidate_scores, axis=1, kind="stable")
+            scores[start:end] = candidate_scores[rows, order]
+            ids[start:end] = candidates[rows, order]
+
+        return scores, ids
+
+    def save(self, path):
+        np.savez(path, backend=self.name, vectors=self.vectors)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        index = cls()
+        index.vectors = data["vectors"]
+        return index
+
+    @property
+    def memory_bytes(self):
+        return self.vectors.nbytes
+
+
+class IVFFlatIndex(VectorIndex):
+    """
+    Inverted-file index: vectors are clustered with spherical k-means and a query only scans
+    the nprobe lists whose centroids are closest to it.
+
+    Queries are processed per inverted list, so each list is scored against all queries probing
+    it in a single matrix product.
+    """
+
+    name = "ivf_flat"
+
+    def __init__(self, num_lists=1024, nprobe=16, kmeans_iterations=20, training_sample=256, seed=0):
+        self.num_lists = num_lists
+        self.nprobe = nprobe
+        self.kmeans_iterations = kmeans_iterations
+        self.training_sample = training_sample
+        self.seed = seed
+        self.centroids = None
+        self.vectors = None
+        self.ids = None
+        self.offsets = None
+
+    def _assign(self, embeddings, block_size=65536):
+        assignments = np.empty(len(embeddings), dtype=np.int64)
+        for start in range(0, len(embeddings), block_size):
+            block = embeddings[start:start + block_size]
+            assignments[start:start + block_size] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def _train(self, embeddings):
+        rng = np.random.default_rng(self.seed)
+        num_lists = min(self.num_lists, len(embeddings))
+        sample_size = min(len(embeddings), num_lists * self.training_sample)
+        sample = embeddings[np.sort(rng.choice(len(embeddings), sample_size, replace=False))]
+        self.centroids = sample[rng.choice(len(sample), num_lists, replace=False)].copy()
+
+        for _ in range(self.kmeans_iterations):
+            assignments = self._assign(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=num_lists)
+            # Empty lists are re-seeded with random sample points
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            self.centroids = sums / np.maximum(norms, 1e-12)
+
+    def build(self, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        self._train(embeddings)
+        assignments = self._assign(embeddings)
+        order = np.argsort(assignments, kind="stable")
+        self.ids = order
+        self.vectors = embeddings[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(self.centroids)))])
+        return self
+
+    def search(self, queries, k, nprobe=None):
+        queries = np.asarray(queries, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+
+        # Group queries by the lists they probe
+        probe_lists = probes.ravel()
+        probe_queries = np.repeat(np.arange(len(queries)), nprobe)
+        order = np.argsort(probe_lists, kind="stable")
+        probe_lists, probe_queries = probe_lists[order], probe_queries[order]
+        boundaries = np.flatnonzero(np.diff(probe_lists)) + 1
+
+        for query_group in np.split(np.arange(len(probe_lists)), boundaries):
+            if len(query_group) == 0:
+                continue
+            list_id = probe_lists[query_group[0]]
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start == end:
+                continue
+            query_ids = probe_queries[query_group]
+            scores = queries[query_ids] @ self.vectors[start:end].T
+            list_k = min(k, end - start)
+            candidates = np.argpartition(-scores, list_k - 1, axis=1)[:, :list_k]
+            rows = np.arange(len(query_ids))[:, None]
+            best_scores[query_ids], best_ids[query_ids] = merge_top_k(
+                best_scores[query_ids], best_ids[query_ids],
+                scores[rows, candidates], self.ids[start + candidates], k
+            )
+
+        return best_scores, best_ids
+
+    def save(self, path):
+        np.savez(
+            path,
+            backend=self.name,
+            centroids=self.centroids,
+            vectors=self.vectors,
+            ids=self.ids,
+            offsets=self.offsets,
+            nprobe=self.nprobe
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        index = cls(num_lists=len(data["centroids"]), nprobe=int(data["nprobe"]))
+        index.centroids = data["centroids"]
+        index.vectors = data["vectors"]
+        index.ids = data["ids"]
+        index.offsets = data["offsets"]
+        return index
+
+    @property
+    def memory_bytes(self):
+        return self.centroids.nbytes + self.vectors.nbytes + self.ids.nbytes + self.offsets.nbytes
+
+
+class QuantizedIndex(VectorIndex):
+    """
+    Two-stage search over compressed vectors: the whole corpus is scored on its quantized codes
+    to shortlist k * rescore_factor candidates per query, and only the shortlist is rescored
+    with the float vectors.
+
+    The float vectors are kept by reference and only indexed at shortlisted rows, so they can be
+    a memory-mapped array (e.g. from the embedding store); only the codes are held in memory.
+    Subclasses define how blocks of vectors are encoded and decoded.
+    """
+
+    def __init__(self, rescore_factor=10, max_block_bytes=256 * 1024 ** 2):
+        self.rescore_factor = rescore_factor
+        self.max_block_bytes = max_block_bytes
+        self.codes = None
+        self.dimension = None
+        self.rescore_vectors = None
+
+    def _fit(self, embeddings):
+        """Learn quantization parameters from the embeddings."""
+
+    def _encode(self, block):
+        raise NotImplementedError
+
+    def _decode(self, codes):
+        """Returns float32 vectors whose dot product with prepared queries gives shortlist scores."""
+        raise NotImplementedError
+
+    def _prepare_queries(self, queries):
+        return queries
+
+    def build(self, embeddings, block_size=65536):
+        self.dimension = embeddings.shape[1]
+        self._fit(embeddings)
+        self.codes = np.concatenate([
+            self._encode(np.asarray(embeddings[start:start + block_size], dtype=np.float32))
+            for start in range(0, len(embeddings), block_size)
+        ])
+        self.rescore_vectors = embeddings
+        return self
+
+    def shortlist(self, queries, num_candidates):
+        """
+        Returns (scores, ids) of the num_candidates best entries per query by quantized score.
+
+        The corpus is decoded chunk by chunk so that the decoded chunk and the score block each
+        stay within max_block_bytes.
+        """
+        queries = self._prepare_queries(np.asarray(queries, dtype=np.float32))
+        num_candidates = min(num_candidates, len(self.codes))
+        chunk_size = max(1, min(len(self.codes), self.max_block_bytes // (4 * self.dimension)))
+        block_size = block_rows_for_budget(chunk_size, self.max_block_bytes)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+
+        for chunk_start in range(0, len(self.codes), chunk_size):
+            decoded = self._decode(self.codes[chunk_start:chunk_start + chunk_size])
+            chunk_k = min(num_candidates, len(decoded))
+            chunk_scores = np.empty((len(queries), chunk_k), dtype=np.float32)
+            chunk_ids = np.empty((len(queries), chunk_k), dtype=np.int64)
+            for start in range(0, len(queries), block_size):
+                end = min(start + block_size, len(queries))
+                scores = queries[start:end] @ decoded.T
+                candidates = np.argpartition(-scores, chunk_k - 1, axis=1)[:, :chunk_k]
+                chunk_scores[start:end] = np.take_along_axis(scores, candidates, axis=1)
+                chunk_ids[start:end] = candidates + chunk_start
+            best_scores, best_ids = merge_top_k(best_scores, best_ids, chunk_scores, chunk_ids, num_candidates)
+
+        return best_scores, best_ids
+
+    def search(self, queries, k):
+        queries = np.asarray(queries, dtype=np.float32)
+        k = min(k, len(self.codes))
+        _, candidates = self.shortlist(queries, k * self.rescore_factor)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        ids = np.empty((len(queries), k), dtype=np.int64)
+
+        # Rescore the shortlist in float, gathering at most max_block_bytes of vectors at a time;
+        # rows are read in sorted order, which suits memory-mapped vectors
+        block_size = max(1, self.max_block_bytes // (4 * candidates.shape[1] * self.dimension))
+        for start in range(0, len(queries), block_size):
+            end = min(start + block_size, len(queries))
+            unique_ids, positions = np.unique(candidates[start:end], return_inverse=True)
+            vectors = np.asarray(self.rescore_vectors[unique_ids], dtype=np.float32)
+            block_scores = np.einsum("qd,qcd->qc", queries[start:end], vectors[positions.reshape(end - start, -1)])
+            top = np.argsort(-block_scores, axis=1, kind="stable")[:, :k]
+            scores[start:end] = np.take_along_axis(block_scores, top, axis=1)
+            ids[start:end] = np.take_along_axis(candidates[start:end], top, axis=1)
+        return scores, ids
+
+    def _save_arrays(self):
+        return {}
+
+    def _load_arrays(self, data):
+        pass
+
+    def save(self, path):
+        np.savez(
+            path,
+            backend=self.name,
+            codes=self.codes,
+            dimension=self.dimension,
+            rescore_factor=self.rescore_factor,
+            **self._save_arrays()
+        )
+        # Float vectors go to a raw file next to the index so that load can memory-map them
+        if self.rescore_vectors is not None:
+            with open(f"{path}.rescore.f32", "wb") as vectors_file:
+                for start in range(0, len(self.rescore_vectors), 65536):
+                    vectors_file.write(np.asarray(self.rescore_vectors[start:start + 65536], dtype=np.float32).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        index = cls(rescore_factor=int(data["rescore_factor"]))
+        index.codes = data["codes"]
+        index.dimension = int(data["dimension"])
+        index._load_arrays(data)
+        if os.path.exists(f"{path}.rescore.f32"):
+            index.rescore_vectors = np.memmap(
+                f"{path}.rescore.f32", dtype=np.float32, mode="r", shape=(len(index.codes), index.dimension)
+            )
+        return index
+
+    @property
+    def memory_bytes(self):
+        return self.codes.nbytes + sum(array.nbytes for array in self._save_arrays().values())
+
+
+class ScalarQuantizedIndex(QuantizedIndex):
+    """
+    int8 scalar quantization: every dimension is mapped linearly from its calibrated range
+    onto 256 levels (4x smaller than float32). Shortlist scores are float query times
+    dequantized codes.
+    """
+
+    name = "int8"
+
+    def __init__(self, rescore_factor=10, max_block_bytes=256 * 1024 ** 2, calibration_sample=100000, seed=0):
+        super().__init__(rescore_factor, max_block_bytes)
+        self.calibration_sample = calibration_sample
+        self.seed = seed
+        self.minimum = None
+        self.step = None
+
+    def _fit(self, embeddings):
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(embeddings), self.calibration_sample)
+        sample = np.asarray(embeddings[np.sort(rng.choice(len(embeddings), sample_size, replace=False))], dtype=np.float32)
+        self.minimum = sample.min(axis=0)
+        self.step = np.maximum(sample.max(axis=0) - self.minimum, 1e-12) / 255.0
+
+    def _encode(self, block):
+        levels = np.clip(np.rint((block - self.minimum) / self.step), 0, 255)
+        return (levels - 128).astype(np.int8)
+
+    def _decode(self, codes):
+        return (codes.astype(np.float32) + 128.0) * self.step + self.minimum
+
+    def _save_arrays(self):
+        return {"minimum": self.minimum, "step": self.step}
+
+    def _load_arrays(self, data):
+        self.minimum = data["minimum"]
+        self.step = data["step"]
+
+
+class BinaryIndex(QuantizedIndex):
+    """
+    Binary (sign) quantization: one bit per dimension, packed into bytes (32x smaller than
+    float32). Shortlist scores are dimension - 2 * Hamming distance between the query's and the
+    vector's sign bits, computed as a +-1 matrix product.
+    """
+
+    name = "binary"
+
+    def _encode(self, block):
+        return np.packbits(block > 0, axis=1)
+
+    def _decode(self, codes):
+        return np.unpackbits(codes, axis=1, count=self.dimension).astype(np.float32) * 2.0 - 1.0
+
+    def _prepare_queries(self, queries):
+        return np.where(queries > 0, 1.0, -1.0).astype(np.float32)
+
+
+INDEX_BACKENDS = {
+    FlatIndex.name: FlatIndex,
+    IVFFlatIndex.name: IVFFlatIndex,
+    ScalarQuantizedIndex.name: ScalarQuantizedIndex,
+    BinaryIndex.name: BinaryIndex,
+}
+
+
+def create_index(backend, **options):
+    """
+    Create an empty index for the given backend name.
+
+    Args:
+        backend (str): Key of INDEX_BACKENDS
+        **options: Backend-specific parameters
+
+    Returns:
+        VectorIndex: Unbuilt index
+    """
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown index backend: {backend}. Available backends: {list(INDEX_BACKENDS.keys())}")
+    return INDEX_BACKENDS[backend](**options)
+
+
+def embeddings_fingerprint(embeddings, **metadata):
+    """
+    Identifies the embeddings an index is built from.
+
+    Args:
+        embeddings (np.ndarray): Matrix of shape (n, dim)
+        **metadata: JSON-serialisable details such as the model ID and index options
+
+    Returns:
+        dict: Row count, dimension and SHA-1 of the float32 vectors, plus the metadata
+    """
+    digest = hashlib.sha1()
+    for start in range(0, len(embeddings), 65536):
+        digest.update(np.ascontiguousarray(embeddings[start:start + 65536], dtype=np.float32).tobytes())
+    return {
+        "num_vectors": int(len(embeddings)),
+        "dimension": int(embeddings.shape[1]) if len(embeddings) else 0,
+        "sha1": digest.hexdigest(),
+        **metadata
+    }
+
+
+def save_index(index, path, fingerprint=None):
+    """
+    Persist an index to a .npz file, with its fingerprint (see embeddings_fingerprint) in a
+    <path>.fingerprint.json file next to it.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    index.save(path)
+    if fingerprint is not None:
+        with open(f"{path}.fingerprint.json", "w", encoding="utf-8") as fingerprint_file:
+            json.dump(fingerprint, fingerprint_file, indent=2, sort_keys=True)
+
+
+def index_matches(path, fingerprint):
+    """
+    Whether the index saved at path was built from embeddings with the given fingerprint. Indices
+    saved without a fingerprint never match.
+    """
+    fingerprint_path = f"{path}.fingerprint.json"
+    if not os.path.exists(path) or not os.path.exists(fingerprint_path):
+        return False
+    with open(fingerprint_path, "r", encoding="utf-8") as fingerprint_file:
+        # Round-tripped through JSON so tuples in the metadata compare equal to stored lists
+        return json.load(fingerprint_file) == json.loads(json.dumps(fingerprint))
+
+
+def load_index(path):
+    """
+    Load an index saved with save_index, dispatching on the stored backend name.
+    """
+    with np.load(path) as data:
+        backend = str(data["backend"])
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown index backend '{backend}' in {path}.")
+    return INDEX_BACKENDS[backend].load(path)
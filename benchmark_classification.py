@@ -0,0 +1,74 @@
+"""
+Classification Benchmark
+
+Compares the throughput of per-row prompt classification against the batched embedding
+classifier on a synthetic dataset with repeated texts, using stub models.
+"""
+
+import time
+
+from stub_models import StubClassificationModel, StubEmbeddingModel, install_stub_modules
+
+# The scripts import loaders that are not part of this repository
+install_stub_modules()
+
+from data_classifier import classification_labels, classify_column_with_embeddings, classify_column_with_prompts
+from embedding_classifier import EmbeddingZeroShotClassifier
+
+def make_texts(num_rows, num_distinct):
+    """
+    Creates synthetic texts where only num_distinct of num_rows are unique.
+    """
+    return [f"Synthetic text {i % num_distinct} about topic {i % 13}." for i in range(num_rows)]
+
+def benchmark_prompts(texts, latency):
+    """
+    Times per-row prompt classification and returns rows per second.
+    """
+    model = StubClassificationModel(classification_labels, latency=latency)
+    start = time.perf_counter()
+    classify_column_with_prompts(texts, classification_labels, model)
+    elapsed = time.perf_counter() - start
+    return {"mode": "prompt per row", "rows": len(texts), "seconds": elapsed, "rows_per_second": len(texts) / elapsed}
+
+def benchmark_embeddings(texts, batch_size):
+    """
+    Times batched embedding classification and returns rows per second.
+    """
+    model = StubEmbeddingModel()
+    classifier = EmbeddingZeroShotClassifier(model.encode, classification_labels, threshold=0.1)
+    start = time.perf_counter()
+    classify_column_with_embeddings(texts, classifier, batch_size)
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": f"embedding (batch_size={batch_size})",
+        "rows": len(texts),
+        "seconds": elapsed,
+        "rows_per_second": len(texts) / elapsed
+    }
+
+def main():
+    """
+    Runs the classification throughput comparison with predefined parameters.
+    """
+    # Configuration for the benchmark
+    num_rows = 20000
+    num_distinct = 14000  # About 30% repeated texts
+    prompt_rows = 200  # The prompt path is slow, so it runs on a prefix of the data
+    prompt_latency = 0.02  # Seconds per simulated generative call
+    batch_sizes = [32, 256]
+
+    texts = make_texts(num_rows, num_distinct)
+    results = [benchmark_prompts(texts[:prompt_rows], prompt_latency)]
+    for batch_size in batch_sizes:
+        results.append(benchmark_embeddings(texts, batch_size))
+
+    baseline = results[0]["rows_per_second"]
+    print(f"{'Mode':<30} | {'Rows':>6} | {'Rows/s':>9} | {'Speedup':>7}")
+    print("-" * 62)
+    for result in results:
+        speedup = result["rows_per_second"] / baseline
+        print(f"{result['mode']:<30} | {result['rows']:>6} | {result['rows_per_second']:>9.1f} | {speedup:>6.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Data Pipeline Benchmark
+
+Compares the padding ratio and tokens per second of the on-the-fly path (prefix and tokenize
+every random batch, as map_to_pairs does) with pre-tokenized, memory-mapped columns served in
+length-bucketed batches.
+"""
+
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from embedding_store import text_hashes
+from pretokenized_data import PretokenizedPairs, padding_ratio, pretokenize_column, random_batches
+from stub_models import StubTokenizer
+
+def make_pairs(num_rows, seed=0):
+    """
+    Creates synthetic instructions (short, variable) and personas (longer, variable), with some
+    personas repeated.
+    """
+    rng = random.Random(seed)
+    words = [f"word{i}" for i in range(5000)]
+    instructions = [" ".join(rng.choices(words, k=rng.randint(5, 60))) for _ in range(num_rows)]
+    distinct_personas = [" ".join(rng.choices(words, k=rng.randint(20, 200))) for _ in range(int(num_rows * 0.8))]
+    personas = [rng.choice(distinct_personas) for _ in range(num_rows)]
+    return instructions, personas
+
+def benchmark_on_the_fly(instructions, personas, tokenizer, batch_size, prefixes, max_length):
+    """
+    Tokenizes and pads every random batch from the raw texts.
+    """
+    batches = random_batches(len(instructions), batch_size)
+    start = time.perf_counter()
+    real_tokens = padded_tokens = 0
+    for batch in batches:
+        for texts, prefix in ((instructions, prefixes[0]), (personas, prefixes[1])):
+            encoded = tokenizer([f"{prefix}{texts[i]}" for i in batch], truncation=True, max_length=max_length, padding=True)
+            mask = np.asarray(encoded["attention_mask"])
+            real_tokens += int(mask.sum())
+            padded_tokens += mask.size
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": "tokenize per batch (random)",
+        "padding_ratio": 1.0 - real_tokens / padded_tokens,
+        "tokens_per_second": real_tokens / elapsed,
+        "preprocess_seconds": 0.0
+    }
+
+def benchmark_pretokenized(instructions, personas, tokenizer, batch_size, prefixes, max_length, cache_dir, bucketed=True):
+    """
+    Pre-tokenizes both columns once, then pads batches straight from the memory-mapped tokens.
+    """
+    start = time.perf_counter()
+    pairs = PretokenizedPairs(
+        pretokenize_column(instructions, tokenizer, prefixes[0], max_length, cache_dir),
+        pretokenize_column(personas, tokenizer, prefixes[1], max_length, cache_dir),
+        positive_keys=text_hashes(personas)
+    )
+    preprocess_seconds = time.perf_counter() - start
+
+    batches = pairs.batches(batch_size) if bucketed else random_batches(len(pairs), batch_size)
+    start = time.perf_counter()
+    real_tokens = 0
+    for batch in batches:
+        for features in pairs.collate(batch):
+            real_tokens += int(features["attention_mask"].sum())
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": f"pretokenized ({'length-bucketed' if bucketed else 'random'})",
+        "padding_ratio": padding_ratio(batches, pairs.instructions.lengths, pairs.inputs.lengths),
+        "tokens_per_second": real_tokens / elapsed,
+        "preprocess_seconds": preprocess_seconds
+    }
+
+def main():
+    """
+    Runs the data pipeline comparison with predefined parameters.
+    """
+    # Configuration for the benchmark
+    num_rows = 50000
+    batch_size = 64
+    max_length = 256
+    prefixes = ("Instruct: ", "Persona: ")
+
+    instructions, personas = make_pairs(num_rows)
+    tokenizer = StubTokenizer()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results = [
+            benchmark_on_the_fly(instructions, personas, tokenizer, batch_size, prefixes, max_length),
+            benchmark_pretokenized(instructions, personas, tokenizer, batch_size, prefixes, max_length, cache_dir, bucketed=False),
+            benchmark_pretokenized(instructions, personas, tokenizer, batch_size, prefixes, max_length, cache_dir)
+        ]
+
+    print(f"{'Mode':<30} | {'Padding':>7} | {'Tokens/s':>11} | {'Preprocess s':>12}")
+    print("-" * 70)
+    for result in results:
+        print(
+            f"{result['mode']:<30} | {result['padding_ratio']:>6.1%} | "
+            f"{result['tokens_per_second']:>11.0f} | {result['preprocess_seconds']:>12.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
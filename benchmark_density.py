@@ -0,0 +1,87 @@
+"""
+Density Rendering Benchmark
+
+Renders one million labelled 2D points as a marker scatter plot and as a density raster, and
+reports the time, peak memory growth and PNG size of both.
+"""
+
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from density_plot import encode_categories, render_density_plot
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def make_points(num_points, num_classes=20, seed=0):
+    """
+    Clustered 2D points with a class column per half, as Python string lists like dataset columns.
+    """
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, num_classes, num_points)
+    centers = rng.uniform(-50, 50, (num_classes, 2))
+    points = centers[labels] + rng.standard_normal((num_points, 2)) * 4
+    names = [f"Class {i}" for i in range(num_classes)]
+    classes = [names[label] for label in labels]
+    half = num_points // 2
+    return points[:, 0], points[:, 1], classes[:half], classes[half:]
+
+def benchmark_scatter(x, y, persona_classes, instruction_classes, output_path):
+    """
+    One marker per point, with the class list built by list concatenation as the plotting scripts do.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    start = time.perf_counter()
+    classes = persona_classes + instruction_classes
+    names, codes = np.unique(classes, return_inverse=True)
+    figure, axis = plt.subplots(figsize=(13, 10), dpi=100)
+    axis.scatter(x, y, c=codes, s=2, cmap="tab20")
+    figure.savefig(output_path)
+    plt.close(figure)
+    return time.perf_counter() - start
+
+def benchmark_density(x, y, persona_classes, instruction_classes, output_path):
+    start = time.perf_counter()
+    codes, categories = encode_categories(persona_classes, instruction_classes)
+    encode_seconds = time.perf_counter() - start
+    render_density_plot(x, y, codes, categories, output_path, title="Density")
+    return encode_seconds, time.perf_counter() - start
+
+def run_mode(mode, num_points, output_path):
+    """
+    Renders in a fresh process, so peak memory is measured per mode.
+    """
+    x, y, persona_classes, instruction_classes = make_points(num_points)
+    baseline_rss = peak_rss_mib()
+    if mode == "density":
+        _, seconds = benchmark_density(x, y, persona_classes, instruction_classes, output_path)
+    else:
+        seconds = benchmark_scatter(x, y, persona_classes, instruction_classes, output_path)
+    return seconds, peak_rss_mib() - baseline_rss, os.path.getsize(output_path) / 1024
+
+def main():
+    """
+    Runs the rendering benchmark with predefined parameters.
+    """
+    # Configuration for the benchmark
+    num_points = 1000000
+
+    print(f"{'Mode':<8} | {'Seconds':>7} | {'Peak RSS growth MiB':>19} | {'PNG KiB':>7}")
+    print("-" * 52)
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("scatter", "density"):
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                seconds, rss_growth, png_kib = pool.submit(run_mode, mode, num_points, os.path.join(directory, f"{mode}.png")).result()
+            print(f"{mode:<8} | {seconds:>7.2f} | {rss_growth:>19.0f} | {png_kib:>7.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+ONNX Backend Benchmark
+
+Sentences per second of all-MiniLM-L6-v2 and bge-large-en-v1.5 on CPU with the stock
+SentenceTransformer encode and with the float32 and dynamic int8 ONNX Runtime exports of
+onnx_backend, plus the cosine drift of each export against the original model on the benchmark
+texts. When a model cannot be downloaded, a randomly initialised model with the same architecture
+(layers, hidden size, heads, pooling, sequence length) stands in for it: throughput depends on the
+architecture only, while the drift of random weights is only indicative.
+"""
+
+import os
+import tempfile
+import time
+
+from model_mappings import get_model_id, load_sentence_transformer
+from onnx_backend import OnnxEncoder, available_cpus, check_parity, export_onnx
+from stub_models import make_synthetic_corpus
+
+# BERT architectures of the benchmarked models, for stand-ins
+ARCHITECTURES = {
+    "all-MiniLM-L6-v2": {"num_hidden_layers": 6, "hidden_size": 384, "num_attention_heads": 12, "intermediate_size": 1536,
+                         "pooling_mode": "mean", "max_seq_length": 256},
+    "bge-large-en-v1.5": {"num_hidden_layers": 24, "hidden_size": 1024, "num_attention_heads": 16, "intermediate_size": 4096,
+                          "pooling_mode": "cls", "max_seq_length": 512},
+}
+
+def build_stand_in(model_name, texts, directory):
+    """
+    Randomly initialised SentenceTransformer with the architecture of model_name and a word-level
+    vocabulary covering texts.
+    """
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    architecture = dict(ARCHITECTURES[model_name])
+    pooling_mode = architecture.pop("pooling_mode")
+    max_seq_length = architecture.pop("max_seq_length")
+    words = sorted({word for text in texts for word in text.lower().replace(":", " :").split()})
+    vocab_path = os.path.join(directory, "vocab.txt")
+    with open(vocab_path, "w", encoding="utf-8") as vocab_file:
+        vocab_file.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words) + "\n")
+
+    model_directory = os.path.join(directory, "model")
+    BertModel(BertConfig(vocab_size=30522, max_position_embeddings=512, **architecture)).save_pretrained(model_directory)
+    BertTokenizerFast(vocab_file=vocab_path, do_lower_case=True).save_pretrained(model_directory)
+    transformer = models.Transformer(model_directory, max_seq_length=max_seq_length)
+    pooling = models.Pooling(architecture["hidden_size"], pooling_mode=pooling_mode)
+    return SentenceTransformer(modules=[transformer, pooling, models.Normalize()], device="cpu")
+
+def sentences_per_second(encode, texts, batch_size):
+    encode(texts[:batch_size])
+    start = time.perf_counter()
+    embeddings = encode(texts)
+    return len(texts) / (time.perf_counter() - start), embeddings
+
+def benchmark_model(model_name, texts, batch_size, directory):
+    import torch
+
+    try:
+        model = load_sentence_transformer(get_model_id(model_name))
+        source = "pretrained"
+    except OSError as error:
+        print(f"{model_name} is not available ({type(error).__name__}); using a random-weight stand-in.")
+        model = build_stand_in(model_name, texts, directory)
+        source = "stand-in"
+
+    torch.set_num_threads(available_cpus())
+    with torch.inference_mode():
+        torch_rate, reference = sentences_per_second(lambda batch: model.encode(batch, batch_size=batch_size), texts, batch_size)
+    rows = [(f"{model_name} ({source})", "torch", available_cpus(), torch_rate, None)]
+
+    export_directory = os.path.join(directory, "onnx")
+    export_onnx(model, export_directory, get_model_id(model_name), tune_texts=texts[:4 * batch_size])
+    for backend in ("onnx", "onnx-int8"):
+        encoder = OnnxEncoder(export_directory, backend)
+        rate, embeddings = sentences_per_second(lambda batch: encoder.encode(batch, batch_size=batch_size), texts, batch_size)
+        rows.append((f"{model_name} ({source})", backend, encoder.num_threads, rate, check_parity(reference, embeddings)))
+    return rows
+
+def main():
+    """
+    Runs the ONNX backend benchmark with predefined parameters.
+    """
+    # Configuration for the benchmark
+    num_texts = {"all-MiniLM-L6-v2": 2000, "bge-large-en-v1.5": 400}
+    batch_size = 32
+
+    corpus = make_synthetic_corpus(max(num_texts.values()))
+    rows = []
+    for model_name, count in num_texts.items():
+        texts = list(corpus.get_column("input"))[:count]
+        with tempfile.TemporaryDirectory() as directory:
+            rows += benchmark_model(model_name, texts, batch_size, directory)
+
+    print(f"\n{'Model':<32} | {'Backend':<9} | {'Threads':>7} | {'Sent/s':>8} | {'Speedup':>7} | {'Mean drift':>10} | {'Max drift':>10}")
+    print("-" * 101)
+    baseline = {}
+    for model, backend, threads, rate, parity in rows:
+        baseline.setdefault(model, rate)
+        drift = f"{parity['mean_cosine_drift']:>10.2e} | {parity['max_cosine_drift']:>10.2e}" if parity else f"{'-':>10} | {'-':>10}"
+        print(f"{model:<32} | {backend:<9} | {threads:>7} | {rate:>8.1f} | {rate / baseline[model]:>6.2f}x | {drift}")
+
+if __name__ == "__main__":
+    main()
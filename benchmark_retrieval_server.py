@@ -0,0 +1,76 @@
+"""
+Retrieval Server Benchmark
+
+Load-tests retrieval_server with load_generator at several concurrency levels, once with
+micro-batching disabled (max_batch_size=1, one encode call per request) and once with dynamic
+micro-batches. The server runs in its own process over a synthetic persona corpus and a stub
+encoder with a fixed per-call overhead plus a per-text cost, like a real model's forward pass.
+"""
+
+import asyncio
+import io
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+
+from stub_models import StubBagOfWordsEncoder, install_stub_modules, make_synthetic_corpus
+
+# The scripts import loaders that are not part of this repository; installed here at import
+# time so the spawned server process gets them too
+install_stub_modules()
+
+import load_generator
+from ann_index import create_index
+from retrieval_server import PersonaRetriever, RetrievalServer
+from retrieval_ranking import normalize_embeddings
+
+def _serve_stub(port_queue, num_personas, max_batch_size, max_wait_ms, latency, per_text_latency):
+    corpus = make_synthetic_corpus(num_personas)
+    personas = list(dict.fromkeys(corpus.get_column("input")))
+    model = StubBagOfWordsEncoder(dimension=384, latency=latency, per_text_latency=per_text_latency)
+    index = create_index("flat").build(normalize_embeddings(model.encode([f"Persona: {text}" for text in personas])))
+    server = RetrievalServer(PersonaRetriever(model.encode, personas, index), port=0, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    async def serve():
+        with redirect_stdout(io.StringIO()):
+            await server.start()
+        port_queue.put(server.port)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+def main():
+    """
+    Runs the retrieval server benchmark with predefined parameters.
+    """
+    # Configuration for the benchmark
+    num_personas = 20000
+    concurrency_levels = [1, 16, 64]
+    requests_per_level = 2000
+    latency = 0.005  # Per encode call
+    per_text_latency = 0.0002
+    configurations = [("no batching", 1, 0.0), ("micro-batching", 64, 2.0)]
+
+    queries = list(make_synthetic_corpus(num_personas).get_column("instruction"))
+    context = get_context("spawn")
+    for label, max_batch_size, max_wait_ms in configurations:
+        port_queue = context.Queue()
+        process = context.Process(
+            target=_serve_stub,
+            args=(port_queue, num_personas, max_batch_size, max_wait_ms, latency, per_text_latency),
+            daemon=True
+        )
+        process.start()
+        try:
+            port = port_queue.get(timeout=300)
+            print(f"{label} (max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms}):")
+            for concurrency in concurrency_levels:
+                report = asyncio.run(load_generator.run_load(
+                    "127.0.0.1", port, queries, concurrency=concurrency, num_requests=requests_per_level
+                ))
+                load_generator.print_report(report)
+        finally:
+            process.terminate()
+            process.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Retrieval Sweep Benchmark
+
+Compares evaluating every model in MODEL_MAPPINGS one after another with
+perform_retrieval_analysis (the dataset is re-read for each model) against perform_retrieval_sweep
+with one and several workers. Models are stub encoders whose per-text cost is proportional to the
+model's parameter count, so the sweep's schedule is exercised without downloading any weights.
+"""
+
+import io
+import os
+import tempfile
+import time
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest import mock
+
+from stub_models import StubBagOfWordsEncoder, StubDataset, install_stub_modules, make_synthetic_corpus
+
+# The scripts import loaders that are not part of this repository
+install_stub_modules()
+
+import input_instruction_retrieval
+import retrieval_sweep
+from model_mappings import MODEL_MAPPINGS, MODEL_PARAMETERS_MILLIONS, resolve_model_id
+
+# Simulated encode cost per text and million parameters; it is spent sleeping, like a process
+# waiting on an accelerator, so concurrent models overlap even on a single CPU core
+SECONDS_PER_TEXT_AND_MILLION_PARAMETERS = 5e-7
+
+def sized_stub_loader(model_name):
+    parameters = MODEL_PARAMETERS_MILLIONS.get(resolve_model_id(model_name), 110)
+    return StubBagOfWordsEncoder(per_text_latency=parameters * SECONDS_PER_TEXT_AND_MILLION_PARAMETERS)
+
+def read_jsonl_dataset(path):
+    import json
+    with open(path, "r", encoding="utf-8") as dataset_file:
+        rows = [json.loads(line) for line in dataset_file]
+    return StubDataset({name: [row[name] for row in rows] for name in rows[0]})
+
+def benchmark_sequential(model_names, dataset_path, directory):
+    patches = [
+        mock.patch.object(input_instruction_retrieval, "dataset_loader", SimpleNamespace(load=read_jsonl_dataset)),
+        mock.patch.object(input_instruction_retrieval, "model_loader", SimpleNamespace(load=sized_stub_loader)),
+        mock.patch.object(input_instruction_retrieval, "analysis_reporter", SimpleNamespace(save_results=lambda *args: None)),
+    ]
+    start = time.perf_counter()
+    for patch in patches:
+        patch.start()
+    try:
+        for model_name in model_names:
+            with redirect_stdout(io.StringIO()):
+                input_instruction_retrieval.perform_retrieval_analysis(
+                    model_name, model_name, dataset_path, directory, store_dir=f"{directory}/sequential_store"
+                )
+    finally:
+        for patch in patches:
+            patch.stop()
+    return time.perf_counter() - start
+
+def benchmark_sweep(model_names, dataset_path, directory, max_workers):
+    leaderboard = {}
+    patches = [
+        mock.patch.object(retrieval_sweep, "dataset_loader", SimpleNamespace(load=read_jsonl_dataset)),
+        mock.patch.object(retrieval_sweep, "analysis_reporter", SimpleNamespace(save_results=lambda data, *args: leaderboard.update(data))),
+    ]
+    for patch in patches:
+        patch.start()
+    try:
+        with redirect_stdout(io.StringIO()):
+            retrieval_sweep.perform_retrieval_sweep(
+                model_names, dataset_path, directory, max_workers=max_workers,
+                store_dir=f"{directory}/sweep_store_{max_workers}", loader=sized_stub_loader
+            )
+    finally:
+        for patch in patches:
+            patch.stop()
+    return leaderboard
+
+def main():
+    """
+    Runs the retrieval sweep benchmark with predefined parameters.
+    """
+    # Configuration for the benchmark
+    num_rows = 10000
+    worker_counts = [1, 4]
+    model_names = list(MODEL_MAPPINGS)
+
+    with tempfile.TemporaryDirectory() as directory:
+        dataset_path = os.path.join(directory, "dataset.jsonl")
+        make_synthetic_corpus(num_rows).save(dataset_path)
+
+        sequential_seconds = benchmark_sequential(model_names, dataset_path, directory)
+        print(f"Sequential perform_retrieval_analysis over {len(model_names)} models: {sequential_seconds:.1f}s")
+
+        for max_workers in worker_counts:
+            leaderboard = benchmark_sweep(model_names, dataset_path, directory, max_workers)
+            rows = leaderboard["leaderboard"]
+            slowest = max(row["total_seconds"] for row in rows)
+            peak = max(row["peak_rss_mib"] for row in rows)
+            print(
+                f"Sweep with {max_workers} workers: {leaderboard['wall_seconds']:.1f}s wall, "
+                f"{leaderboard['sum_of_model_seconds']:.1f}s summed over models, slowest model {slowest:.1f}s, "
+                f"largest worker peak RSS {peak:.0f} MiB"
+            )
+        retrieval_sweep.print_leaderboard(rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Benchmark Suite
+
+End-to-end performance baseline of the main scripts on synthetic persona/instruction corpora of
+several sizes. Dataset loaders, models and the language model API are replaced by the stubs from
+stub_models (project modules missing from the environment are registered as empty modules
+before the scripts are imported), so the suite runs offline on CPU. Each case runs in a fresh process so that peak
+memory is measured per case. Results are written as JSON (one record per case and size, plus
+git commit and environment) to compare runs across commits with compare_results.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from types import SimpleNamespace
+from unittest import mock
+
+from instrumentation import peak_rss_mib
+from stub_models import StubBagOfWordsEncoder, StubLanguageModelAPI, install_stub_modules, make_synthetic_corpus
+
+STUB_MODEL_NAME = "stub-bag-of-words"
+
+def stub_dataset_loader(dataset):
+    # Every loader entry point used by the scripts returns the synthetic dataset
+    return SimpleNamespace(load=lambda path: dataset, load_personas=lambda path: dataset)
+
+def stub_model_loader():
+    return SimpleNamespace(
+        load=lambda name: StubBagOfWordsEncoder(),
+        load_model=lambda name: StubBagOfWordsEncoder()
+    )
+
+def run_patched(patches, function, *args, **kwargs):
+    for patch in patches:
+        patch.start()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+
+def case_retrieval(dataset, work_dir):
+    import input_instruction_retrieval as module
+    results = {}
+    patches = [
+        mock.patch.object(module, "dataset_loader", stub_dataset_loader(dataset)),
+        mock.patch.object(module, "model_loader", stub_model_loader()),
+        mock.patch.object(module, "analysis_reporter", SimpleNamespace(save_results=lambda data, *args: results.update(data))),
+    ]
+    run_patched(
+        patches, module.perform_retrieval_analysis,
+        STUB_MODEL_NAME, STUB_MODEL_NAME, "synthetic", work_dir, store_dir=f"{work_dir}/embeddings"
+    )
+    return {"top_1_accuracy": results["Top-1 Accuracy"], "mrr": results["Mean Reciprocal Rank (MRR)"]}
+
+def case_classification(dataset, work_dir):
+    import data_classifier as module
+    patches = [
+        mock.patch.object(module, "dataset_loader", stub_dataset_loader(dataset)),
+        mock.patch.object(module, "embedding_generator", stub_model_loader()),
+    ]
+    run_patched(patches, module.classify_dataset, "synthetic", f"{work_dir}/classified.jsonl", mode="embedding", embedding_model_name=STUB_MODEL_NAME)
+    return {}
+
+def case_synthesis(dataset, work_dir):
+    import openai_synthesize as module
+    api = StubLanguageModelAPI(latency=0.0)
+    patches = [
+        mock.patch.object(module, "data_loader", stub_dataset_loader(dataset)),
+        mock.patch.object(module, "language_model_api", api),
+        mock.patch.object(module, "get_template_by_name", lambda name: "Persona: {persona}\nPredict a likely user prompt."),
+    ]
+    run_patched(patches, module.synthesize_data, "instruction", len(dataset), f"{work_dir}/synthetic.jsonl", resume=False)
+    return {"requests": api.calls}
+
+def case_tsne_plot(dataset, work_dir):
+    import tsne_plot_embeddings as module
+    patches = [
+        mock.patch.object(module, "data_loader", stub_dataset_loader(dataset)),
+        mock.patch.object(module, "embedding_generator", stub_model_loader()),
+    ]
+    run_patched(
+        patches, module.create_tsne_visualization,
+        "synthetic", STUB_MODEL_NAME, work_dir, "Instruct:", "Persona:",
+        show_class_colors=True, store_dir=f"{work_dir}/embeddings", scalable=True, max_points=10000,
+        graph_dir=None, render="density"
+    )
+    return {}
+
+def case_umap_plot(dataset, work_dir):
+    import umap_plot_embeddings as module
+    patches = [
+        mock.patch.object(module, "data_loader", stub_dataset_loader(dataset)),
+        mock.patch.object(module, "embedding_generator", stub_model_loader()),
+    ]
+    run_patched(
+        patches, module.create_umap_visualization,
+        "synthetic", STUB_MODEL_NAME, work_dir,
+        show_class_colors=True, store_dir=f"{work_dir}/embeddings", graph_dir=None, render="density"
+    )
+    return {}
+
+BENCHMARK_CASES = {
+    "retrieval": case_retrieval,
+    "classification": case_classification,
+    "synthesis": case_synthesis,
+    "tsne_plot": case_tsne_plot,
+    "umap_plot": case_umap_plot,
+}
+
+def run_case(case_name, num_rows, seed=0, warmup_rows=300):
+    """
+    Runs one case on a fresh synthetic corpus and returns its measurements.
+
+    The case first runs once on warmup_rows rows, so one-off costs of a new process (imports,
+    numba/JIT compilation in UMAP and t-SNE) are not counted; 0 disables the warm-up.
+    """
+    # Before any case imports its script
+    install_stub_modules()
+    if warmup_rows:
+        with tempfile.TemporaryDirectory() as work_dir:
+            BENCHMARK_CASES[case_name](make_synthetic_corpus(warmup_rows, seed=seed + 1), work_dir)
+
+    dataset = make_synthetic_corpus(num_rows, seed=seed)
+    with tempfile.TemporaryDirectory() as work_dir:
+        baseline_rss = peak_rss_mib()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        extra = BENCHMARK_CASES[case_name](dataset, work_dir)
+        seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.process_time() - cpu_start
+    return {
+        "case": case_name,
+        "rows": num_rows,
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds,
+        "rows_per_second": num_rows / seconds if seconds else 0.0,
+        "peak_rss_growth_mib": peak_rss_mib() - baseline_rss,
+        **extra
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(scales, output_directory="results/benchmarks", cases=None, warmup_rows=300):
+    """
+    Runs every case at every size listed for it and writes the results as JSON.
+
+    Args:
+        scales (dict): Case name to list of corpus sizes (rows)
+        output_directory (str): Directory receiving <timestamp>-<commit>.json
+        cases (list): Subset of case names to run, all in scales if None
+        warmup_rows (int): Size of the untimed warm-up run of every case
+
+    Returns:
+        str: Path of the results file
+    """
+    records = []
+    for case_name in cases or list(scales):
+        for num_rows in scales[case_name]:
+            # A fresh process per case: clean module state and a per-case peak RSS
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                record = pool.submit(run_case, case_name, num_rows, warmup_rows=warmup_rows).result()
+            print(json.dumps(record))
+            records.append(record)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": records
+    }
+    os.makedirs(output_directory, exist_ok=True)
+    output_path = os.path.join(output_directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'nocommit'}.json")
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Benchmark results saved to {output_path}.")
+    return output_path
+
+def compare_results(baseline_path, current_path, tolerance=0.1):
+    """
+    Prints the relative change in seconds of every (case, rows) pair present in both result files
+    and returns the pairs that got slower by more than tolerance.
+    """
+    def load(path):
+        with open(path, "r", encoding="utf-8") as results_file:
+            return {(record["case"], record["rows"]): record for record in json.load(results_file)["results"]}
+
+    baseline, current = load(baseline_path), load(current_path)
+    regressions = []
+    print(f"{'Case':<16} | {'Rows':>7} | {'Before s':>8} | {'After s':>8} | {'Change':>7}")
+    print("-" * 60)
+    for key in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[key]["seconds"], current[key]["seconds"]
+        change = after / before - 1.0 if before else 0.0
+        print(f"{key[0]:<16} | {key[1]:>7} | {before:>8.2f} | {after:>8.2f} | {change:>+6.1%}")
+        if change > tolerance:
+            regressions.append(key)
+    return regressions
+
+def main():
+    """
+    Runs the benchmark suite with predefined parameters.
+    """
+    # Corpus sizes per case; synthesis and plotting are slower per row
+    scales = {
+        "retrieval": [1000, 10000, 50000],
+        "classification": [1000, 10000, 50000],
+        "synthesis": [1000, 10000],
+        "tsne_plot": [1000, 10000],
+        "umap_plot": [1000, 10000],
+    }
+    run_suite(scales)
+
+if __name__ == "__main__":
+    main()
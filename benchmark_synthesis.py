@@ -0,0 +1,120 @@
+"""
+Synthesis Benchmark
+
+Compares the sequential synthesis loop against the concurrent engine on a stub language model
+with artificial latency, and reports the achieved requests per second. Also reports the wall
+time per dialog of serial versus concurrent multi-turn dialog generation.
+"""
+
+import asyncio
+import time
+
+from stub_models import StubLanguageModelAPI, install_stub_modules
+
+# The scripts import loaders that are not part of this repository
+install_stub_modules()
+
+from concurrent_synthesis import AsyncLanguageModelClient
+from openai_synthesize import generate_dialogs_for_persona, synthesize_record, synthesize_records_async
+
+BENCHMARK_TEMPLATE = "Persona: {persona}\nPredict a likely user prompt."
+
+def make_personas(num_personas):
+    """
+    Creates simple synthetic persona texts.
+    """
+    return [f"Persona number {i} who enjoys topic {i % 17}." for i in range(num_personas)]
+
+def benchmark_sequential(persona_texts, latency):
+    """
+    Times the sequential synthesis loop and returns requests per second.
+    """
+    api = StubLanguageModelAPI(latency=latency)
+    start = time.perf_counter()
+    for persona_text in persona_texts:
+        synthesize_record(persona_text, "instruction", BENCHMARK_TEMPLATE, api=api)
+    elapsed = time.perf_counter() - start
+    return {"mode": "sequential", "requests": api.calls, "seconds": elapsed, "requests_per_second": api.calls / elapsed}
+
+def benchmark_concurrent(persona_texts, latency, max_in_flight, ordered=True):
+    """
+    Times the concurrent engine and returns requests per second.
+    """
+    api = StubLanguageModelAPI(latency=latency)
+    client = AsyncLanguageModelClient(api, max_in_flight=max_in_flight)
+
+    async def run():
+        records = synthesize_records_async(
+            persona_texts, "instruction", BENCHMARK_TEMPLATE, client, max_in_flight, ordered
+        )
+        return [result async for _, result in records]
+
+    start = time.perf_counter()
+    try:
+        asyncio.run(run())
+    finally:
+        client.close()
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": f"concurrent (max_in_flight={max_in_flight}, ordered={ordered})",
+        "requests": api.calls,
+        "seconds": elapsed,
+        "requests_per_second": api.calls / elapsed
+    }
+
+def benchmark_dialogs(persona_text, num_dialogs, max_turns, latency, max_workers=None, max_history_tokens=None):
+    """
+    Times dialog generation for one persona and returns the wall time per dialog.
+    """
+    api = StubLanguageModelAPI(latency=latency)
+    start = time.perf_counter()
+    generate_dialogs_for_persona(
+        persona_text,
+        num_dialogs=num_dialogs,
+        max_turns=max_turns,
+        api=api,
+        max_history_tokens=max_history_tokens,
+        max_workers=max_workers
+    )
+    elapsed = time.perf_counter() - start
+    return {"turns": max_turns, "requests": api.calls, "seconds_per_dialog": elapsed / num_dialogs}
+
+def main():
+    """
+    Runs the synthesis throughput comparison with predefined parameters.
+    """
+    # Configuration for the benchmark
+    num_personas = 200
+    latency = 0.05  # Seconds per simulated request
+    in_flight_limits = [8, 32, 64]
+
+    persona_texts = make_personas(num_personas)
+    results = [benchmark_sequential(persona_texts, latency)]
+    for max_in_flight in in_flight_limits:
+        results.append(benchmark_concurrent(persona_texts, latency, max_in_flight))
+    results.append(benchmark_concurrent(persona_texts, latency, in_flight_limits[-1], ordered=False))
+
+    baseline = results[0]["requests_per_second"]
+    print(f"{'Mode':<45} | {'Req/s':>8} | {'Speedup':>7}")
+    print("-" * 67)
+    for result in results:
+        speedup = result["requests_per_second"] / baseline
+        print(f"{result['mode']:<45} | {result['requests_per_second']:>8.1f} | {speedup:>6.1f}x")
+
+    # Dialog generation: serial dialogs versus all dialogs of a persona advancing together
+    num_dialogs = 8
+    dialog_latency = 0.02
+    print()
+    print(f"{'Turns':>5} | {'Serial s/dialog':>15} | {'Parallel s/dialog':>17} | {'Speedup':>7}")
+    print("-" * 54)
+    for max_turns in [4, 8, 16]:
+        serial = benchmark_dialogs(persona_texts[0], num_dialogs, max_turns, dialog_latency, max_workers=1)
+        parallel = benchmark_dialogs(persona_texts[0], num_dialogs, max_turns, dialog_latency, max_history_tokens=512)
+        speedup = serial["seconds_per_dialog"] / parallel["seconds_per_dialog"]
+        print(
+            f"{max_turns:>5} | {serial['seconds_per_dialog']:>15.3f} | "
+            f"{parallel['seconds_per_dialog']:>17.3f} | {speedup:>6.1f}x"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Training Benchmark
+
+Measures peak RSS and samples per second of one contrastive training step at several effective
+batch sizes, with the standard in-batch-negative loss and with the gradient-cached loss. Each
+configuration runs in a fresh process so that peak RSS is not shared between them.
+"""
+
+import json
+import multiprocessing
+import resource
+import time
+
+import torch
+from torch import nn
+
+from gradient_cached_loss import GradientCachedContrastiveLoss
+
+class StubSentenceEncoder(nn.Module):
+    """
+    Small Transformer encoder returning mean-pooled sentence embeddings, used as a stand-in for
+    a Sentence Transformer model.
+    """
+
+    def __init__(self, vocab_size=30000, dimension=128, num_layers=2):
+        super().__init__()
+        self.embeddings = nn.Embedding(vocab_size, dimension)
+        layer = nn.TransformerEncoderLayer(dimension, nhead=4, dim_feedforward=4 * dimension, batch_first=True)
+        self.encoder = nn.TransformerEncoder(layer, num_layers)
+
+    def forward(self, features):
+        hidden = self.encoder(self.embeddings(features["input_ids"]))
+        return {"sentence_embedding": hidden.mean(dim=1)}
+
+def make_batch(batch_size, sequence_length, seed):
+    """
+    Creates random (anchor, positive) token batches.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    return [
+        {"input_ids": torch.randint(0, 30000, (batch_size, sequence_length), generator=generator)}
+        for _ in range(2)
+    ]
+
+def run_configuration(batch_size, mini_batch_size, sequence_length, steps, queue):
+    """
+    Runs a few training steps and reports samples/sec and peak RSS through the queue.
+    """
+    torch.manual_seed(0)
+    torch.set_num_threads(1)
+    model = StubSentenceEncoder()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    loss_function = GradientCachedContrastiveLoss(model, mini_batch_size=mini_batch_size or batch_size)
+
+    start = time.perf_counter()
+    for step in range(steps):
+        features = make_batch(batch_size, sequence_length, step)
+        optimizer.zero_grad()
+        if mini_batch_size:
+            loss = loss_function(features)
+        else:
+            # Standard path: the whole batch is encoded with its autograd graph
+            anchors, positives = (model(batch)["sentence_embedding"] for batch in features)
+            loss = loss_function.contrastive_loss(anchors, positives)
+        loss.backward()
+        optimizer.step()
+    elapsed = time.perf_counter() - start
+
+    queue.put({
+        "loss": "gradient cached" if mini_batch_size else "standard",
+        "batch_size": batch_size,
+        "mini_batch_size": mini_batch_size,
+        "samples_per_second": steps * batch_size / elapsed,
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    })
+
+def main():
+    """
+    Runs the training memory/throughput comparison with predefined parameters.
+    """
+    # Configuration for the benchmark
+    batch_sizes = [64, 256, 1024]
+    mini_batch_size = 32
+    sequence_length = 32
+    steps = 1
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for batch_size in batch_sizes:
+        for chunk_size in (None, mini_batch_size):
+            queue = context.Queue()
+            process = context.Process(target=run_configuration, args=(batch_size, chunk_size, sequence_length, steps, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+
+    print(f"{'Loss':<16} | {'Batch':>5} | {'Samples/s':>9} | {'Peak RSS MiB':>12}")
+    print("-" * 52)
+    for result in results:
+        print(
+            f"{result['loss']:<16} | {result['batch_size']:>5} | "
+            f"{result['samples_per_second']:>9.1f} | {result['peak_rss_mib']:>12.0f}"
+        )
+    print(json.dumps(results))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+t-SNE Benchmark
+
+Times t-SNE on synthetic clustered embeddings at 10k, 100k and 1M points: the current path
+(scikit-learn t-SNE on the raw embeddings, only at the smallest size) against the scalable path
+(PCA to 50 dimensions, approximate kNN, FFT gradients, all cores), embedding either every point
+or a stratified subsample with the rest placed out of sample.
+"""
+
+import json
+import time
+
+import numpy as np
+
+from scalable_tsne import run_tsne, scalable_tsne
+
+def make_embeddings(num_points, dimension=384, num_classes=20, seed=0):
+    """
+    Clustered unit-length embeddings with a class label per point.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_classes, dimension)).astype(np.float32)
+    labels = rng.integers(0, num_classes, num_points)
+    embeddings = np.empty((num_points, dimension), dtype=np.float32)
+    for start in range(0, num_points, 100000):
+        end = min(start + 100000, num_points)
+        block = centers[labels[start:end]] + 1.5 * rng.standard_normal((end - start, dimension), dtype=np.float32)
+        embeddings[start:end] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return embeddings, labels
+
+def benchmark_exact(embeddings):
+    """
+    scikit-learn Barnes-Hut t-SNE on the full-dimensional embeddings, as reduce_with_tsne runs it.
+    """
+    from sklearn.manifold import TSNE
+    start = time.perf_counter()
+    TSNE(n_components=2, init="pca", random_state=0).fit_transform(embeddings)
+    return {"total_seconds": time.perf_counter() - start}
+
+def benchmark_scalable(embeddings, labels, max_points=None):
+    start = time.perf_counter()
+    _, timings = scalable_tsne(embeddings, labels=labels, max_points=max_points)
+    timings["total_seconds"] = time.perf_counter() - start
+    return timings
+
+def main():
+    """
+    Runs the t-SNE benchmark with predefined parameters.
+    """
+    # Configuration for the benchmark: (points, mode, subsample size)
+    configurations = [
+        (10000, "exact", None),
+        (10000, "scalable", None),
+        (100000, "scalable", None),
+        (100000, "scalable", 20000),
+        (1000000, "scalable", 100000),
+    ]
+
+    results = []
+    for num_points, mode, max_points in configurations:
+        embeddings, labels = make_embeddings(num_points)
+        run_tsne(embeddings[:200, :50])  # Warm up numba/FFT compilation outside the timings
+        if mode == "exact":
+            timings = benchmark_exact(embeddings)
+        else:
+            timings = benchmark_scalable(embeddings, labels, max_points)
+        result = {"points": num_points, "mode": mode, "max_points": max_points, **timings}
+        print(json.dumps(result))
+        results.append(result)
+
+    print(f"{'Points':>8} | {'Mode':<9} | {'Subsample':>9} | {'PCA s':>6} | {'t-SNE s':>8} | {'Place s':>7} | {'Total s':>8}")
+    print("-" * 75)
+    for result in results:
+        print(
+            f"{result['points']:>8} | {result['mode']:<9} | {str(result['max_points'] or '-'):>9} | "
+            f"{result.get('pca_seconds', 0.0):>6.1f} | {result.get('tsne_seconds', 0.0):>8.1f} | "
+            f"{result.get('placement_seconds', 0.0):>7.1f} | {result['total_seconds']:>8.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
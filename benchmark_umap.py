@@ -0,0 +1,60 @@
+"""
+UMAP Layout Benchmark
+
+Compares refitting UMAP on the whole corpus with projecting only a batch of new points into a
+saved layout, and times scalable t-SNE with and without the kNN graph cached by the UMAP fit.
+"""
+
+import tempfile
+import time
+
+from benchmark_tsne import make_embeddings
+from embedding_store import text_hashes
+from knn_graph import embeddings_fingerprint, load_knn_graph
+from scalable_tsne import perplexity_neighbors, scalable_tsne
+from umap_layout import UmapLayout
+
+def main():
+    """
+    Runs the UMAP layout benchmark with predefined parameters.
+    """
+    # Configuration for the benchmark
+    num_existing = 50000
+    num_new = 5000
+
+    embeddings, _ = make_embeddings(num_existing + num_new)
+    keys = text_hashes([f"text {i}" for i in range(len(embeddings))])
+    existing = slice(0, num_existing)
+
+    # Warm up numba compilation of fit and transform outside the timings
+    UmapLayout.fit(embeddings[:2000], keys[:2000], graph_dir=None).update(embeddings[2000:2100], keys[2000:2100])
+
+    with tempfile.TemporaryDirectory() as directory:
+        graph_dir = f"{directory}/knn"
+        layout = UmapLayout.fit(embeddings[existing], keys[existing], graph_dir=graph_dir)
+        layout.save(f"{directory}/layout")
+        print(f"Initial fit on {num_existing} points: {layout.fit_seconds:.1f}s")
+
+        # A later run: the saved layout plus num_new new points
+        start = time.perf_counter()
+        layout = UmapLayout.load(f"{directory}/layout")
+        _, projected = layout.update(embeddings, keys)
+        update_seconds = time.perf_counter() - start
+        print(f"Load + transform of {projected} new points: {update_seconds:.1f}s (transform {layout.transform_seconds:.1f}s)")
+
+        refit = UmapLayout.fit(embeddings, keys, graph_dir=None)
+        print(f"Refit on all {len(embeddings)} points: {refit.fit_seconds:.1f}s")
+
+        # t-SNE on the points of the first fit, with and without the graph UMAP cached
+        graph = load_knn_graph(embeddings_fingerprint(embeddings[existing]), perplexity_neighbors(), graph_dir)
+        if graph is None:
+            raise RuntimeError(f"The UMAP fit cached no graph with {perplexity_neighbors()} neighbours in {graph_dir}.")
+        start = time.perf_counter()
+        scalable_tsne(embeddings[existing])
+        print(f"Scalable t-SNE with its own neighbour search: {time.perf_counter() - start:.1f}s")
+        start = time.perf_counter()
+        scalable_tsne(embeddings[existing], knn_graph=graph)
+        print(f"Scalable t-SNE with the graph cached by UMAP: {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+User Embedding Benchmark
+
+Streams synthetic dialogs of 100k users turn by turn into a UserEmbeddingStore and compares the
+incremental update (embed only the new user turn) against re-embedding each user's whole history
+on every turn. Reports single-update latency percentiles, batched update throughput and memory
+per 100k users. The encoder is a stub with a fixed per-call and per-text cost, so the numbers
+reflect the number of texts encoded rather than a particular model.
+"""
+
+import random
+import time
+
+import numpy as np
+
+from stub_models import StubEmbeddingModel
+from user_embeddings import DialogUserEncoder, UserEmbeddingStore
+
+def make_dialogs(num_users, user_turns, seed=0):
+    """Full {"speaker", "message"} turn lists per user, alternating user and assistant."""
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    dialogs = {}
+    for user in range(num_users):
+        turns = []
+        for _ in range(user_turns):
+            turns.append({"speaker": "user", "message": " ".join(rng.choices(vocabulary, k=rng.randint(5, 20)))})
+            turns.append({"speaker": "assistant", "message": "ok"})
+        dialogs[f"user-{user}"] = turns
+    return dialogs
+
+def percentiles(seconds):
+    return np.percentile(np.array(seconds) * 1000, 50), np.percentile(np.array(seconds) * 1000, 99)
+
+def main():
+    """
+    Runs the user embedding benchmark with predefined parameters.
+    """
+    # Configuration for the benchmark
+    num_users = 100000
+    user_turns = 4
+    dimension = 384
+    batch_size = 1024
+    latency_samples = 2000
+    latency_history_turns = 20  # User turns per dialog in the latency comparison
+    decay = 0.8
+
+    dialogs = make_dialogs(num_users, user_turns)
+    user_ids = list(dialogs)
+    model = StubEmbeddingModel(dimension, latency=0.002, per_text_latency=0.0001)
+
+    # --- Batched streaming: every round each user's dialog grows by one user turn ---
+    store = UserEmbeddingStore(dimension, decay=decay)
+    encoder = DialogUserEncoder(model.encode, store)
+    start = time.perf_counter()
+    for turn in range(1, user_turns + 1):
+        for batch_start in range(0, num_users, batch_size):
+            batch = [(user_id, 0, dialogs[user_id][:2 * turn]) for user_id in user_ids[batch_start:batch_start + batch_size]]
+            encoder.consume(batch)
+    streaming_seconds = time.perf_counter() - start
+    print(
+        f"Batched incremental updates: {encoder.turns_encoded} turns of {num_users} users in {streaming_seconds:.1f}s "
+        f"({encoder.turns_encoded / streaming_seconds:.0f} updates/s)"
+    )
+
+    # Pool arithmetic alone, without the encoder
+    turn_embeddings = np.random.default_rng(0).standard_normal((batch_size, dimension)).astype(np.float32)
+    pool_start = time.perf_counter()
+    for batch_start in range(0, num_users, batch_size):
+        batch_ids = user_ids[batch_start:batch_start + batch_size]
+        store.update(batch_ids, turn_embeddings[:len(batch_ids)])
+    update_seconds = time.perf_counter() - pool_start
+    print(f"Store update without encoding: {num_users / update_seconds:.0f} updates/s")
+
+    # --- Single-user update latency: one new turn vs the whole history ---
+    long_dialogs = make_dialogs(latency_samples, latency_history_turns, seed=1)
+    sample = list(long_dialogs)
+    incremental_seconds, full_seconds = [], []
+    latency_store = UserEmbeddingStore(dimension, decay=decay)
+    latency_encoder = DialogUserEncoder(model.encode, latency_store)
+    latency_encoder.consume([(user_id, 0, long_dialogs[user_id][:-2]) for user_id in sample])
+    for user_id in sample:
+        start = time.perf_counter()
+        latency_encoder.consume([(user_id, 0, long_dialogs[user_id])])
+        incremental_seconds.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        history = [turn["message"] for turn in long_dialogs[user_id] if turn["speaker"] == "user"]
+        embeddings = model.encode(history)
+        weights = decay ** np.arange(len(history) - 1, -1, -1, dtype=np.float32)
+        pooled = weights @ embeddings / weights.sum()
+        pooled /= np.linalg.norm(pooled)
+        full_seconds.append(time.perf_counter() - start)
+    incremental_p50, incremental_p99 = percentiles(incremental_seconds)
+    full_p50, full_p99 = percentiles(full_seconds)
+    print(f"Single update, new turn only (turn {latency_history_turns}): p50 {incremental_p50:.2f} ms, p99 {incremental_p99:.2f} ms")
+    print(f"Single update, re-embed {latency_history_turns}-turn history: p50 {full_p50:.2f} ms, p99 {full_p99:.2f} ms")
+
+    # The incremental pool equals the decayed mean over the full history
+    agreement = float(np.sum(latency_store.get([sample[-1]])[0] * pooled))
+    print(f"Cosine between incremental and full-history embedding: {agreement:.6f}")
+
+    # --- Memory per 100k users ---
+    scale = 100000 / num_users
+    half_store = UserEmbeddingStore(dimension, decay=decay, dtype=np.float16)
+    half_store.rows(user_ids)
+    history_bytes = encoder.turns_encoded * dimension * 4
+    print(f"Memory per 100k users: float32 store {store.memory_bytes * scale / 1024 ** 2:.1f} MiB, "
+          f"float16 store {half_store.memory_bytes * scale / 1024 ** 2:.1f} MiB, "
+          f"float32 turn history ({user_turns} turns) {history_bytes * scale / 1024 ** 2:.1f} MiB")
+
+if __name__ == "__main__":
+    main()
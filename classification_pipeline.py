@@ -0,0 +1,212 @@
+"""
+Classification Pipeline
+
+Streaming variant of data_classifier: the dataset is read in chunks, chunks are classified on a
+pool of worker processes or threads, and every labelled chunk is written as its own JSONL shard
+as soon as it completes. Finished shards are skipped on restart, so an interrupted run resumes
+where it stopped, and at most a bounded number of chunks is held in memory at any time.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import dataset_loader
+import embedding_generator
+from data_classifier import (
+    classification_labels,
+    classify_column_with_embeddings,
+    classify_column_with_prompts,
+    load_classification_model
+)
+from embedding_classifier import EmbeddingZeroShotClassifier
+from model_mappings import checkpoint_fingerprint, load_model, resolve_model_id
+
+# Classifier of the current worker process (or shared by all worker threads)
+_worker_state = {}
+
+def _init_worker(mode, model_name, embedding_model_name, batch_size, threshold, encode_backend="torch"):
+    """
+    Loads the classifier once per worker.
+    """
+    _worker_state["mode"] = mode
+    _worker_state["batch_size"] = batch_size
+    if mode == "prompt":
+        _worker_state["model"] = load_classification_model(model_name)
+    elif mode == "embedding":
+        embedding_model = load_model(embedding_model_name, embedding_generator.load_model, encode_backend)
+        _worker_state["classifier"] = EmbeddingZeroShotClassifier(
+            embedding_model.encode, classification_labels, threshold=threshold
+        )
+    else:
+        raise ValueError(f"Unknown classification mode: {mode}. Use 'prompt' or 'embedding'.")
+
+def shard_path(shard_directory, shard_index):
+    return os.path.join(shard_directory, f"shard-{shard_index:05d}.jsonl")
+
+def _classify_chunk(shard_index, instruction_texts, input_texts, output_path):
+    """
+    Classifies one chunk and writes it as a shard. The shard only appears under its final name
+    once it is complete, so a crash never leaves a partial shard behind.
+    """
+    if _worker_state["mode"] == "prompt":
+        model = _worker_state["model"]
+        instruction_classes = classify_column_with_prompts(instruction_texts, classification_labels, model)
+        input_classes = classify_column_with_prompts(input_texts, classification_labels, model)
+    else:
+        classifier = _worker_state["classifier"]
+        batch_size = _worker_state["batch_size"]
+        instruction_classes = classify_column_with_embeddings(instruction_texts, classifier, batch_size)
+        input_classes = classify_column_with_embeddings(input_texts, classifier, batch_size)
+
+    temporary_path = f"{output_path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as shard_file:
+        for row in zip(instruction_texts, input_texts, instruction_classes, input_classes):
+            record = dict(zip(("instruction", "input", "instruction_class", "input_class"), row))
+            shard_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        shard_file.flush()
+        os.fsync(shard_file.fileno())
+    os.replace(temporary_path, output_path)
+    return shard_index, len(instruction_texts)
+
+def _run_config(source_path, num_rows, chunk_size, mode, model_name, embedding_model_name, threshold, encode_backend):
+    # Everything that changes the labels of a shard, so finished shards are never mixed with new ones
+    config = {"source_path": source_path, "num_rows": num_rows, "chunk_size": chunk_size, "mode": mode}
+    if mode == "prompt":
+        config["model_name"] = model_name
+    else:
+        config.update({
+            "embedding_model": resolve_model_id(embedding_model_name),
+            "checkpoint_fingerprint": checkpoint_fingerprint(embedding_model_name),
+            "threshold": threshold,
+            "encode_backend": encode_backend
+        })
+    return config
+
+def _check_run_config(shard_directory, config):
+    # Shards are only reusable if they were cut from the same source with the same chunk size
+    # and labelled by the same classifier
+    config_path = os.path.join(shard_directory, "pipeline.json")
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as config_file:
+            previous = json.load(config_file)
+        if previous != config:
+            raise ValueError(
+                f"Shards in '{shard_directory}' were written with {previous}, not {config}; use a new directory."
+            )
+    else:
+        with open(config_path, "w", encoding="utf-8") as config_file:
+            json.dump(config, config_file)
+
+def run_classification_pipeline(
+    source_path,
+    shard_directory,
+    mode="embedding",
+    chunk_size=10000,
+    num_workers=4,
+    executor="process",
+    model_name="some-model-name",
+    embedding_model_name="all-mpnet-base-v2",
+    batch_size=256,
+    threshold=None,
+    encode_backend="torch"
+):
+    """
+    Classifies a dataset chunk by chunk on a worker pool, writing one labelled shard per chunk.
+
+    At most 2 * num_workers chunks are read ahead of the workers, so peak memory is bounded by
+    chunk_size rather than dataset size. Shards that already exist are skipped; resuming is refused
+    if they were written with another source, chunk size, mode, model or threshold.
+
+    Args:
+        source_path (str): Dataset with "instruction" and "input" columns
+        shard_directory (str): Directory receiving shard-XXXXX.jsonl files
+        mode (str): "embedding" or "prompt", as in data_classifier.classify_dataset
+        chunk_size (int): Rows per chunk and shard
+        num_workers (int): Number of worker processes or threads
+        executor (str): "process" or "thread"
+        model_name (str): Generative model for the prompt mode
+        embedding_model_name (str): Embedding model for the embedding mode
+        batch_size (int): Texts per encode call in the embedding mode
+        threshold (float): Optional "Other" threshold for the embedding mode
+        encode_backend (str): "torch", "onnx" or "onnx-int8" for the embedding mode
+
+    Returns:
+        dict: Rows classified in this run, shards skipped and elapsed seconds
+    """
+    os.makedirs(shard_directory, exist_ok=True)
+    dataset = dataset_loader.load(source_path)
+    num_rows = len(dataset)
+    num_shards = (num_rows + chunk_size - 1) // chunk_size
+    _check_run_config(shard_directory, _run_config(
+        source_path, num_rows, chunk_size, mode, model_name, embedding_model_name, threshold, encode_backend
+    ))
+
+    pending_shards = [i for i in range(num_shards) if not os.path.exists(shard_path(shard_directory, i))]
+    skipped = num_shards - len(pending_shards)
+    print(f"Classifying {len(pending_shards)} of {num_shards} shards ({skipped} already done).")
+
+    initargs = (mode, model_name, embedding_model_name, batch_size, threshold, encode_backend)
+    if executor == "process":
+        pool = ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=initargs)
+    elif executor == "thread":
+        # Threads share a single classifier
+        _init_worker(*initargs)
+        pool = ThreadPoolExecutor(max_workers=num_workers)
+    else:
+        raise ValueError(f"Unknown executor: {executor}. Use 'process' or 'thread'.")
+
+    start = time.perf_counter()
+    rows_classified = 0
+    in_flight = set()
+    with pool:
+        for shard_index in pending_shards:
+            if len(in_flight) >= 2 * num_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                rows_classified += sum(future.result()[1] for future in done)
+
+            chunk = dataset.select(range(shard_index * chunk_size, min((shard_index + 1) * chunk_size, num_rows)))
+            in_flight.add(pool.submit(
+                _classify_chunk,
+                shard_index,
+                list(chunk.get_column("instruction")),
+                list(chunk.get_column("input")),
+                shard_path(shard_directory, shard_index)
+            ))
+
+        for future in wait(in_flight).done:
+            rows_classified += future.result()[1]
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Classification complete: {rows_classified} rows in {elapsed:.1f}s "
+        f"({rows_classified / elapsed if elapsed else 0.0:.1f} rows/s). Shards saved to {shard_directory}."
+    )
+    return {"rows_classified": rows_classified, "shards_skipped": skipped, "seconds": elapsed}
+
+def iter_labelled_rows(shard_directory):
+    """
+    Yields the labelled rows of all shards in dataset order, one at a time.
+    """
+    shard_names = sorted(name for name in os.listdir(shard_directory) if name.startswith("shard-") and name.endswith(".jsonl"))
+    for name in shard_names:
+        with open(os.path.join(shard_directory, name), "r", encoding="utf-8") as shard_file:
+            for line in shard_file:
+                yield json.loads(line)
+
+def main():
+    """
+    Main function to configure and run the pipelined classification.
+    """
+    # Specify dataset paths
+    source_path = "path/to/source/dataset"
+    shard_directory = "path/to/destination/shards"
+    encode_backend = "torch"  # "onnx-int8" to embed with the quantized ONNX Runtime backend
+
+    run_classification_pipeline(
+        source_path, shard_directory, mode="embedding", chunk_size=10000, num_workers=8, encode_backend=encode_backend
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Concurrent Synthesis
+
+Asyncio building blocks for running many language model requests at once: a token bucket
+rate limiter, a retrying client wrapped around the blocking language model API, and a helper
+that drives a coroutine over a stream of items with a bounded number of tasks in flight.
+"""
+
+import asyncio
+import functools
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from response_cache import CachedLanguageModelAPI, sample_api
+
+
+def estimate_tokens(text):
+    """
+    Roughly estimate the number of tokens in a text (about four characters per token).
+
+    Args:
+        text (str): Text to estimate
+
+    Returns:
+        int: Estimated token count
+    """
+    return max(1, len(text) // 4)
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    """
+    Exponential backoff with full jitter for the given (0-based) retry attempt.
+
+    Args:
+        attempt (int): Number of failed attempts so far, minus one
+        base_delay (float): Delay in seconds for the first retry
+        max_delay (float): Upper bound on the delay in seconds
+
+    Returns:
+        float: Seconds to wait before retrying
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class RateLimiter:
+    """
+    Token bucket limiter for requests per minute and (estimated) tokens per minute.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._available_requests = float(requests_per_minute or 0)
+        self._available_tokens = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60.0
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._available_requests = min(
+                self.requests_per_minute,
+                self._available_requests + elapsed_minutes * self.requests_per_minute
+            )
+        if self.tokens_per_minute:
+            self._available_tokens = min(
+                self.tokens_per_minute,
+                self._available_tokens + elapsed_minutes * self.tokens_per_minute
+            )
+
+    def _seconds_until_available(self, tokens):
+        wait = 0.0
+        if self.requests_per_minute and self._available_requests < 1:
+            wait = max(wait, (1 - self._available_requests) * 60.0 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            # A single request larger than the bucket only has to wait for a full bucket
+            needed = min(tokens, self.tokens_per_minute)
+            if self._available_tokens < needed:
+                wait = max(wait, (needed - self._available_tokens) * 60.0 / self.tokens_per_minute)
+        return wait
+
+    async def acquire(self, tokens=1):
+        """
+        Wait until one request and the given number of tokens fit into the budget.
+        """
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return
+
+        # Waiters are served one at a time so a large request cannot be starved
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._seconds_until_available(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.requests_per_minute:
+                self._available_requests -= 1
+            if self.tokens_per_minute:
+                self._available_tokens -= min(tokens, self.tokens_per_minute)
+
+
+class AsyncLanguageModelClient:
+    """
+    Awaitable wrapper around a blocking language model API module.
+
+    Calls run on a thread pool, at most max_in_flight at a time, go through the optional rate
+    limiter and are retried with jittered exponential backoff when they raise. Requests answered
+    by a CachedLanguageModelAPI's cache return right away and only count as cache_hits.
+    """
+
+    def __init__(
+        self,
+        api,
+        max_in_flight=16,
+        rate_limiter=None,
+        max_retries=5,
+        base_delay=1.0,
+        max_delay=60.0
+    ):
+        self.api = api
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests_completed = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    async def generate_response(self, prompt, sample_index=None, template_name=None, **kwargs):
+        """
+        Awaitable counterpart of language_model_api.generate_response.
+
+        sample_index keeps cached responses of repeated identical requests apart; template_name
+        names the template the prompt was rendered from in the cache key.
+        """
+        api = sample_api(self.api, sample_index, template_name)
+        return await self._request(api, "generate_response", prompt, estimate_tokens(prompt), kwargs)
+
+    async def generate_conversation_response(self, dialog_history, sample_index=None, **kwargs):
+        """
+        Awaitable counterpart of language_model_api.generate_conversation_response.
+        """
+        api = sample_api(self.api, sample_index)
+        tokens = sum(estimate_tokens(turn["message"]) for turn in dialog_history)
+        return await self._request(api, "generate_conversation_response", dialog_history, tokens, kwargs)
+
+    async def _request(self, api, method, request, tokens, kwargs):
+        if not isinstance(api, CachedLanguageModelAPI):
+            return await self._call(functools.partial(getattr(api, method), request, **kwargs), tokens)
+        # The cache is checked before the rate limiter and the in-flight limit, so hits cost neither
+        key, response = api.lookup(method, request, kwargs)
+        if response is not None:
+            self.cache_hits += 1
+            return response
+        return await self._call(functools.partial(api.fetch, method, key, request, kwargs), tokens)
+
+    async def _call(self, call, tokens):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter:
+                await self.rate_limiter.acquire(tokens)
+            async with self._semaphore:
+                try:
+                    response = await loop.run_in_executor(self._executor, call)
+                    self.requests_completed += 1
+                    return response
+                except Exception as error:
+                    if attempt == self.max_retries:
+                        raise
+                    print(f"Request failed ({error!r}), retrying ({attempt + 1}/{self.max_retries})...")
+            self.retries += 1
+            await asyncio.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+
+    def close(self):
+        """Shut down the worker threads."""
+        self._executor.shutdown(wait=False)
+
+
+async def iterate_concurrently(items, worker, concurrency, ordered=True):
+    """
+    Run an async worker over items with at most `concurrency` tasks alive at once.
+
+    Items are pulled lazily from the iterable, so arbitrarily long inputs never create more
+    than a bounded number of tasks.
+
+    Args:
+        items (iterable): Inputs passed one at a time to the worker
+        worker (callable): Coroutine function taking a single item
+        concurrency (int): Maximum number of worker tasks running at once
+        ordered (bool): Yield results in input order instead of completion order
+
+    Yields:
+        tuple: (index, result) pairs
+    """
+    iterator = enumerate(items)
+    exhausted = False
+    pending = {}
+    buffered = {}
+    next_index = 0
+    # In ordered mode a slow head item holds back completed results, so the buffer counts
+    # towards the window to keep memory bounded
+    window = 2 * concurrency if ordered else concurrency
+
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency and len(pending) + len(buffered) < window:
+                try:
+                    index, item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[asyncio.ensure_future(worker(item))] = index
+
+            if not pending:
+                break
+
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = pending.pop(task)
+                result = task.result()
+                if ordered:
+                    buffered[index] = result
+                else:
+                    yield index, result
+
+            while next_index in buffered:
+                yield next_index, buffered.pop(next_index)
+                next_index += 1
+    finally:
+        for task in pending:
+            task.cancel()
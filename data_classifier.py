@@ -1,68 +1,135 @@
 import model_loader
 import dataset_loader
+import embedding_generator
+from embedding_classifier import EmbeddingZeroShotClassifier
+from instrumentation import profile_run, span
+from model_mappings import load_model
 
-# Load a pre-trained language model for classification
-model, tokenizer = model_loader.load_language_model("some-model-name")
+# Define the categories for classification
+classification_labels = [
+    "Business & Finance", "Computers & Internet", "Education & Reference",
+    "Entertainment & Music", "Family & Relationships", "Health",
+    "Politics & Government", "Science & Mathematics", "Society & Culture",
+    "Sports", "Other"
+]
+
+def load_classification_model(model_name="some-model-name"):
+    """
+    Loads a pre-trained language model for prompt-based classification.
+    """
+    model, tokenizer = model_loader.load_language_model(model_name)
+    return model
 
-def classify_text(text_to_classify, available_labels):
+def classify_text(text_to_classify, available_labels, model):
     """
     Classifies a given text into one of the available labels using the loaded model.
     """
     prompt = f"Classify the following text: '{text_to_classify}' as one of these: {', '.join(available_labels)}."
-    
+
     # In a real implementation, this would involve tokenizing the prompt
     # and feeding it to the model to generate a prediction.
     # We simulate this by returning a placeholder classification.
     predicted_label = model.predict(prompt)
-    
+
     if predicted_label in available_labels:
         return predicted_label
     else:
         # Fallback for when the model's output isn't a perfect match.
         return "Other"
 
-# Define the categories for classification
-classification_labels = [
-    "Business & Finance", "Computers & Internet", "Education & Reference", 
-    "Entertainment & Music", "Family & Relationships", "Health", 
-    "Politics & Government", "Science & Mathematics", "Society & Culture", 
-    "Sports", "Other"
-]
+def classify_column_with_prompts(texts, available_labels, model):
+    """
+    Classifies each text with one prompt per row; empty texts are labelled "N/A".
+    """
+    return [classify_text(text, available_labels, model) if text else "N/A" for text in texts]
 
-# Specify dataset paths
-source_path = "path/to/source/dataset"
-destination_path = "path/to/destination/dataset"
+def classify_column_with_embeddings(texts, classifier, batch_size=256):
+    """
+    Classifies a column of texts in batches by embedding similarity; empty texts are labelled "N/A".
+    """
+    present = [i for i, text in enumerate(texts) if text]
+    labels = ["N/A"] * len(texts)
+    predicted = classifier.classify([texts[i] for i in present], batch_size=batch_size)
+    for i, label in zip(present, predicted):
+        labels[i] = label
+    return labels
 
-# Load the dataset to be classified
-dataset = dataset_loader.load(source_path)
+def classify_dataset(
+    source_path,
+    destination_path,
+    mode="prompt",
+    model_name="some-model-name",
+    embedding_model_name="all-mpnet-base-v2",
+    batch_size=256,
+    calibration_size=0,
+    encode_backend="torch",
+    instrument=False
+):
+    """
+    Adds instruction_class and input_class columns to a dataset and saves it.
 
-# Prepare lists to store the classification results
-instruction_classifications = []
-input_classifications = []
+    mode="prompt" (the default) asks the language model once per field per row; the opt-in
+    mode="embedding" embeds the labels once and the texts in batches and assigns the most
+    similar label. With
+    calibration_size > 0, the "Other" threshold of the embedding classifier is calibrated
+    against prompt-based labels for that many instruction texts. encode_backend="onnx" or
+    "onnx-int8" runs the embedding model on ONNX Runtime.
 
-# Process each item in the dataset
-for item in dataset:
-    # Classify the 'instruction' text
-    instruction_text = item.get("instruction")
-    if instruction_text:
-        instruction_label = classify_text(instruction_text, classification_labels)
-        instruction_classifications.append(instruction_label)
-    else:
-        instruction_classifications.append("N/A")
+    With instrument=True (or PIPELINE_INSTRUMENTATION set), per-stage timings and memory are
+    written to <destination_path>.spans.json.
+    """
+    with profile_run("classify_dataset", f"{destination_path}.spans.json", instrument):
+        # Load the dataset to be classified
+        with span("load_dataset") as load_span:
+            dataset = dataset_loader.load(source_path)
+            instruction_texts = dataset.get_column("instruction")
+            input_texts = dataset.get_column("input")
+            load_span.add_items(len(instruction_texts))
 
-    # Classify the 'input' text (e.g., a user's persona)
-    input_text = item.get("input")
-    if input_text:
-        input_label = classify_text(input_text, classification_labels)
-        input_classifications.append(input_label)
-    else:
-        input_classifications.append("N/A")
+        if mode == "prompt":
+            with span("load_model"):
+                model = load_classification_model(model_name)
+            with span("classify_instructions", items=len(instruction_texts)):
+                instruction_classifications = classify_column_with_prompts(instruction_texts, classification_labels, model)
+            with span("classify_inputs", items=len(input_texts)):
+                input_classifications = classify_column_with_prompts(input_texts, classification_labels, model)
+        elif mode == "embedding":
+            with span("load_model"):
+                embedding_model = load_model(embedding_model_name, embedding_generator.load_model, encode_backend)
+                classifier = EmbeddingZeroShotClassifier(embedding_model.encode, classification_labels)
+            if calibration_size > 0:
+                with span("calibrate_threshold", items=calibration_size):
+                    sample = [text for text in instruction_texts[:calibration_size] if text]
+                    reference = classify_column_with_prompts(sample, classification_labels, load_classification_model(model_name))
+                    classifier.calibrate_threshold(sample, reference)
+            with span("classify_instructions", items=len(instruction_texts)):
+                instruction_classifications = classify_column_with_embeddings(instruction_texts, classifier, batch_size)
+            with span("classify_inputs", items=len(input_texts)):
+                input_classifications = classify_column_with_embeddings(input_texts, classifier, batch_size)
+        else:
+            raise ValueError(f"Unknown classification mode: {mode}. Use 'prompt' or 'embedding'.")
+
+        # Add the new classification data as columns in the dataset
+        dataset.add_column("instruction_class", instruction_classifications)
+        dataset.add_column("input_class", input_classifications)
+
+        # Save the updated dataset to the specified destination
+        with span("save_dataset"):
+            dataset.save(destination_path)
 
-# Add the new classification data as columns in the dataset
-dataset.add_column("instruction_class", instruction_classifications)
-dataset.add_column("input_class", input_classifications)
+    print("Classification complete. The updated dataset is saved.")
+
+def main():
+    """
+    Main function to configure and run the dataset classification.
+    """
+    # Specify dataset paths
+    source_path = "path/to/source/dataset"
+    destination_path = "path/to/destination/dataset"
+    mode = "prompt"  # "embedding" for the batched embedding similarity classifier
+    encode_backend = "torch"  # "onnx-int8" to embed with the quantized ONNX Runtime backend (embedding mode)
 
-# Save the updated dataset to the specified destination
-dataset.save(destination_path)
+    classify_dataset(source_path, destination_path, mode=mode, encode_backend=encode_backend)
 
-print("Classification complete. The updated dataset is saved.") 
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Density Plot
+
+Raster rendering of large 2D embedding plots. Points are binned into a fixed-size grid with one
+count layer per category, and the layers are colour-composited into a single image. Cost is
+linear in the number of points and memory is bounded by the raster size, so a million points
+render in seconds into a PNG whose size does not depend on the number of points. Categorical
+columns are handled as integer codes rather than lists of strings.
+"""
+
+import os
+
+import numpy as np
+
+DEFAULT_COLORS = [
+    "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f",
+    "#bcbd22", "#17becf", "#393b79", "#637939", "#8c6d31", "#843c39", "#7b4173", "#3182bd",
+    "#e6550d", "#31a354", "#756bb1", "#636363"
+]
+
+
+def encode_categories(*columns):
+    """
+    Integer codes for the concatenation of categorical columns, without joining the columns.
+
+    Args:
+        *columns: Sequences of category values (e.g. the input_class and instruction_class columns)
+
+    Returns:
+        tuple: (int32 codes of length sum(len(column)), sorted array of category values)
+    """
+    uniques = [np.unique(np.asarray(column), return_inverse=True) for column in columns]
+    categories = np.unique(np.concatenate([values for values, _ in uniques]))
+    codes = np.concatenate([
+        np.searchsorted(categories, values).astype(np.int32)[inverse.ravel()] for values, inverse in uniques
+    ])
+    return codes, categories
+
+
+def rasterize(x, y, codes, num_categories, width=1000, height=1000, extent=None, chunk_size=1000000):
+    """
+    Counts the points of every category in each cell of a height x width grid.
+
+    Args:
+        x (np.ndarray): x coordinates
+        y (np.ndarray): y coordinates
+        codes (np.ndarray): Category code of every point, in [0, num_categories)
+        num_categories (int): Number of categories
+        width (int): Raster columns
+        height (int): Raster rows
+        extent (tuple): (x_min, x_max, y_min, y_max), the data range if None
+        chunk_size (int): Points binned at a time, bounding temporary memory
+
+    Returns:
+        np.ndarray: uint32 counts of shape (num_categories, height, width), row 0 at the top
+    """
+    if extent is None:
+        extent = (float(np.min(x)), float(np.max(x)), float(np.min(y)), float(np.max(y)))
+    x_min, x_max, y_min, y_max = extent
+    x_scale = width / max(x_max - x_min, 1e-12)
+    y_scale = height / max(y_max - y_min, 1e-12)
+
+    counts = np.zeros(num_categories * height * width, dtype=np.uint32)
+    for start in range(0, len(x), chunk_size):
+        end = min(start + chunk_size, len(x))
+        columns = np.clip(((np.asarray(x[start:end]) - x_min) * x_scale).astype(np.int64), 0, width - 1)
+        rows = np.clip(((y_max - np.asarray(y[start:end])) * y_scale).astype(np.int64), 0, height - 1)
+        cells = (np.asarray(codes[start:end], dtype=np.int64) * height + rows) * width + columns
+        counts += np.bincount(cells, minlength=len(counts)).astype(np.uint32)
+    return counts.reshape(num_categories, height, width)
+
+
+def hex_to_rgb(color):
+    color = color.lstrip("#")
+    return [int(color[i:i + 2], 16) / 255.0 for i in (0, 2, 4)]
+
+
+def composite(counts, colors, background=(1.0, 1.0, 1.0), min_alpha=0.25):
+    """
+    Blends the category layers into an RGB image.
+
+    Each cell gets the count-weighted mean colour of its categories, with an opacity that grows
+    with the log of its total count; non-empty cells are at least min_alpha opaque.
+
+    Args:
+        counts (np.ndarray): Output of rasterize, shape (categories, height, width)
+        colors (list): Hex colour per category
+        background (tuple): RGB background in [0, 1]
+        min_alpha (float): Opacity of a cell holding a single point
+
+    Returns:
+        np.ndarray: uint8 image of shape (height, width, 3)
+    """
+    palette = np.array([hex_to_rgb(color) for color in colors], dtype=np.float32)
+    total = counts.sum(axis=0, dtype=np.float64)
+    occupied = total > 0
+    mean_color = np.tensordot(palette.T, counts.astype(np.float32), axes=1) / np.maximum(total, 1)[None]
+
+    alpha = np.zeros_like(total)
+    if occupied.any():
+        alpha[occupied] = min_alpha + (1.0 - min_alpha) * np.log1p(total[occupied] - 1) / max(np.log1p(total.max() - 1), 1e-12)
+    image = np.asarray(background, dtype=np.float32)[:, None, None] * (1.0 - alpha) + mean_color * alpha
+    return (np.clip(image.transpose(1, 2, 0), 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def render_density_plot(x, y, codes, categories, output_path, title=None, width=1000, height=1000, colors=None):
+    """
+    Renders points as a category-coloured density raster and saves it with a legend.
+
+    Args:
+        x (np.ndarray): x coordinates
+        y (np.ndarray): y coordinates
+        codes (np.ndarray): Integer category code of every point
+        categories (list): Category names, indexed by code
+        output_path (str): PNG file to write
+        title (str): Plot title
+        width (int): Raster width in pixels
+        height (int): Raster height in pixels
+        colors (list): Hex colour per category, DEFAULT_COLORS if None
+
+    Returns:
+        np.ndarray: The rendered uint8 image
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Patch
+
+    colors = colors or [DEFAULT_COLORS[i % len(DEFAULT_COLORS)] for i in range(len(categories))]
+    extent = (float(np.min(x)), float(np.max(x)), float(np.min(y)), float(np.max(y)))
+    counts = rasterize(x, y, codes, len(categories), width, height, extent)
+    image = composite(counts, colors)
+
+    figure, axis = plt.subplots(figsize=(width / 100 + 3, height / 100), dpi=100)
+    axis.imshow(image, extent=extent, interpolation="nearest", aspect="auto")
+    axis.set_xticks([])
+    axis.set_yticks([])
+    if title:
+        axis.set_title(title)
+    present = counts.reshape(len(categories), -1).any(axis=1)
+    handles = [Patch(color=colors[i], label=str(categories[i])) for i in np.flatnonzero(present)]
+    axis.legend(handles=handles, loc="center left", bbox_to_anchor=(1.01, 0.5), frameon=False)
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    figure.savefig(output_path, bbox_inches="tight")
+    plt.close(figure)
+    return image
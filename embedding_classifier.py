@@ -0,0 +1,102 @@
+"""
+Embedding Classifier
+
+Zero-shot classification by embedding similarity: the label descriptions are embedded once,
+texts are embedded in batches (each distinct text once), and every text gets the label whose
+embedding is most similar. Texts whose best similarity falls below a threshold are assigned the
+fallback label instead.
+"""
+
+import numpy as np
+
+from retrieval_ranking import normalize_embeddings
+
+
+class EmbeddingZeroShotClassifier:
+    """
+    Assigns labels to texts by cosine similarity between text and label embeddings.
+
+    The fallback label (e.g. "Other") is never matched directly; it is assigned when the best
+    similarity is below `threshold`, which can be set by hand or with calibrate_threshold.
+    """
+
+    def __init__(self, encode, labels, label_template="This text is about {label}.", fallback_label="Other", threshold=None):
+        self.encode = encode
+        self.labels = list(labels)
+        self.fallback_label = fallback_label
+        self.threshold = threshold
+        self.candidate_labels = [label for label in self.labels if label != fallback_label]
+        self.label_embeddings = normalize_embeddings(
+            encode([label_template.format(label=label) for label in self.candidate_labels])
+        )
+
+    def score(self, texts, batch_size=256):
+        """
+        Returns the index of the best candidate label and its similarity for each text.
+
+        Args:
+            texts (list): Texts to score
+            batch_size (int): Number of distinct texts embedded per encode call
+
+        Returns:
+            tuple: (best label indices, best similarities), both of shape (len(texts),)
+        """
+        # Repeated texts are embedded and scored once
+        unique_texts = {}
+        inverse = np.fromiter((unique_texts.setdefault(text, len(unique_texts)) for text in texts), dtype=np.int64, count=len(texts))
+        unique_list = list(unique_texts)
+
+        best_labels = np.empty(len(unique_list), dtype=np.int64)
+        best_scores = np.empty(len(unique_list), dtype=np.float32)
+        for start in range(0, len(unique_list), batch_size):
+            embeddings = normalize_embeddings(self.encode(unique_list[start:start + batch_size]))
+            similarities = embeddings @ self.label_embeddings.T
+            best_labels[start:start + batch_size] = np.argmax(similarities, axis=1)
+            best_scores[start:start + batch_size] = np.max(similarities, axis=1)
+
+        return best_labels[inverse], best_scores[inverse]
+
+    def classify(self, texts, batch_size=256):
+        """
+        Returns one label per text.
+        """
+        if not texts:
+            return []
+        best_labels, best_scores = self.score(texts, batch_size)
+        labels = np.array(self.candidate_labels, dtype=object)[best_labels]
+        if self.threshold is not None and self.fallback_label in self.labels:
+            labels[best_scores < self.threshold] = self.fallback_label
+        return labels.tolist()
+
+    def calibrate_threshold(self, texts, reference_labels, batch_size=256):
+        """
+        Sets the fallback threshold that best reproduces reference labels on a sample.
+
+        Every observed best similarity is tried as threshold and the one with the highest
+        agreement with reference_labels (e.g. labels from the prompt-based classifier or a hand
+        labelled sample) is kept.
+
+        Returns:
+            float: Selected threshold, or None if no text should fall back
+        """
+        best_labels, best_scores = self.score(texts, batch_size)
+        predicted = np.array(self.candidate_labels, dtype=object)[best_labels]
+        reference = np.array(reference_labels, dtype=object)
+        is_fallback = reference == self.fallback_label
+        matches_label = predicted == reference
+
+        # Sweeping thresholds in increasing score order, a text turns into the fallback label
+        # once the threshold passes its score
+        order = np.argsort(best_scores, kind="stable")
+        gain = np.where(is_fallback[order], 1, 0) - np.where(matches_label[order], 1, 0)
+        agreement = matches_label.sum() + np.concatenate([[0], np.cumsum(gain)])
+        best = int(np.argmax(agreement))
+        sorted_scores = best_scores[order]
+        if best == 0:
+            # Agreement is highest when no text falls back
+            self.threshold = None
+        elif best == len(sorted_scores):
+            self.threshold = float(sorted_scores[-1]) + 1e-6
+        else:
+            self.threshold = float(sorted_scores[best - 1] + sorted_scores[best]) / 2
+        return self.threshold
@@ -0,0 +1,205 @@
+"""
+Embedding Store
+
+On-disk cache of text embeddings shared by the retrieval and plotting scripts. Vectors are kept
+in append-only float32 files that are memory-mapped on load, one namespace per (resolved model
+id, text prefix, and content fingerprint for local checkpoints), and indexed by a 64-bit hash
+of the text. Only texts missing from the store are encoded.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from instrumentation import span
+from model_mappings import checkpoint_fingerprint, resolve_model_id
+
+DEFAULT_STORE_DIR = "cache/embeddings"
+
+
+def text_hashes(texts):
+    """
+    64-bit content hashes of the given texts.
+
+    Args:
+        texts (list): Texts to hash
+
+    Returns:
+        np.ndarray: uint64 array with one hash per text
+    """
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little") for text in texts),
+        dtype=np.uint64,
+        count=len(texts)
+    )
+
+
+def lazy_encoder(load_model):
+    """
+    Returns an encode function that only loads the model the first time it is called, so fully
+    cached runs never load model weights.
+    """
+    model = []
+
+    def encode(texts):
+        if not model:
+            with span("load_model"):
+                model.append(load_model())
+        with span("encode", items=len(texts)):
+            return model[0].encode(texts)
+
+    return encode
+
+
+class EmbeddingStore:
+    """
+    Memory-mapped embeddings for one model and text prefix.
+
+    Rows are appended in the order texts are first seen; keys.u64 holds the text hash of every
+    row and vectors.f32 the raw float32 vectors. hits and misses count looked-up texts.
+    Embeddings from a non-default encode backend are kept apart from the model's own, and
+    those of a local checkpoint from the ones of earlier versions of it (see
+    model_mappings.checkpoint_fingerprint).
+    """
+
+    def __init__(self, model_name, prefix="", store_dir=DEFAULT_STORE_DIR, backend="torch"):
+        self.model_id = resolve_model_id(model_name)
+        self.prefix = prefix
+        self.checkpoint_fingerprint = checkpoint_fingerprint(model_name)
+        namespace_key = (
+            f"{self.model_id}\n{prefix}"
+            + (f"\n{backend}" if backend != "torch" else "")
+            + (f"\n{self.checkpoint_fingerprint}" if self.checkpoint_fingerprint else "")
+        )
+        namespace = hashlib.sha1(namespace_key.encode("utf-8")).hexdigest()[:16]
+        self.directory = os.path.join(store_dir, self.model_id.replace("/", "__"), namespace)
+        self.keys_path = os.path.join(self.directory, "keys.u64")
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.hits = 0
+        self.misses = 0
+        self.dimension = None
+        self._load()
+
+    def _load(self):
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.vectors = None
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as meta_file:
+            self.dimension = json.load(meta_file)["dimension"]
+        keys = np.fromfile(self.keys_path, dtype=np.uint64)
+        num_vectors = os.path.getsize(self.vectors_path) // (4 * self.dimension)
+        # Keys are written after their vectors, so rows without a key are incomplete appends
+        num_rows = min(len(keys), num_vectors)
+        self.keys = keys[:num_rows]
+        if num_rows:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(num_rows, self.dimension))
+        self._sorted_order = np.argsort(self.keys, kind="stable")
+
+    def _lookup(self, hashes):
+        if not len(self.keys):
+            return np.full(len(hashes), -1, dtype=np.int64)
+        sorted_keys = self.keys[self._sorted_order]
+        positions = np.minimum(np.searchsorted(sorted_keys, hashes), len(sorted_keys) - 1)
+        found = sorted_keys[positions] == hashes
+        return np.where(found, self._sorted_order[positions], -1)
+
+    def _append(self, hashes, vectors):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        os.makedirs(self.directory, exist_ok=True)
+        # Processes sharing the store (e.g. parallel pipeline stages) append one at a time
+        with open(os.path.join(self.directory, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Another process may have appended since this store was loaded
+            self._load()
+            new = self._lookup(hashes) < 0
+            hashes, vectors = hashes[new], vectors[new]
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                with open(self.meta_path, "w", encoding="utf-8") as meta_file:
+                    json.dump({
+                        "model_id": self.model_id,
+                        "prefix": self.prefix,
+                        "checkpoint_fingerprint": self.checkpoint_fingerprint,
+                        "dimension": self.dimension
+                    }, meta_file)
+            if len(hashes):
+                # Drop the rows of an interrupted append before extending the files
+                with open(self.vectors_path, "ab") as vectors_file:
+                    vectors_file.truncate(len(self.keys) * 4 * self.dimension)
+                    vectors_file.write(vectors.tobytes())
+                with open(self.keys_path, "ab") as keys_file:
+                    keys_file.truncate(len(self.keys) * 8)
+                    keys_file.write(hashes.tobytes())
+            self._load()
+
+    def get(self, texts, encode):
+        """
+        Returns the embeddings of the given texts, encoding only the ones not yet stored.
+
+        When the texts are exactly a run of stored rows (e.g. the same dataset column as
+        before), the result is a read-only view of the memory map and nothing is copied.
+
+        Args:
+            texts (list): Texts without the prefix
+            encode (callable): Maps a list of prefixed texts to a (n, dim) array
+
+        Returns:
+            np.ndarray: (len(texts), dim) float32 embeddings
+        """
+        hashes = text_hashes(texts)
+        rows = self._lookup(hashes)
+        missing = rows < 0
+        self.hits += int(len(rows) - missing.sum())
+        self.misses += int(missing.sum())
+
+        if missing.any():
+            # Encode each distinct missing text once
+            missing_hashes, first_positions = np.unique(hashes[missing], return_index=True)
+            order = np.argsort(first_positions)
+            missing_hashes, first_positions = missing_hashes[order], first_positions[order]
+            missing_texts = [texts[i] for i in np.flatnonzero(missing)[first_positions]]
+            new_vectors = encode([f"{self.prefix}{text}" for text in missing_texts])
+            self._append(missing_hashes, new_vectors)
+            rows = self._lookup(hashes)
+
+        if len(rows) and rows[0] >= 0 and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            return self.vectors[rows[0]:rows[0] + len(rows)]
+        return np.asarray(self.vectors[rows])
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def log_stats(self):
+        """Prints the hit ratio of the lookups made so far."""
+        print(
+            f"Embedding store {self.model_id} (prefix {self.prefix!r}): {self.hits}/{self.hits + self.misses} "
+            f"cached ({self.hit_ratio():.1%} hit ratio), {len(self.keys)} stored."
+        )
+
+
+def encode_with_store(texts, model_name, encode, prefix="", store_dir=DEFAULT_STORE_DIR, backend="torch"):
+    """
+    Embeds texts through the store for the given model and prefix and logs the hit ratio.
+
+    Args:
+        texts (list): Texts without the prefix
+        model_name (str): Short name, model ID or checkpoint path of the embedding model
+        encode (callable): Maps a list of prefixed texts to embeddings
+        prefix (str): Prefix prepended to each text before encoding
+        store_dir (str): Root directory of the store
+        backend (str): Encode backend that encode runs on (see model_mappings.ENCODE_BACKENDS)
+
+    Returns:
+        np.ndarray: (len(texts), dim) float32 embeddings
+    """
+    store = EmbeddingStore(model_name, prefix, store_dir, backend)
+    embeddings = store.get(list(texts), encode)
+    store.log_stats()
+    return embeddings
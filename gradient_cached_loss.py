@@ -0,0 +1,124 @@
+"""
+Gradient Cached Loss
+
+In-batch-negative contrastive loss whose memory use does not grow with the batch size. The batch
+is embedded in mini-chunks without an autograd graph, the full-batch loss is computed on those
+embeddings and its gradient with respect to every embedding is cached, and the chunks are then
+re-encoded with a graph and back-propagated one at a time using the cached gradients
+(Gao et al., "Scaling Deep Contrastive Learning Batch Size under Memory Limited Setup").
+"""
+
+from contextlib import contextmanager
+from functools import partial
+
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+
+class RandomStateSnapshot:
+    """
+    Captured torch RNG state, so that dropout in the re-encoding pass matches the first pass.
+    """
+
+    def __init__(self):
+        self.cpu_state = torch.get_rng_state()
+        self.cuda_states = torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+
+    @contextmanager
+    def restored(self):
+        devices = list(range(torch.cuda.device_count())) if self.cuda_states is not None else []
+        with torch.random.fork_rng(devices=devices):
+            torch.set_rng_state(self.cpu_state)
+            if self.cuda_states is not None:
+                torch.cuda.set_rng_state_all(self.cuda_states)
+            yield
+
+
+def split_features(features, mini_batch_size):
+    """
+    Splits a dict of batched tensors into dicts of at most mini_batch_size rows.
+    """
+    batch_size = len(next(iter(features.values())))
+    for start in range(0, batch_size, mini_batch_size):
+        yield {name: value[start:start + mini_batch_size] for name, value in features.items()}
+
+
+def _backward_hook(grad_output, sentence_features, loss_object):
+    """
+    Re-encodes every chunk with a graph and back-propagates the cached embedding gradients.
+    """
+    assert loss_object.cached_gradients is not None
+    with torch.enable_grad():
+        for features, gradients, random_states in zip(
+            sentence_features, loss_object.cached_gradients, loss_object.random_states
+        ):
+            for chunk, gradient, random_state in zip(
+                split_features(features, loss_object.mini_batch_size), gradients, random_states
+            ):
+                with random_state.restored():
+                    embeddings = loss_object.model(chunk)["sentence_embedding"]
+                surrogate = torch.dot(embeddings.flatten(), (gradient * grad_output).flatten())
+                surrogate.backward()
+    loss_object.cached_gradients = None
+    loss_object.random_states = None
+
+
+class GradientCachedContrastiveLoss(nn.Module):
+    """
+    Multiple-negatives ranking loss (anchor i against every positive and optional hard negative
+    in the batch, cross-entropy on scaled cosine similarities) with gradient caching.
+
+    Takes the same (sentence_features, labels) inputs as the sentence-transformers losses: the
+    first feature dict holds the anchors, the second the positives and any further ones hard
+    negatives. Peak activation memory is that of mini_batch_size rows, whatever the batch size.
+    """
+
+    def __init__(self, model, scale=20.0, mini_batch_size=32):
+        super().__init__()
+        self.model = model
+        self.scale = scale
+        self.mini_batch_size = mini_batch_size
+        self.cached_gradients = None
+        self.random_states = None
+
+    def _embed_without_graph(self, features):
+        embeddings = []
+        random_states = []
+        for chunk in split_features(features, self.mini_batch_size):
+            random_states.append(RandomStateSnapshot())
+            with torch.no_grad():
+                embeddings.append(self.model(chunk)["sentence_embedding"].detach())
+        return embeddings, random_states
+
+    def contrastive_loss(self, anchor_embeddings, candidate_embeddings):
+        """
+        Cross-entropy of each anchor against all candidates, the matching positive being column i.
+        """
+        scores = F.normalize(anchor_embeddings, dim=-1) @ F.normalize(candidate_embeddings, dim=-1).T * self.scale
+        labels = torch.arange(len(anchor_embeddings), device=scores.device)
+        return F.cross_entropy(scores, labels)
+
+    def forward(self, sentence_features, labels=None):
+        embedded = [self._embed_without_graph(features) for features in sentence_features]
+        chunk_embeddings = [[chunk.requires_grad_() for chunk in chunks] for chunks, _ in embedded]
+        self.random_states = [states for _, states in embedded]
+
+        anchors = torch.cat(chunk_embeddings[0])
+        candidates = torch.cat([torch.cat(chunks) for chunks in chunk_embeddings[1:]])
+        with torch.enable_grad():
+            loss = self.contrastive_loss(anchors, candidates)
+
+        if not torch.is_grad_enabled():
+            # Evaluation: no backward pass will follow
+            self.random_states = None
+            return loss.detach()
+
+        # Gradients of the full-batch loss with respect to every (detached) chunk embedding
+        loss.backward()
+        self.cached_gradients = [[chunk.grad for chunk in chunks] for chunks in chunk_embeddings]
+
+        # The trainer's loss.backward() runs the chunked re-encoding through this hook
+        loss = loss.detach().requires_grad_()
+        loss.register_hook(partial(_backward_hook, sentence_features=sentence_features, loss_object=self))
+        return loss
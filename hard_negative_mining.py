@@ -0,0 +1,127 @@
+"""
+Hard Negative Mining
+
+Finds, for every training instruction, the personas the current model finds most similar that
+are not its own, and writes (anchor, positive, hard negative) triplets for the trainer. Persona
+embeddings are written batch by batch to a memory-mapped file and searched in memory-bounded
+blocks, so million-row training sets are mined without holding all embeddings in RAM.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from ann_index import create_index
+from embedding_store import text_hashes
+from retrieval_ranking import normalize_embeddings
+
+
+def encode_to_memmap(encode, texts, path, batch_size=1024):
+    """
+    Encodes texts batch by batch into a float32 memory-mapped file of normalised embeddings.
+
+    Args:
+        encode (callable): Maps a list of texts to a (n, dim) array
+        texts (list): Texts to encode
+        path (str): Raw float32 output file
+        batch_size (int): Texts per encode call
+
+    Returns:
+        np.memmap: (len(texts), dim) read-only embeddings
+    """
+    dimension = None
+    with open(path, "wb") as vectors_file:
+        for start in range(0, len(texts), batch_size):
+            embeddings = normalize_embeddings(encode(texts[start:start + batch_size]))
+            dimension = embeddings.shape[1]
+            vectors_file.write(embeddings.tobytes())
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(len(texts), dimension))
+
+
+def mine_hard_negatives(
+    encode,
+    instructions,
+    personas,
+    output_path,
+    instruction_prefix="",
+    input_prefix="",
+    num_negatives=1,
+    batch_size=1024,
+    index_backend="flat",
+    index_options=None
+):
+    """
+    Writes (anchor, positive, negative) triplets with the hardest wrong personas per instruction.
+
+    Instruction i is paired with persona i. Candidates with the same persona text as the
+    positive are never used as negatives, since they are not actually wrong.
+
+    Args:
+        encode (callable): Encoder of the current checkpoint, mapping texts to embeddings
+        instructions (list): Instruction texts without prefix
+        personas (list): Persona texts without prefix, aligned with instructions
+        output_path (str): JSONL file receiving one triplet per line
+        instruction_prefix (str): Prefix prepended to instructions before encoding
+        input_prefix (str): Prefix prepended to personas before encoding
+        num_negatives (int): Hard negatives (and thus triplets) per instruction
+        batch_size (int): Texts per encode call and instructions per search batch
+        index_backend (str): ann_index backend used for the search, e.g. "ivf_flat" for speed
+        index_options (dict): Backend parameters
+
+    Returns:
+        dict: Number of triplets and encode/search/total seconds
+    """
+    start = time.perf_counter()
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    prefixed_personas = [f"{input_prefix}{text}" for text in personas]
+    persona_vectors = encode_to_memmap(encode, prefixed_personas, f"{output_path}.personas.f32", batch_size)
+    persona_hashes = text_hashes(personas)
+    encode_seconds = time.perf_counter() - start
+
+    index = create_index(index_backend, **(index_options or {})).build(persona_vectors)
+    # A few extra candidates cover the positive itself and duplicates of it
+    num_candidates = min(len(personas), 2 * num_negatives + 4)
+
+    search_seconds = 0.0
+    num_triplets = 0
+    with open(output_path, "w", encoding="utf-8") as triplets_file:
+        for batch_start in range(0, len(instructions), batch_size):
+            batch = instructions[batch_start:batch_start + batch_size]
+            encode_start = time.perf_counter()
+            queries = normalize_embeddings(encode([f"{instruction_prefix}{text}" for text in batch]))
+            search_start = time.perf_counter()
+            encode_seconds += search_start - encode_start
+            _, candidates = index.search(queries, num_candidates)
+            search_seconds += time.perf_counter() - search_start
+
+            gold = np.arange(batch_start, batch_start + len(batch))
+            valid = (candidates >= 0) & (persona_hashes[np.maximum(candidates, 0)] != persona_hashes[gold][:, None])
+            for row, instruction in enumerate(batch):
+                positive = prefixed_personas[gold[row]]
+                for negative in candidates[row][valid[row]][:num_negatives]:
+                    triplet = {
+                        "anchor": f"{instruction_prefix}{instruction}",
+                        "positive": positive,
+                        "negative": prefixed_personas[negative]
+                    }
+                    triplets_file.write(json.dumps(triplet, ensure_ascii=False) + "\n")
+                    num_triplets += 1
+
+    del index, persona_vectors
+    os.remove(f"{output_path}.personas.f32")
+    total_seconds = time.perf_counter() - start
+    print(
+        f"Mined {num_triplets} triplets in {total_seconds:.1f}s "
+        f"(encoding {encode_seconds:.1f}s, search {search_seconds:.1f}s). Saved to {output_path}."
+    )
+    return {
+        "triplets": num_triplets,
+        "encode_seconds": encode_seconds,
+        "search_seconds": search_seconds,
+        "mining_seconds": total_seconds
+    }
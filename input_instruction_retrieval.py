@@ -1,65 +1,253 @@
+import os
+import time
+
+import numpy as np
+
 import model_loader
 import dataset_loader
 import analysis_reporter
+from ann_index import create_index, embeddings_fingerprint, index_matches, load_index, save_index
+from embedding_store import DEFAULT_STORE_DIR, encode_with_store, lazy_encoder
+from instrumentation import profile_run, span
+from model_mappings import load_model, resolve_model_id
+from retrieval_ranking import calculate_accuracy, calculate_mrr, normalize_embeddings, rank_gold_blocked
 
-def perform_retrieval_analysis(instruction_model_name, input_model_name, dataset_path, output_directory):
+def perform_retrieval_analysis(
+    instruction_model_name,
+    input_model_name,
+    dataset_path,
+    output_directory,
+    max_block_bytes=256 * 1024 ** 2,
+    index_backend=None,
+    index_options=None,
+    index_path=None,
+    index_k=10,
+    query_batch_size=4096,
+    store_dir=DEFAULT_STORE_DIR,
+    quantization=None,
+    rescore_factor=10,
+    encode_backend="torch",
+    instrument=False
+):
     """
     Analyzes how well instruction embeddings can retrieve their corresponding input (persona) embeddings.
+
+    Similarity scores are computed in blocks of at most max_block_bytes. With an index_backend
+    (see ann_index.INDEX_BACKENDS), retrieval is also evaluated against a nearest-neighbour index
+    over the input embeddings, loaded from index_path if it was built from the same embeddings
+    (model, count, dimension and content, see ann_index.embeddings_fingerprint) and built and
+    saved otherwise.
+    Embeddings are read from and added to the embedding store under store_dir.
+
+    For each scheme in quantization ("int8", "binary"), retrieval is repeated with a two-stage
+    search that shortlists index_k * rescore_factor inputs on the quantized codes and rescores
+    them in float; its memory footprint and metric deltas versus full precision are reported.
+
+    encode_backend="onnx" or "onnx-int8" encodes on ONNX Runtime instead of the model itself
+    (see onnx_backend); those embeddings are stored apart from the model's own.
+
+    With instrument=True (or PIPELINE_INSTRUMENTATION set), the time, CPU time, peak memory and
+    throughput of every stage are written to retrieval_analysis_spans.json next to the summary.
     """
     
-    # Load the models for generating embeddings
-    instruction_model = model_loader.load(instruction_model_name)
-    input_model = model_loader.load(input_model_name)
-    
-    # Load the dataset containing instruction and input texts
-    dataset = dataset_loader.load(dataset_path)
-    
-    instruction_texts = [f"Instruct: {text}" for text in dataset.get_column("instruction")]
-    input_texts = [f"Persona: {text}" for text in dataset.get_column("input")]
-    
-    # Generate embeddings for all instructions and inputs
-    instruction_embeddings = instruction_model.encode(instruction_texts)
-    input_embeddings = input_model.encode(input_texts)
-    
-    # Calculate cosine similarity between each instruction and all inputs
-    similarity_scores = calculate_cosine_similarity(instruction_embeddings, input_embeddings)
-    
-    # Determine the rank of the correct input for each instruction
-    ranks = []
-    for i, instruction_embedding in enumerate(instruction_embeddings):
-        # The correct input is at the same index 'i' in the input_embeddings list
-        correct_input_index = i
+    with profile_run("retrieval_analysis", f"{output_directory}/retrieval_analysis_spans.json", instrument):
+        # Models are only loaded if some texts are not in the embedding store yet
+        instruction_encoder = lazy_encoder(lambda: load_model(instruction_model_name, model_loader.load, encode_backend))
+        input_encoder = lazy_encoder(lambda: load_model(input_model_name, model_loader.load, encode_backend))
         
-        # Get similarity scores of the current instruction against all inputs
-        scores_for_instruction = similarity_scores[i]
+        # Load the dataset containing instruction and input texts
+        with span("load_dataset") as load_span:
+            dataset = dataset_loader.load(dataset_path)
+            instructions = dataset.get_column("instruction")
+            inputs = dataset.get_column("input")
+            load_span.add_items(len(instructions))
         
-        # Sort inputs by similarity score in descending order and find the rank of the correct input
-        sorted_indices = sort_indices_by_score(scores_for_instruction, descending=True)
-        rank = find_position(sorted_indices, correct_input_index) + 1  # +1 because rank is 1-based
-        ranks.append(rank)
+        # Generate (or reuse stored) embeddings for all instructions and inputs
+        with span("embed_instructions", items=len(instructions)):
+            instruction_embeddings = encode_with_store(
+                instructions, instruction_model_name, instruction_encoder, "Instruct: ", store_dir, encode_backend
+            )
+        with span("embed_inputs", items=len(inputs)):
+            input_embeddings = encode_with_store(
+                inputs, input_model_name, input_encoder, "Persona: ", store_dir, encode_backend
+            )
         
-    # Calculate key performance metrics
-    top_1_accuracy = calculate_accuracy(ranks, top_k=1)
-    top_5_accuracy = calculate_accuracy(ranks, top_k=5)
-    mean_reciprocal_rank = calculate_mrr(ranks)
-    
-    # Prepare the results for reporting
-    results = {
-        "Top-1 Accuracy": top_1_accuracy,
-        "Top-5 Accuracy": top_5_accuracy,
-        "Mean Reciprocal Rank (MRR)": mean_reciprocal_rank,
-        "model_info": {
-            "instruction_model": instruction_model_name,
-            "input_model": input_model_name,
-            "dataset": dataset_path
+        # Rank the correct input for each instruction block by block; the correct input is at the
+        # same index in input_embeddings, and no full similarity matrix is ever materialised
+        with span("normalize", items=len(instruction_embeddings) + len(input_embeddings)):
+            instruction_embeddings = normalize_embeddings(instruction_embeddings)
+            input_embeddings = normalize_embeddings(input_embeddings)
+        with span("rank", items=len(instruction_embeddings)):
+            ranks, exact_top_k = rank_gold_blocked(
+                instruction_embeddings,
+                input_embeddings,
+                top_k=index_k if index_backend or quantization else 0,  # Exact neighbours are only needed for recall
+                max_block_bytes=max_block_bytes
+            )
+            
+        # Calculate key performance metrics
+        top_1_accuracy = calculate_accuracy(ranks, top_k=1)
+        top_5_accuracy = calculate_accuracy(ranks, top_k=5)
+        mean_reciprocal_rank = calculate_mrr(ranks)
+        
+        # Prepare the results for reporting
+        results = {
+            "Top-1 Accuracy": top_1_accuracy,
+            "Top-5 Accuracy": top_5_accuracy,
+            "Mean Reciprocal Rank (MRR)": mean_reciprocal_rank,
+            "model_info": {
+                "instruction_model": instruction_model_name,
+                "input_model": input_model_name,
+                "dataset": dataset_path
+            }
         }
-    }
-    
-    # Save the analysis results to a file
-    analysis_reporter.save_results(results, output_directory, "retrieval_analysis_summary.json")
+
+        if index_backend:
+            with span(f"index_evaluation[{index_backend}]"):
+                results["index_evaluation"] = evaluate_index(
+                    instruction_embeddings,
+                    input_embeddings,
+                    exact_top_k,
+                    index_backend,
+                    index_options or {},
+                    index_path,
+                    index_k,
+                    query_batch_size,
+                    fingerprint_metadata={"model_id": resolve_model_id(input_model_name), "encode_backend": encode_backend}
+                )
+
+        if quantization:
+            results["quantized_search"] = {}
+            for scheme in quantization:
+                with span(f"quantized_search[{scheme}]"):
+                    results["quantized_search"][scheme] = evaluate_quantization(
+                        instruction_embeddings,
+                        input_embeddings,
+                        ranks,
+                        exact_top_k,
+                        scheme,
+                        rescore_factor,
+                        index_k,
+                        query_batch_size
+                    )
+        
+        # Save the analysis results to a file
+        with span("save_results"):
+            analysis_reporter.save_results(results, output_directory, "retrieval_analysis_summary.json")
     
     print("Retrieval analysis complete. Results saved.")
 
+def evaluate_index(
+    instruction_embeddings,
+    input_embeddings,
+    exact_top_k,
+    index_backend,
+    index_options,
+    index_path,
+    k,
+    query_batch_size,
+    fingerprint_metadata=None
+):
+    """
+    Evaluates instruction-to-persona retrieval through a nearest-neighbour index.
+
+    Reports Top-1/Top-5 accuracy and MRR@k of the index results, their recall against the exact
+    top-k neighbours, and index build time and query throughput. An index at index_path is only
+    reused if its fingerprint matches input_embeddings, the backend and its options and
+    fingerprint_metadata; otherwise it is rebuilt and overwritten.
+    """
+    build_seconds = 0.0
+    loaded = False
+    if index_path:
+        with span("fingerprint_index", items=len(input_embeddings)):
+            fingerprint = embeddings_fingerprint(
+                input_embeddings, backend=index_backend, options=index_options, **(fingerprint_metadata or {})
+            )
+        loaded = index_matches(index_path, fingerprint)
+        if os.path.exists(index_path) and not loaded:
+            print(f"Index at {index_path} was built from other embeddings or options; rebuilding it.")
+    if loaded:
+        with span("load_index"):
+            index = load_index(index_path)
+    else:
+        with span("build_index", items=len(input_embeddings)):
+            start = time.perf_counter()
+            index = create_index(index_backend, **index_options).build(input_embeddings)
+            build_seconds = time.perf_counter() - start
+            if index_path:
+                save_index(index, index_path, fingerprint)
+
+    # Query in batches, as the index would be queried when serving
+    with span("search_index", items=len(instruction_embeddings)):
+        start = time.perf_counter()
+        retrieved = np.concatenate([
+            index.search(instruction_embeddings[batch_start:batch_start + query_batch_size], k)[1]
+            for batch_start in range(0, len(instruction_embeddings), query_batch_size)
+        ])
+        query_seconds = time.perf_counter() - start
+
+    # Rank of the correct input within the returned list, 0 if the index missed it
+    hits = retrieved == np.arange(len(retrieved))[:, None]
+    index_ranks = np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, 0)
+    found = index_ranks > 0
+
+    recall = np.mean([
+        len(np.intersect1d(approximate, exact)) / len(exact)
+        for approximate, exact in zip(retrieved, exact_top_k)
+    ])
+
+    return {
+        "backend": index_backend,
+        "options": index_options,
+        "Top-1 Accuracy": float(np.mean(found & (index_ranks <= 1))),
+        "Top-5 Accuracy": float(np.mean(found & (index_ranks <= 5))),
+        f"MRR@{k}": float(np.sum(1.0 / index_ranks[found]) / len(index_ranks)),
+        f"Recall@{k} vs exact": float(recall),
+        "build_seconds": build_seconds,
+        "query_seconds": query_seconds,
+        "queries_per_second": len(retrieved) / query_seconds if query_seconds else 0.0,
+        "index_memory_bytes": index.memory_bytes,
+        "index_loaded_from_disk": loaded
+    }
+
+def evaluate_quantization(
+    instruction_embeddings,
+    input_embeddings,
+    ranks,
+    exact_top_k,
+    scheme,
+    rescore_factor,
+    k,
+    query_batch_size
+):
+    """
+    Evaluates two-stage retrieval over quantized input embeddings against full precision.
+
+    Adds to the evaluate_index metrics the float32 and quantized sizes of the input embeddings
+    and the Top-1/Top-5/MRR@k differences to the exact float32 ranking (negative means worse).
+    """
+    evaluation = evaluate_index(
+        instruction_embeddings,
+        input_embeddings,
+        exact_top_k,
+        scheme,
+        {"rescore_factor": rescore_factor},
+        None,
+        k,
+        query_batch_size
+    )
+    full_precision = {
+        "Top-1 Accuracy": calculate_accuracy(ranks, top_k=1),
+        "Top-5 Accuracy": calculate_accuracy(ranks, top_k=5),
+        f"MRR@{k}": float(np.sum(np.where(ranks <= k, 1.0 / ranks, 0.0)) / len(ranks))
+    }
+    evaluation["float32_bytes"] = int(input_embeddings.size * 4)
+    evaluation["compression_ratio"] = evaluation["float32_bytes"] / evaluation["index_memory_bytes"]
+    evaluation["delta_vs_float32"] = {
+        metric: evaluation[metric] - value for metric, value in full_precision.items()
+    }
+    return evaluation
+
 def main():
     """
     Main execution block to run the retrieval analysis with predefined parameters.
@@ -69,9 +257,25 @@ def main():
     input_model = "path/to/input_model"
     dataset_location = "path/to/dataset"
     results_directory = "results/retrieval_analysis"
+    index_backend = "ivf_flat"  # None for exact ranking only
+    index_options = {"num_lists": 1024, "nprobe": 16}
+    quantization = ["int8", "binary"]  # Two-stage search over quantized embeddings
+    encode_backend = "torch"  # "onnx-int8" to encode with the quantized ONNX Runtime backend
+    instrument = False  # Write per-stage timings and memory to retrieval_analysis_spans.json
     
     # Run the analysis
-    perform_retrieval_analysis(instruction_model, input_model, dataset_location, results_directory)
+    perform_retrieval_analysis(
+        instruction_model,
+        input_model,
+        dataset_location,
+        results_directory,
+        index_backend=index_backend,
+        index_options=index_options,
+        index_path=f"{results_directory}/persona_index.npz",
+        quantization=quantization,
+        encode_backend=encode_backend,
+        instrument=instrument
+    )
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""
+Instrumentation
+
+Lightweight per-stage profiling for the pipeline scripts. A span measures one stage (data
+loading, encoding, ranking, reduction, plotting, ...) with its wall time, CPU time, peak RSS and
+optionally the number of items it processed; spans opened inside another span become its
+children, so a run produces a tree of stages. Instrumentation is off by default: span() then
+returns a shared no-op object and costs a flag check, so the calls can stay in the hot paths.
+Set PIPELINE_INSTRUMENTATION=1 or call enable() to record spans.
+"""
+
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+_enabled = os.environ.get("PIPELINE_INSTRUMENTATION", "") not in ("", "0")
+_lock = threading.Lock()
+_local = threading.local()
+_roots = []
+
+
+def peak_rss_mib():
+    """
+    Peak resident set size of this process so far, in MiB.
+
+    On Linux this is VmHWM, because ru_maxrss survives fork and exec: a spawned worker would
+    report its parent's peak.
+    """
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Discards all recorded spans."""
+    with _lock:
+        _roots.clear()
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class Span:
+    """
+    One timed stage. Use through span(); items can also be counted while the span is open with
+    add_items.
+    """
+
+    __slots__ = (
+        "name", "items", "children", "wall_seconds", "cpu_seconds", "peak_rss_mib", "peak_rss_growth_mib",
+        "_wall_start", "_cpu_start", "_rss_start"
+    )
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+        self.children = []
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_mib = 0.0
+        self.peak_rss_growth_mib = 0.0
+
+    def add_items(self, count):
+        self.items = (self.items or 0) + count
+
+    def __enter__(self):
+        stack = _stack()
+        if stack:
+            stack[-1].children.append(self)
+        else:
+            # Spans opened outside any other span (also in worker threads) are roots
+            with _lock:
+                _roots.append(self)
+        stack.append(self)
+        self._rss_start = peak_rss_mib()
+        self._cpu_start = time.process_time()
+        self._wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall_seconds = time.perf_counter() - self._wall_start
+        # Process CPU time, so it includes the worker threads of numpy, torch, numba, ...
+        self.cpu_seconds = time.process_time() - self._cpu_start
+        self.peak_rss_mib = peak_rss_mib()
+        self.peak_rss_growth_mib = self.peak_rss_mib - self._rss_start
+        _stack().pop()
+        return False
+
+    def to_dict(self):
+        record = {
+            "name": self.name,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_mib": self.peak_rss_mib,
+            "peak_rss_growth_mib": self.peak_rss_growth_mib
+        }
+        if self.items is not None:
+            record["items"] = self.items
+            record["items_per_second"] = self.items / self.wall_seconds if self.wall_seconds else 0.0
+        if self.children:
+            record["children"] = [child.to_dict() for child in self.children]
+        return record
+
+
+class _NullSpan:
+    """Stand-in returned by span() while instrumentation is disabled."""
+
+    __slots__ = ()
+
+    def add_items(self, count):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, items=None):
+    """
+    Context manager timing a stage.
+
+    Args:
+        name (str): Stage name, shown in the span tree
+        items (int): Number of items processed by the stage, for the throughput
+
+    Returns:
+        Span: The open span (a no-op stand-in while instrumentation is disabled)
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, items)
+
+
+def instrumented(name=None):
+    """
+    Decorator running every call of the function inside a span named name (the function's
+    qualified name by default).
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def span_tree():
+    """Returns the recorded spans as a list of nested dicts."""
+    with _lock:
+        return [root.to_dict() for root in _roots]
+
+
+def format_span_tree(records=None, indent=0):
+    """Renders the span tree as indented text lines, one stage per line."""
+    lines = []
+    for record in span_tree() if records is None else records:
+        line = (
+            f"{'  ' * indent}{record['name']}: {record['wall_seconds']:.3f}s wall, "
+            f"{record['cpu_seconds']:.3f}s CPU, peak RSS {record['peak_rss_mib']:.0f} MiB "
+            f"(+{record['peak_rss_growth_mib']:.0f})"
+        )
+        if "items" in record:
+            line += f", {record['items']} items ({record['items_per_second']:.0f}/s)"
+        lines.append(line)
+        lines.extend(format_span_tree(record.get("children", []), indent + 1))
+    return lines
+
+
+def save_span_tree(output_path, root=None):
+    """
+    Writes the recorded span tree (or only the subtree of root) as JSON and prints it, if
+    instrumentation is enabled.
+
+    Returns:
+        str: output_path, or None if nothing was written
+    """
+    if not _enabled:
+        return None
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    records = [root.to_dict()] if isinstance(root, Span) else span_tree()
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        json.dump({"spans": records}, output_file, indent=2)
+    print("\n".join(format_span_tree(records)))
+    print(f"Span tree saved to {output_path}.")
+    return output_path
+
+
+@contextmanager
+def profile_run(name, output_path, enabled=False):
+    """
+    Runs the body of a script inside a root span and writes that span's tree to output_path
+    when the body finishes or fails. Afterwards the root span is discarded and instrumentation
+    is switched back to its previous state, so repeated runs in one process neither accumulate
+    spans nor leave instrumentation on.
+
+    Args:
+        name (str): Name of the root span
+        output_path (str): JSON file receiving the span tree
+        enabled (bool): Turns instrumentation on; it is also on if PIPELINE_INSTRUMENTATION is set
+
+    Yields:
+        Span: The root span (a no-op stand-in while instrumentation is disabled)
+    """
+    global _enabled
+    was_enabled = _enabled
+    if enabled:
+        enable()
+    run_span = span(name)
+    try:
+        with run_span:
+            yield run_span
+    finally:
+        try:
+            save_span_tree(output_path, run_span)
+        finally:
+            with _lock:
+                if any(root is run_span for root in _roots):
+                    _roots.remove(run_span)
+            _enabled = was_enabled
@@ -0,0 +1,119 @@
+"""
+kNN Graph Cache
+
+Approximate k-nearest-neighbour graphs of embedding matrices, cached on disk by content so that
+the UMAP and t-SNE scripts share one graph instead of each rebuilding it. A graph is a pair of
+(n, k) arrays: neighbour ids (self excluded) and cosine distances, nearest first.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from ann_index import create_index
+from retrieval_ranking import normalize_embeddings
+
+DEFAULT_GRAPH_DIR = "cache/knn"
+
+
+def embeddings_fingerprint(embeddings, block_size=65536):
+    """
+    Content hash of an embedding matrix (shape and float32 bytes), read block by block.
+    """
+    digest = hashlib.sha256(json.dumps(list(embeddings.shape)).encode("utf-8"))
+    for start in range(0, len(embeddings), block_size):
+        digest.update(np.ascontiguousarray(embeddings[start:start + block_size], dtype=np.float32).tobytes())
+    return digest.hexdigest()[:24]
+
+
+def graph_path(fingerprint, num_neighbors, graph_dir=DEFAULT_GRAPH_DIR):
+    return os.path.join(graph_dir, f"{fingerprint}-k{num_neighbors}.npz")
+
+
+def save_knn_graph(fingerprint, indices, distances, graph_dir=DEFAULT_GRAPH_DIR):
+    """
+    Stores a graph under the fingerprint of the embeddings it was built from.
+    """
+    os.makedirs(graph_dir, exist_ok=True)
+    path = graph_path(fingerprint, indices.shape[1], graph_dir)
+    # Written under a temporary name first, so readers never see a partial file
+    temporary_path = f"{path}.tmp.npz"
+    np.savez(temporary_path, indices=indices.astype(np.int64), distances=distances.astype(np.float32))
+    os.replace(temporary_path, path)
+    return path
+
+
+def load_knn_graph(fingerprint, num_neighbors, graph_dir=DEFAULT_GRAPH_DIR):
+    """
+    Returns (indices, distances) with num_neighbors columns, or None if no graph with at least
+    that many neighbours is cached for these embeddings.
+    """
+    if not os.path.isdir(graph_dir):
+        return None
+    candidates = []
+    for name in os.listdir(graph_dir):
+        if name.startswith(f"{fingerprint}-k") and name.endswith(".npz") and ".tmp" not in name:
+            k = int(name[len(fingerprint) + 2:-len(".npz")])
+            if k >= num_neighbors:
+                candidates.append(k)
+    if not candidates:
+        return None
+    # The smallest sufficient graph is the cheapest to load; its leading columns are the answer
+    with np.load(graph_path(fingerprint, min(candidates), graph_dir)) as data:
+        return data["indices"][:, :num_neighbors], data["distances"][:, :num_neighbors]
+
+
+def drop_self(indices, distances):
+    """
+    Removes every point from its own neighbour list, or the last neighbour where the point is
+    missing, so that (n, k + 1) inputs become (n, k).
+    """
+    is_self = indices == np.arange(len(indices))[:, None]
+    is_self[~is_self.any(axis=1), -1] = True
+    keep = ~is_self
+    num_neighbors = indices.shape[1] - 1
+    return indices[keep].reshape(-1, num_neighbors), distances[keep].reshape(-1, num_neighbors)
+
+
+def build_knn_graph(embeddings, num_neighbors=15, index_backend="flat", index_options=None, batch_size=8192):
+    """
+    Builds the cosine kNN graph of embeddings with an ann_index backend.
+
+    Args:
+        embeddings (np.ndarray): Matrix of shape (n, dim)
+        num_neighbors (int): Neighbours per point, excluding the point itself
+        index_backend (str): ann_index backend, e.g. "ivf_flat" for large n
+        index_options (dict): Backend parameters
+        batch_size (int): Points searched at a time
+
+    Returns:
+        tuple: (indices, distances), both of shape (n, num_neighbors)
+    """
+    vectors = normalize_embeddings(embeddings)
+    index = create_index(index_backend, **(index_options or {})).build(vectors)
+    indices = np.empty((len(vectors), num_neighbors), dtype=np.int64)
+    distances = np.empty((len(vectors), num_neighbors), dtype=np.float32)
+    for start in range(0, len(vectors), batch_size):
+        end = min(start + batch_size, len(vectors))
+        similarities, neighbors = index.search(vectors[start:end], num_neighbors + 1)
+        block_indices, block_similarities = drop_self(neighbors - start, similarities)
+        indices[start:end] = block_indices + start
+        distances[start:end] = np.maximum(1.0 - block_similarities, 0.0)
+    return indices, distances
+
+
+def get_knn_graph(embeddings, num_neighbors=15, graph_dir=DEFAULT_GRAPH_DIR, **build_options):
+    """
+    Returns the cached kNN graph of embeddings, building and caching it if needed.
+
+    Returns:
+        tuple: (indices, distances, fingerprint)
+    """
+    fingerprint = embeddings_fingerprint(embeddings)
+    graph = load_knn_graph(fingerprint, num_neighbors, graph_dir)
+    if graph is None:
+        graph = build_knn_graph(embeddings, num_neighbors, **build_options)
+        save_knn_graph(fingerprint, *graph, graph_dir=graph_dir)
+    return graph[0], graph[1], fingerprint
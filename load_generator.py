@@ -0,0 +1,141 @@
+"""
+Load Generator
+
+Closed-loop HTTP load generator for retrieval_server. A number of concurrent clients, each on
+its own keep-alive connection, send /search requests back to back for a fixed number of requests
+or a fixed duration. Reports client-side throughput and p50/p99 latency together with the
+server's own /metrics.
+"""
+
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+import dataset_loader
+
+
+async def send_request(reader, writer, method, path, payload=None):
+    """
+    Sends one HTTP/1.1 request on an open connection and reads the JSON response.
+
+    Returns:
+        tuple: (status code, decoded JSON body)
+    """
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    data = await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, json.loads(data) if data else None
+
+
+async def fetch_json(host, port, path, method="GET"):
+    """Requests path on a fresh connection and returns the JSON body."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        return (await send_request(reader, writer, method, path))[1]
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, queries, concurrency=16, num_requests=None, duration=None, k=5, seed=0):
+    """
+    Drives the server with concurrency closed-loop clients.
+
+    Args:
+        host (str): Server host
+        port (int): Server port
+        queries (list): Query texts, drawn at random for every request
+        concurrency (int): Clients with one request in flight each
+        num_requests (int): Total requests to send, or
+        duration (float): Seconds to keep sending (one of the two must be set)
+        k (int): Personas requested per query
+        seed (int): Seed of the query draw
+
+    Returns:
+        dict: Client-side counts, throughput and latency percentiles, and the server's metrics
+    """
+    if num_requests is None and duration is None:
+        raise ValueError("Set num_requests or duration.")
+    # Server metrics then cover this run only
+    await fetch_json(host, port, "/metrics/reset", "POST")
+    rng = random.Random(seed)
+    latencies = []
+    errors = [0]
+    sent = [0]
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+
+    def more():
+        if num_requests is not None and sent[0] >= num_requests:
+            return False
+        return deadline is None or time.perf_counter() < deadline
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while more():
+                sent[0] += 1
+                request_start = time.perf_counter()
+                status, _ = await send_request(reader, writer, "POST", "/search", {"query": rng.choice(queries), "k": k})
+                latencies.append(time.perf_counter() - request_start)
+                errors[0] += int(status != 200)
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "seconds": seconds,
+        "requests_per_second": len(latencies) / seconds if seconds else 0.0,
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)) if len(latencies) else 0.0,
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)) if len(latencies) else 0.0,
+        "server_metrics": await fetch_json(host, port, "/metrics")
+    }
+
+
+def print_report(report):
+    """Prints one load generator report on a line."""
+    server = report["server_metrics"]
+    print(
+        f"concurrency {report['concurrency']:>4}: {report['requests_per_second']:>7.0f} req/s, "
+        f"p50 {report['latency_p50_ms']:>7.2f} ms, p99 {report['latency_p99_ms']:>7.2f} ms, "
+        f"errors {report['errors']}, server mean batch {server['mean_batch_size']:.1f}"
+    )
+
+
+def main():
+    """
+    Runs the load generator against a running server with predefined parameters.
+    """
+    # Configuration for the load test
+    host = "127.0.0.1"
+    port = 8080
+    dataset_location = "path/to/dataset"  # Its instructions are used as queries
+    concurrency_levels = [1, 8, 32, 128]
+    duration = 20.0  # Seconds per concurrency level
+
+    queries = list(dataset_loader.load(dataset_location).get_column("instruction"))
+    for concurrency in concurrency_levels:
+        print_report(asyncio.run(run_load(host, port, queries, concurrency=concurrency, duration=duration)))
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,16 @@
 Model Mappings
 
 This file provides mappings between short model names and their full Hugging Face model IDs
-for text embedding models used in this project.
+for text embedding models used in this project, and a registry that lazily loads those models
+and keeps the most recently used ones in memory under a RAM budget.
 """
 
+import gc
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
 MODEL_MAPPINGS = {
     # Sentence Transformers models
     "all-MiniLM-L6-v2": "sentence-transformers/all-MiniLM-L6-v2",
@@ -28,6 +35,30 @@ MODEL_MAPPINGS = {
     "Jina-embeddings-v3": "jinaai/jina-embeddings-v3",
 }
 
+# Approximate parameter counts in millions, used to schedule and budget models before loading them
+MODEL_PARAMETERS_MILLIONS = {
+    "sentence-transformers/all-MiniLM-L6-v2": 23,
+    "sentence-transformers/all-MiniLM-L12-v2": 33,
+    "sentence-transformers/all-mpnet-base-v2": 109,
+    "sentence-transformers/sentence-t5-base": 110,
+    "TechWolf/ConTeXT-Skill-Extraction-base": 109,
+    "nomic-ai/nomic-embed-text-v1.5": 137,
+    "ibm-granite/granite-embedding-30m-english": 30,
+    "NovaSearch/stella_en_400M_v5": 435,
+    "NovaSearch/stella_en_1.5B_v5": 1543,
+    "NovaSearch/jasper_en_vision_language_v1": 1999,
+    "intfloat/multilingual-e5-large-instruct": 560,
+    "intfloat/e5-large-v2": 335,
+    "BAAI/bge-m3": 568,
+    "BAAI/bge-large-en-v1.5": 335,
+    "hkunlp/instructor-large": 335,
+    "nvidia/NV-Embed-v2": 7851,
+    "jinaai/jina-embeddings-v3": 572,
+}
+
+# Values of the encode_backend option of the scripts
+ENCODE_BACKENDS = ("torch", "onnx", "onnx-int8")
+
 def get_model_id(model_name):
     """
     Get the full Hugging Face model ID for a given short model name.
@@ -46,6 +77,63 @@ def get_model_id(model_name):
     else:
         raise ValueError(f"Unknown model name: {model_name}. Available models: {list(MODEL_MAPPINGS.keys())}")
 
+def resolve_model_id(model_name):
+    """
+    Like get_model_id, but names that are not in MODEL_MAPPINGS (e.g. local checkpoint paths)
+    are returned unchanged instead of raising.
+    
+    Args:
+        model_name (str): Short model name, full model ID or local path
+        
+    Returns:
+        str: Model ID or path to load
+    """
+    try:
+        return get_model_id(model_name)
+    except ValueError:
+        return model_name
+
+def checkpoint_fingerprint(model_name):
+    """
+    Content fingerprint of a local checkpoint, from the relative path, size and modification
+    time of every file in it, so caches keyed by model notice a checkpoint retrained in place.
+
+    Args:
+        model_name (str): Short model name, full model ID or local path
+
+    Returns:
+        str: Hex digest for a local checkpoint, None for hub model IDs
+    """
+    path = resolve_model_id(model_name)
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha1()
+    for root, directories, files in os.walk(path):
+        directories.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            stat = os.stat(file_path)
+            digest.update(f"{os.path.relpath(file_path, path)}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode("utf-8"))
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        digest.update(f"{stat.st_size}\t{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def estimate_model_bytes(model_name, bytes_per_parameter=4, default_parameters_millions=110):
+    """
+    Estimate the memory a model needs before loading it, from its approximate parameter count.
+    
+    Args:
+        model_name (str): Short model name, full model ID or local path
+        bytes_per_parameter (int): 4 for float32, 2 for half precision
+        default_parameters_millions (int): Assumed size of models not in MODEL_PARAMETERS_MILLIONS
+        
+    Returns:
+        int: Estimated size in bytes
+    """
+    parameters = MODEL_PARAMETERS_MILLIONS.get(resolve_model_id(model_name), default_parameters_millions)
+    return int(parameters * 1e6 * bytes_per_parameter)
+
 def list_available_models():
     """
     List all available model names and their full Hugging Face model IDs.
@@ -65,5 +153,142 @@ def print_available_models():
     for name, model_id in sorted(MODEL_MAPPINGS.items()):
         print(f"{name:<20} | {model_id:<50}")
 
+def load_sentence_transformer(model_id):
+    """
+    Default loader of the model registry. sentence_transformers (and with it torch) is only
+    imported here, when the first model is actually requested.
+    """
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_id, trust_remote_code=True)
+
+def estimate_model_size(model):
+    """
+    Estimate the resident size of a loaded model in bytes from its parameters and buffers.
+    
+    Args:
+        model: Loaded model (a torch module, or an object exposing `memory_footprint` in bytes)
+        
+    Returns:
+        int: Estimated size in bytes, 0 if unknown
+    """
+    if hasattr(model, "memory_footprint"):
+        return int(model.memory_footprint)
+    if hasattr(model, "parameters"):
+        tensors = list(model.parameters())
+        if hasattr(model, "buffers"):
+            tensors += list(model.buffers())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+    return 0
+
+class ModelRegistry:
+    """
+    Lazily loads models by name and keeps the loaded ones in an LRU under a memory budget.
+    
+    Loading a model that does not fit next to the resident ones evicts the least recently used
+    models first. Sizes are estimated after loading and remembered, so a model that was loaded
+    before makes room for itself before it is reloaded. Load time, resident size, load count and
+    hits are recorded per model ID.
+    """
+    
+    def __init__(self, loader=load_sentence_transformer, memory_budget_bytes=None, size_estimator=estimate_model_size):
+        self.loader = loader
+        self.memory_budget_bytes = memory_budget_bytes
+        self.size_estimator = size_estimator
+        self.stats = {}
+        self._models = OrderedDict()
+    
+    @property
+    def resident_bytes(self):
+        return sum(self.stats[model_id]["resident_bytes"] for model_id in self._models)
+    
+    def get(self, model_name, loader=None, variant=None):
+        """
+        Return the loaded model for a name, loading it on first use.
+        
+        Args:
+            model_name (str): Short model name, full model ID or local path
+            loader (callable): Loader to use instead of the registry's on a miss
+            variant (str): Kept apart from other variants of the same model, e.g. an encode backend
+            
+        Returns:
+            The loaded model
+        """
+        model_id = resolve_model_id(model_name)
+        key = f"{model_id} [{variant}]" if variant else model_id
+        if key in self._models:
+            self._models.move_to_end(key)
+            self.stats[key]["hits"] += 1
+            return self._models[key]
+        
+        # Make room up front if the size is known from an earlier load
+        known_size = self.stats.get(key, {}).get("resident_bytes", 0)
+        self._evict_until_fits(known_size)
+        
+        start = time.perf_counter()
+        model = (loader or self.loader)(model_id)
+        load_seconds = time.perf_counter() - start
+        
+        model_stats = self.stats.setdefault(key, {"loads": 0, "hits": 0, "load_seconds": 0.0, "resident_bytes": 0})
+        model_stats["loads"] += 1
+        model_stats["load_seconds"] = load_seconds
+        model_stats["resident_bytes"] = self.size_estimator(model)
+        
+        self._evict_until_fits(model_stats["resident_bytes"])
+        self._models[key] = model
+        print(f"Loaded {key} in {load_seconds:.1f}s ({model_stats['resident_bytes'] / 1024 ** 2:.0f} MiB resident).")
+        return model
+    
+    def _evict_until_fits(self, incoming_bytes):
+        if self.memory_budget_bytes is None:
+            return
+        while self._models and self.resident_bytes + incoming_bytes > self.memory_budget_bytes:
+            self.evict(next(iter(self._models)))
+    
+    def evict(self, model_name):
+        """Drop a loaded model (or a registry key with its variant) and release its memory."""
+        key = model_name if model_name in self._models else resolve_model_id(model_name)
+        if self._models.pop(key, None) is not None:
+            print(f"Evicted {key} from the model registry.")
+            gc.collect()
+    
+    def loaded_models(self):
+        """
+        List the IDs of the resident models, least recently used first.
+        """
+        return list(self._models)
+
+_default_registry = None
+
+def get_registry(memory_budget_bytes=None):
+    """
+    Return the shared model registry, creating it on first use.
+    
+    Args:
+        memory_budget_bytes (int): Budget to set on the registry, None to keep the current one
+        
+    Returns:
+        ModelRegistry: The process-wide registry
+    """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = ModelRegistry()
+    if memory_budget_bytes is not None:
+        _default_registry.memory_budget_bytes = memory_budget_bytes
+    return _default_registry
+
+def load_model(model_name, loader=None, backend="torch"):
+    """
+    Load a model through the shared registry.
+    
+    With backend "onnx" or "onnx-int8", an ONNX Runtime encoder exported from the model (see
+    onnx_backend) is loaded instead and loader is not used.
+    """
+    if backend not in ENCODE_BACKENDS:
+        raise ValueError(f"Unknown encode backend: {backend}. Available backends: {list(ENCODE_BACKENDS)}")
+    if backend == "torch":
+        return get_registry().get(model_name, loader)
+    from onnx_backend import onnx_loader
+    return get_registry().get(model_name, onnx_loader(backend), variant=backend)
+
 if __name__ == "__main__":
     print_available_models() 
\ No newline at end of file
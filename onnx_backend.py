@@ -0,0 +1,334 @@
+"""
+ONNX Backend
+
+Optional CPU encode backend. A Sentence Transformers model (transformer, pooling and optional
+normalisation) is exported once to a single ONNX graph that maps token IDs straight to sentence
+embeddings, and optionally quantized with dynamic int8 weight quantization. Encoding then runs
+on ONNX Runtime with the `tokenizers` library, without torch, on a thread count tuned per model
+at export time. Every export is checked for parity against the original model, and the cosine
+drift is stored next to the exported graph and printed.
+
+Exports are cached under DEFAULT_ONNX_DIR per resolved model ID. Scripts select the backend with
+their encode_backend option ("torch", "onnx" or "onnx-int8"), which model_mappings.load_model
+passes to onnx_loader. onnxruntime, onnx and tokenizers are only imported when the backend is used.
+"""
+
+import inspect
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+DEFAULT_ONNX_DIR = "onnx_models"
+
+ONNX_BACKENDS = {"onnx": "model.onnx", "onnx-int8": "model.int8.onnx"}
+
+# Short and long, plain and formatted texts for the export parity check
+PARITY_TEXTS = [
+    "Hello world.",
+    "A retired teacher who volunteers at the local library and enjoys gardening.",
+    "Instruct: Recommend a good book about the history of mathematics.",
+    "Persona: A software engineer interested in distributed systems, climbing and jazz.",
+    "What is the capital of France?",
+    "The quarterly report shows a 12% increase in revenue compared to last year, driven mostly by new subscriptions.",
+    "I need help writing a cover letter for a nursing position.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "ok",
+    "Can you explain how a transformer model computes attention over a sequence of tokens, step by step, "
+    "including the role of the query, key and value projections and the softmax normalisation?",
+    "Best hiking trails near Denver for beginners?",
+    "A high school student preparing for a chemistry olympiad.",
+]
+
+
+def available_cpus():
+    """Number of CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def model_directory(model_name, onnx_dir=DEFAULT_ONNX_DIR):
+    from model_mappings import resolve_model_id
+    return os.path.join(onnx_dir, resolve_model_id(model_name).strip("/").replace("/", "__"))
+
+
+def _pooling_mode(pooling_module):
+    config = pooling_module.get_config_dict()
+    if config.get("pooling_mode"):
+        return config["pooling_mode"]
+    # Older sentence-transformers releases store one flag per mode
+    for flag, mode in (("pooling_mode_cls_token", "cls"), ("pooling_mode_mean_tokens", "mean"), ("pooling_mode_max_tokens", "max")):
+        if config.get(flag):
+            return mode
+    return None
+
+
+def export_onnx(model, output_directory, model_id=None, quantize=True, opset_version=17, parity_texts=PARITY_TEXTS, tune_texts=None,
+                checkpoint_fingerprint=None):
+    """
+    Exports a loaded SentenceTransformer to output_directory.
+
+    Writes model.onnx (float32), model.int8.onnx (with quantize=True), tokenizer.json and
+    onnx_config.json with the pooling settings, the tuned thread count and the parity of every
+    exported graph against model.encode.
+
+    Args:
+        model: SentenceTransformer made of a Transformer, a Pooling and optionally a Normalize module
+        output_directory (str): Directory receiving the exported files
+        model_id (str): ID recorded in onnx_config.json
+        quantize (bool): Also write the dynamically int8-quantized graph
+        opset_version (int): ONNX opset of the export
+        parity_texts (list): Texts encoded by both models for the parity check
+        tune_texts (list): Texts timed for thread tuning, parity_texts if None
+        checkpoint_fingerprint (str): Fingerprint of the exported local checkpoint, recorded in onnx_config.json
+
+    Returns:
+        dict: The written onnx_config.json
+    """
+    import torch
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    modules = list(model)
+    module_names = [type(module).__name__ for module in modules]
+    pooling_mode = _pooling_mode(modules[1]) if module_names[:2] == ["Transformer", "Pooling"] else None
+    if pooling_mode not in ("mean", "cls", "max") or any(name != "Normalize" for name in module_names[2:]):
+        raise ValueError(f"The ONNX backend exports Transformer + Pooling (mean, cls or max) + Normalize models, not {module_names}.")
+    normalize = "Normalize" in module_names
+    transformer = modules[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    if not getattr(tokenizer, "is_fast", False):
+        raise ValueError("The ONNX backend needs a fast (tokenizers-based) tokenizer.")
+    input_names = ["input_ids", "attention_mask"]
+    if "token_type_ids" in tokenizer.model_input_names and "token_type_ids" in inspect.signature(transformer.forward).parameters:
+        input_names.append("token_type_ids")
+
+    class SentenceEmbeddingGraph(torch.nn.Module):
+        # Transformer, pooling and normalisation in one graph, so the runtime needs no torch
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if token_type_ids is not None:
+                inputs["token_type_ids"] = token_type_ids
+            hidden = self.transformer(**inputs).last_hidden_state
+            mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+            if pooling_mode == "cls":
+                pooled = hidden[:, 0]
+            elif pooling_mode == "max":
+                pooled = (hidden - (1 - mask) * 1e9).max(dim=1).values
+            else:
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            return torch.nn.functional.normalize(pooled, p=2, dim=1) if normalize else pooled
+
+    os.makedirs(output_directory, exist_ok=True)
+    float_path = os.path.join(output_directory, ONNX_BACKENDS["onnx"])
+    sample = tokenizer(["an example input", "a second, slightly longer example input"], padding=True, return_tensors="pt")
+    # The TorchScript-based exporter handles the dynamic batch and sequence axes of all common encoders
+    export_options = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(
+            SentenceEmbeddingGraph(),
+            tuple(sample[name] for name in input_names),
+            float_path,
+            input_names=input_names,
+            output_names=["sentence_embedding"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names}, "sentence_embedding": {0: "batch"}},
+            opset_version=opset_version,
+            **export_options
+        )
+    if quantize:
+        # Weights of the matrix multiplications to int8; activations are quantized on the fly
+        quantize_dynamic(
+            float_path,
+            os.path.join(output_directory, ONNX_BACKENDS["onnx-int8"]),
+            weight_type=QuantType.QInt8,
+            op_types_to_quantize=["MatMul"],
+            extra_options={"DefaultTensorType": onnx.TensorProto.FLOAT}
+        )
+    tokenizer.save_pretrained(output_directory)
+
+    config = {
+        "model_id": model_id,
+        "checkpoint_fingerprint": checkpoint_fingerprint,
+        "input_names": input_names,
+        "pooling_mode": pooling_mode,
+        "normalize": normalize,
+        "max_seq_length": int(model.max_seq_length or tokenizer.model_max_length),
+        "pad_token_id": int(tokenizer.pad_token_id or 0),
+        "pad_token": tokenizer.pad_token or "[PAD]",
+        "dimension": int(model.get_sentence_embedding_dimension()),
+        "num_threads": {},
+        "parity": {}
+    }
+    with open(os.path.join(output_directory, "onnx_config.json"), "w", encoding="utf-8") as config_file:
+        json.dump(config, config_file, indent=2)
+
+    reference = np.asarray(model.encode(list(parity_texts)), dtype=np.float32)
+    for backend in ONNX_BACKENDS:
+        if not os.path.exists(os.path.join(output_directory, ONNX_BACKENDS[backend])):
+            continue
+        config["num_threads"][backend], _ = tune_num_threads(output_directory, backend, tune_texts or parity_texts)
+        encoder = OnnxEncoder(output_directory, backend, num_threads=config["num_threads"][backend])
+        config["parity"][backend] = check_parity(reference, encoder.encode(list(parity_texts)))
+        print(
+            f"ONNX parity ({backend}): mean cosine drift {config['parity'][backend]['mean_cosine_drift']:.2e}, "
+            f"max {config['parity'][backend]['max_cosine_drift']:.2e} over {len(parity_texts)} texts."
+        )
+    with open(os.path.join(output_directory, "onnx_config.json"), "w", encoding="utf-8") as config_file:
+        json.dump(config, config_file, indent=2)
+    return config
+
+
+def check_parity(reference_embeddings, embeddings):
+    """
+    Compares embeddings of the same texts from the original and an exported model.
+
+    Returns:
+        dict: Mean and max cosine drift (1 - cosine similarity) and max absolute difference
+    """
+    reference_embeddings = np.asarray(reference_embeddings, dtype=np.float32)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    cosine = np.sum(reference_embeddings * embeddings, axis=1) / np.maximum(
+        np.linalg.norm(reference_embeddings, axis=1) * np.linalg.norm(embeddings, axis=1), 1e-12
+    )
+    # Rounding can put the cosine of identical directions slightly above 1
+    drift = np.maximum(1 - cosine, 0.0)
+    return {
+        "mean_cosine_drift": float(np.mean(drift)),
+        "max_cosine_drift": float(np.max(drift)),
+        "max_abs_difference": float(np.max(np.abs(reference_embeddings - embeddings))),
+        "num_texts": len(cosine)
+    }
+
+
+def tune_num_threads(directory, backend, texts, candidates=None, batch_size=32):
+    """
+    Times encoding texts with each candidate intra-op thread count.
+
+    Returns:
+        tuple: (fastest thread count, {thread count: sentences per second})
+    """
+    cpus = available_cpus()
+    candidates = candidates or sorted({count for count in (1, 2, 4, 8, 16, 32, cpus) if count <= cpus})
+    throughput = {}
+    for num_threads in candidates:
+        encoder = OnnxEncoder(directory, backend, num_threads=num_threads)
+        encoder.encode(texts[:batch_size], batch_size=batch_size)
+        start = time.perf_counter()
+        encoder.encode(texts, batch_size=batch_size)
+        throughput[num_threads] = len(texts) / (time.perf_counter() - start)
+    return max(throughput, key=throughput.get), throughput
+
+
+class OnnxEncoder:
+    """
+    Sentence encoder running an exported graph on ONNX Runtime, with an encode method like
+    SentenceTransformer.encode.
+
+    Args:
+        directory (str): Directory written by export_onnx
+        backend (str): "onnx" (float32) or "onnx-int8"
+        num_threads (int): Intra-op threads, the tuned count from the export if None
+    """
+
+    def __init__(self, directory, backend="onnx-int8", num_threads=None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(directory, "onnx_config.json"), "r", encoding="utf-8") as config_file:
+            self.config = json.load(config_file)
+        self.backend = backend
+        self.model_path = os.path.join(directory, ONNX_BACKENDS[backend])
+        self.num_threads = num_threads or self.config["num_threads"].get(backend) or available_cpus()
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = self.num_threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+    @property
+    def memory_footprint(self):
+        """Size of the graph file, for the model registry."""
+        return os.path.getsize(self.model_path)
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        """
+        Returns a (len(texts), dim) float32 array of sentence embeddings.
+
+        Texts are batched in order of length, so little compute is spent on padding.
+        """
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        embeddings = np.empty((len(texts), self.config["dimension"]), dtype=np.float32)
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), batch_size):
+            batch_indices = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in batch_indices])
+            feeds = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            }
+            if "token_type_ids" in self.config["input_names"]:
+                feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+            embeddings[batch_indices] = self.session.run(None, feeds)[0]
+        return embeddings
+
+
+def _export_fingerprint(directory):
+    """Checkpoint fingerprint recorded by the export in directory, None for hub models and unfinished exports."""
+    config_path = os.path.join(directory, "onnx_config.json")
+    if not os.path.exists(config_path):
+        return None
+    with open(config_path, "r", encoding="utf-8") as config_file:
+        return json.load(config_file).get("checkpoint_fingerprint")
+
+
+def load_onnx_model(model_name, backend="onnx-int8", onnx_dir=DEFAULT_ONNX_DIR, num_threads=None):
+    """
+    Returns an OnnxEncoder for a model, exporting the model on first use.
+
+    Exports of local checkpoints record the checkpoint fingerprint and are redone when the
+    checkpoint's files change.
+
+    Args:
+        model_name (str): Short name, model ID or local path (resolved with resolve_model_id)
+        backend (str): "onnx" or "onnx-int8"
+        onnx_dir (str): Root directory of the exports
+        num_threads (int): Intra-op threads, the tuned count if None
+    """
+    from model_mappings import checkpoint_fingerprint, load_sentence_transformer, resolve_model_id
+
+    if backend not in ONNX_BACKENDS:
+        raise ValueError(f"Unknown ONNX backend: {backend}. Use one of {list(ONNX_BACKENDS)}.")
+    directory = model_directory(model_name, onnx_dir)
+    fingerprint = checkpoint_fingerprint(model_name)
+    if os.path.isdir(directory) and _export_fingerprint(directory) != fingerprint:
+        # The checkpoint changed since it was exported; no graph of the old export is reused
+        print(f"Checkpoint {resolve_model_id(model_name)} changed since its ONNX export; re-exporting.")
+        shutil.rmtree(directory)
+    if not os.path.exists(os.path.join(directory, ONNX_BACKENDS[backend])):
+        model_id = resolve_model_id(model_name)
+        print(f"Exporting {model_id} to ONNX in {directory}...")
+        export_onnx(load_sentence_transformer(model_id), directory, model_id, quantize=backend == "onnx-int8",
+                    checkpoint_fingerprint=fingerprint)
+    return OnnxEncoder(directory, backend, num_threads)
+
+
+def onnx_loader(backend, onnx_dir=DEFAULT_ONNX_DIR, num_threads=None):
+    """Model loader for ModelRegistry that returns ONNX encoders."""
+    return lambda model_id: load_onnx_model(model_id, backend, onnx_dir, num_threads)
@@ -1,77 +1,403 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import data_loader
 import language_model_api
-import file_writer
-from prompt_templates import get_template
+from prompt_templates import get_template_by_name
+from instrumentation import profile_run, span
+from concurrent_synthesis import AsyncLanguageModelClient, RateLimiter, estimate_tokens, iterate_concurrently
+from response_cache import CachedLanguageModelAPI, ResponseCache, sample_api
+from streaming_output import StreamingJsonlWriter, persona_hash
 
-def synthesize_data(template_type, num_samples, output_file):
+def load_personas(num_samples, personas_path="path/to/persona/dataset"):
     """
-    Generates synthetic data using a language model based on a specified template and personas.
+    Loads the persona dataset, optionally limited to the first num_samples personas.
     """
-    
-    # Load the dataset of personas
-    personas_dataset = data_loader.load_personas("path/to/persona/dataset")
+    personas_dataset = data_loader.load_personas(personas_path)
     if num_samples > 0:
         personas_dataset = personas_dataset.select(range(num_samples))
-    
-    # Select the appropriate prompt template
-    prompt_template = get_template(template_type)
+    return personas_dataset
+
+def load_prompt_template(template_type):
+    """
+    Returns the prompt template for the given type, raising if it does not exist.
+    """
+    # Dialog records are generated from the dialog_start/dialog_continue templates
+    prompt_template = get_template_by_name("dialog_start" if template_type == "dialog" else template_type)
     if not prompt_template:
         raise ValueError(f"Template '{template_type}' not found.")
-        
-    # List to hold the generated data
-    generated_results = []
-    
-    # Process each persona in the dataset
-    for persona in personas_dataset:
+    return prompt_template
+
+def open_language_model_api(template_type, cache_path=None, model_name=None):
+    """
+    Returns the language model API to synthesize with, wrapped in a response cache if a
+    cache path is given, together with the cache (or None).
+
+    model_name is the model language_model_api is configured with; it is part of the cache key
+    so responses of different models are never mixed up.
+    """
+    if not cache_path:
+        return language_model_api, None
+    if model_name is None:
+        print("Warning: no model_name given, cached responses are not keyed by model.")
+    cache = ResponseCache(cache_path)
+    return CachedLanguageModelAPI(language_model_api, cache, model=model_name, template_name=template_type), cache
+
+def iter_pending_personas(personas_dataset, writer, deduplicate=True):
+    """
+    Yields (index, persona text) for the personas that still have to be generated.
+
+    Personas already in the output are skipped, and with deduplicate=True so are repeated
+    occurrences of a persona text seen earlier in the dataset.
+    """
+    seen_hashes = set()
+    for index, persona in enumerate(personas_dataset):
         persona_text = persona.get("text").strip()
-        
-        if template_type == "dialog":
-            # Special handling for generating multi-turn dialogs
-            dialogs = generate_dialogs_for_persona(persona_text)
-            result = {"input_persona": persona_text, "dialogs": dialogs}
-        else:
-            # For simpler, single-response templates
-            prompt = prompt_template.format(persona=persona_text)
-            generated_text = language_model_api.generate_response(prompt)
-            result = {"input_persona": persona_text, "synthesized_text": generated_text}
-            
-        generated_results.append(result)
-        
-    # Write all the generated results to a JSONL file
-    file_writer.write_to_jsonl(output_file, generated_results)
-    print(f"Synthetic data generation complete. Results saved to {output_file}.")
+        if deduplicate:
+            digest = persona_hash(persona_text)
+            if digest in seen_hashes:
+                continue
+            seen_hashes.add(digest)
+        if writer.is_done(index, persona_text):
+            continue
+        yield index, persona_text
+
+def report_cache(cache):
+    """Prints the hit/miss counters of a response cache and closes it."""
+    if cache is None:
+        return
+    stats = cache.stats()
+    print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate).")
+    cache.close()
 
-def generate_dialogs_for_persona(persona_text, num_dialogs=3, max_turns=4):
+def synthesize_data(
+    template_type,
+    num_samples,
+    output_file,
+    resume=True,
+    cache_path=None,
+    deduplicate=True,
+    instrument=False,
+    personas_path="path/to/persona/dataset",
+    max_history_tokens=None,
+    model_name=None
+):
     """
-    Generates a set of multi-turn dialogs for a given persona.
+    Generates synthetic data using a language model based on a specified template and personas.
+
+    Records are streamed to the output file as they are generated. With resume=True, personas
+    already listed in the output's progress manifest are skipped. With a cache_path, responses
+    are served from a persistent cache when the same request was made before; model_name keys
+    the cache by the model the language model API is configured with.
+
+    With instrument=True (or PIPELINE_INSTRUMENTATION set), per-stage timings and memory are
+    written to <output_file>.spans.json. max_history_tokens caps the dialog history included in
+    each prompt of dialog records.
     """
-    all_dialogs = []
-    start_template = get_template("dialog_start")
-    continue_template = get_template("dialog_continue")
     
-    for _ in range(num_dialogs):
-        dialog_history = []
-        
-        # Start the dialog with the persona's first message
-        first_prompt = start_template.format(persona=persona_text)
-        persona_message = language_model_api.generate_response(first_prompt)
-        dialog_history.append({"speaker": "user", "message": persona_message})
+    with profile_run("synthesize_data", f"{output_file}.spans.json", instrument):
+        # Load the dataset of personas
+        with span("load_personas") as load_span:
+            personas_dataset = load_personas(num_samples, personas_path)
+            load_span.add_items(len(personas_dataset))
         
-        # Continue the conversation for a random number of turns
-        for _ in range(max_turns - 1):
-            # The assistant responds to the user
-            assistant_message = language_model_api.generate_conversation_response(dialog_history)
-            dialog_history.append({"speaker": "assistant", "message": assistant_message})
-            
-            # The user (persona) responds to the assistant
-            history_str = format_dialog_history(dialog_history)
-            next_prompt = continue_template.format(persona=persona_text, history=history_str)
-            persona_message = language_model_api.generate_response(next_prompt)
-            dialog_history.append({"speaker": "user", "message": persona_message})
+        # Select the appropriate prompt template
+        prompt_template = load_prompt_template(template_type)
+        api, cache = open_language_model_api(template_type, cache_path, model_name)
             
-        all_dialogs.append(dialog_history)
-        
-    return all_dialogs
+        try:
+            with StreamingJsonlWriter(output_file, resume=resume) as writer, span("generate") as generate_span:
+                skipped = writer.num_completed
+
+                # Process each persona in the dataset, writing each result as soon as it is ready
+                for index, persona_text in iter_pending_personas(personas_dataset, writer, deduplicate):
+                    result = synthesize_record(
+                        persona_text, template_type, prompt_template, api=api, max_history_tokens=max_history_tokens
+                    )
+                    writer.write(index, persona_text, result)
+                generate_span.add_items(writer.records_written)
+        finally:
+            report_cache(cache)
+
+    print(
+        f"Synthetic data generation complete ({writer.records_written} new, {skipped} resumed). "
+        f"Results saved to {output_file}."
+    )
+
+def synthesize_record(persona_text, template_type, prompt_template, api=language_model_api, max_history_tokens=None):
+    """
+    Generates the output record for a single persona.
+    """
+    if template_type == "dialog":
+        # Special handling for generating multi-turn dialogs
+        dialogs = generate_dialogs_for_persona(persona_text, api=api, max_history_tokens=max_history_tokens)
+        return {"input_persona": persona_text, "dialogs": dialogs}
+
+    # For simpler, single-response templates
+    prompt = prompt_template.format(persona=persona_text)
+    generated_text = api.generate_response(prompt)
+    return {"input_persona": persona_text, "synthesized_text": generated_text}
+
+def synthesize_data_async(
+    template_type,
+    num_samples,
+    output_file,
+    max_in_flight=16,
+    requests_per_minute=None,
+    tokens_per_minute=None,
+    max_retries=5,
+    ordered=True,
+    resume=True,
+    cache_path=None,
+    deduplicate=True,
+    instrument=False,
+    personas_path="path/to/persona/dataset",
+    max_history_tokens=None,
+    model_name=None
+):
+    """
+    Concurrent variant of synthesize_data that keeps up to max_in_flight requests in flight.
+
+    Requests are throttled to the given request/token per-minute budgets and retried with
+    jittered backoff. With ordered=False results are written in completion order. instrument,
+    max_history_tokens and model_name work as in synthesize_data.
+    """
+    with profile_run("synthesize_data_async", f"{output_file}.spans.json", instrument):
+        with span("load_personas") as load_span:
+            personas_dataset = load_personas(num_samples, personas_path)
+            load_span.add_items(len(personas_dataset))
+        prompt_template = load_prompt_template(template_type)
+        api, cache = open_language_model_api(template_type, cache_path, model_name)
+
+        client = AsyncLanguageModelClient(
+            api,
+            max_in_flight=max_in_flight,
+            rate_limiter=RateLimiter(requests_per_minute, tokens_per_minute),
+            max_retries=max_retries
+        )
+
+        async def worker(indexed_persona):
+            index, persona_text = indexed_persona
+            record = await synthesize_record_async(
+                persona_text, template_type, prompt_template, client, max_history_tokens=max_history_tokens
+            )
+            return index, persona_text, record
+
+        with StreamingJsonlWriter(output_file, resume=resume) as writer, span("generate") as generate_span:
+            skipped = writer.num_completed
+            # Personas are pulled lazily so memory stays bounded by the number of tasks in flight
+            pending_personas = iter_pending_personas(personas_dataset, writer, deduplicate)
+
+            async def stream():
+                records = iterate_concurrently(pending_personas, worker, max_in_flight, ordered=ordered)
+                async for _, (index, persona_text, record) in records:
+                    writer.write(index, persona_text, record)
+
+            try:
+                asyncio.run(stream())
+            finally:
+                client.close()
+                report_cache(cache)
+            generate_span.add_items(writer.records_written)
+
+    print(
+        f"Synthetic data generation complete ({writer.records_written} new, {skipped} resumed, "
+        f"{client.requests_completed} requests, {client.cache_hits} cache hits, {client.retries} retries). "
+        f"Results saved to {output_file}."
+    )
+
+def synthesize_records_async(
+    persona_texts, template_type, prompt_template, client, concurrency, ordered=True, max_history_tokens=None
+):
+    """
+    Asynchronously generates records for a stream of persona texts.
+
+    Yields (persona index, record) pairs, at most `concurrency` personas being processed at once.
+    """
+    async def worker(persona_text):
+        return await synthesize_record_async(
+            persona_text, template_type, prompt_template, client, max_history_tokens=max_history_tokens
+        )
+
+    return iterate_concurrently(persona_texts, worker, concurrency, ordered=ordered)
+
+async def synthesize_record_async(persona_text, template_type, prompt_template, client, max_history_tokens=None):
+    """
+    Awaitable counterpart of synthesize_record using an AsyncLanguageModelClient.
+    """
+    if template_type == "dialog":
+        dialogs = await generate_dialogs_for_persona_async(
+            persona_text, client, max_history_tokens=max_history_tokens
+        )
+        return {"input_persona": persona_text, "dialogs": dialogs}
+
+    prompt = prompt_template.format(persona=persona_text)
+    generated_text = await client.generate_response(prompt)
+    return {"input_persona": persona_text, "synthesized_text": generated_text}
+
+def generate_dialogs_for_persona(
+    persona_text,
+    num_dialogs=3,
+    max_turns=4,
+    api=language_model_api,
+    max_history_tokens=None,
+    max_workers=None
+):
+    """
+    Generates a set of multi-turn dialogs for a given persona.
+
+    The dialogs are independent, so they advance concurrently on up to max_workers threads
+    (one per dialog by default). max_history_tokens caps the history included in each prompt.
+    """
+    start_template = get_template_by_name("dialog_start")
+    continue_template = get_template_by_name("dialog_continue")
+
+    def run_dialog(dialog_index):
+        # Each dialog is a separate sample, so cached runs keep the dialogs distinct
+        dialog_api = sample_api(api, dialog_index)
+        return generate_dialog(persona_text, start_template, continue_template, max_turns, dialog_api, max_history_tokens)
+
+    if num_dialogs <= 1 or max_workers == 1:
+        return [run_dialog(i) for i in range(num_dialogs)]
+
+    with ThreadPoolExecutor(max_workers=max_workers or num_dialogs) as executor:
+        return list(executor.map(run_dialog, range(num_dialogs)))
+
+def generate_dialog(persona_text, start_template, continue_template, max_turns, api, max_history_tokens=None):
+    """
+    Generates a single multi-turn dialog, rendering the history incrementally.
+    """
+    dialog_history = DialogHistory(max_history_tokens)
+    # Prompts are cached under the name of the template they were rendered from
+    start_api = sample_api(api, template_name="dialog_start")
+    continue_api = sample_api(api, template_name="dialog_continue")
+
+    # Start the dialog with the persona's first message
+    first_prompt = start_template.format(persona=persona_text)
+    persona_message = start_api.generate_response(first_prompt)
+    dialog_history.append("user", persona_message)
+
+    # Continue the conversation for a random number of turns
+    for _ in range(max_turns - 1):
+        # The assistant responds to the user
+        assistant_message = api.generate_conversation_response(dialog_history.window_turns())
+        dialog_history.append("assistant", assistant_message)
+
+        # The user (persona) responds to the assistant
+        next_prompt = continue_template.format(persona=persona_text, conversation_history=dialog_history.render())
+        persona_message = continue_api.generate_response(next_prompt)
+        dialog_history.append("user", persona_message)
+
+    return dialog_history.turns
+
+async def generate_dialogs_for_persona_async(persona_text, client, num_dialogs=3, max_turns=4, max_history_tokens=None):
+    """
+    Awaitable counterpart of generate_dialogs_for_persona using an AsyncLanguageModelClient.
+
+    All dialogs advance concurrently; the client's in-flight limit schedules their turns.
+    """
+    start_template = get_template_by_name("dialog_start")
+    continue_template = get_template_by_name("dialog_continue")
+
+    return list(await asyncio.gather(*[
+        generate_dialog_async(
+            persona_text, start_template, continue_template, max_turns, client, max_history_tokens, dialog_index
+        )
+        for dialog_index in range(num_dialogs)
+    ]))
+
+async def generate_dialog_async(
+    persona_text,
+    start_template,
+    continue_template,
+    max_turns,
+    client,
+    max_history_tokens=None,
+    sample_index=None
+):
+    """
+    Awaitable counterpart of generate_dialog using an AsyncLanguageModelClient.
+    """
+    dialog_history = DialogHistory(max_history_tokens)
+
+    first_prompt = start_template.format(persona=persona_text)
+    persona_message = await client.generate_response(first_prompt, sample_index=sample_index, template_name="dialog_start")
+    dialog_history.append("user", persona_message)
+
+    for _ in range(max_turns - 1):
+        assistant_message = await client.generate_conversation_response(
+            dialog_history.window_turns(), sample_index=sample_index
+        )
+        dialog_history.append("assistant", assistant_message)
+
+        next_prompt = continue_template.format(persona=persona_text, conversation_history=dialog_history.render())
+        persona_message = await client.generate_response(
+            next_prompt, sample_index=sample_index, template_name="dialog_continue"
+        )
+        dialog_history.append("user", persona_message)
+
+    return dialog_history.turns
+
+class DialogHistory:
+    """
+    Dialog turns together with their incrementally rendered history string.
+
+    Each turn is formatted once when appended. With max_tokens set, only the most recent turns
+    that fit into the (estimated) token budget are rendered and older turns are replaced by a
+    short note, so prompt size stays bounded however long the dialog grows.
+    """
+
+    def __init__(self, max_tokens=None):
+        self.max_tokens = max_tokens
+        self.turns = []
+        self._lines = []
+        self._line_tokens = []
+        self._window_start = 0
+        self._window_tokens = 0
+        self._rendered = ""
+        self._rendered_until = 0
+
+    def append(self, speaker, message):
+        """Add a turn to the dialog."""
+        turn = {"speaker": speaker, "message": message}
+        line = format_dialog_history([turn])
+        tokens = estimate_tokens(line)
+        self.turns.append(turn)
+        self._lines.append(line)
+        self._line_tokens.append(tokens)
+        self._window_tokens += tokens
+
+        if self.max_tokens:
+            # Keep at least the newest turn even if it alone exceeds the budget
+            while self._window_tokens > self.max_tokens and self._window_start < len(self._lines) - 1:
+                self._window_tokens -= self._line_tokens[self._window_start]
+                self._window_start += 1
+
+    def window_turns(self):
+        """
+        Returns the turns inside the history window.
+        """
+        return self.turns[self._window_start:]
+
+    def render(self):
+        """
+        Returns the history string for the turns inside the window.
+        """
+        if not self.max_tokens:
+            # Only the turns added since the last call are formatted and appended
+            new_lines = self._lines[self._rendered_until:]
+            if new_lines:
+                separator = "\n" if self._rendered else ""
+                self._rendered += separator + "\n".join(new_lines)
+                self._rendered_until = len(self._lines)
+            return self._rendered
+
+        window = self._lines[self._window_start:]
+        if self._window_start:
+            window = [f"[{self._window_start} earlier turns omitted]"] + window
+        return "\n".join(window)
 
 def format_dialog_history(dialog):
     """
@@ -79,6 +405,44 @@ def format_dialog_history(dialog):
     """
     return "\n".join([f"{turn['speaker']}: {turn['message']}" for turn in dialog])
 
+def synthetic_to_pairs(source_path, destination_path):
+    """
+    Converts synthesized records into (instruction, input) rows for classification and training.
+
+    A single-response record (input_persona, synthesized_text) becomes one row whose instruction
+    is the generated text; a dialog record becomes one row per dialog whose instruction is the
+    rendered dialog. The input is always the persona. Rows are streamed to a JSONL file, which
+    only appears under destination_path once it is complete.
+
+    Args:
+        source_path (str): JSONL output of synthesize_data or synthesize_data_async
+        destination_path (str): JSONL file receiving {"instruction", "input"} rows
+
+    Returns:
+        int: Number of rows written
+    """
+    destination_dir = os.path.dirname(destination_path)
+    if destination_dir:
+        os.makedirs(destination_dir, exist_ok=True)
+    num_rows = 0
+    temporary_path = f"{destination_path}.tmp"
+    with open(source_path, "r", encoding="utf-8") as source_file, open(temporary_path, "w", encoding="utf-8") as destination_file:
+        for line in source_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "dialogs" in record:
+                instructions = [format_dialog_history(dialog) for dialog in record["dialogs"]]
+            else:
+                instructions = [record["synthesized_text"]]
+            for instruction in instructions:
+                row = {"instruction": instruction, "input": record["input_persona"]}
+                destination_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                num_rows += 1
+    os.replace(temporary_path, destination_path)
+    print(f"Converted {num_rows} rows from {source_path} to {destination_path}.")
+    return num_rows
+
 def main():
     """
     Main function to configure and run the data synthesis process.
@@ -87,9 +451,24 @@ def main():
     template_choice = "instruction"  # e.g., 'instruction', 'knowledge', 'dialog'
     number_of_samples = 50  # 0 for all samples
     output_path = "output/synthesized_data.jsonl"
+    use_async = False  # Run requests concurrently instead of one at a time
+    cache_path = "output/response_cache.sqlite"  # None to always call the language model
+    model_name = "gpt-4o"  # Model language_model_api is configured with, part of the cache key
     
     # Execute the synthesis
-    synthesize_data(template_choice, number_of_samples, output_path)
+    if use_async:
+        synthesize_data_async(
+            template_choice,
+            number_of_samples,
+            output_path,
+            max_in_flight=32,
+            requests_per_minute=3000,
+            tokens_per_minute=1000000,
+            cache_path=cache_path,
+            model_name=model_name
+        )
+    else:
+        synthesize_data(template_choice, number_of_samples, output_path, cache_path=cache_path, model_name=model_name)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
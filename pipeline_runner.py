@@ -0,0 +1,494 @@
+"""
+Pipeline Runner
+
+Runs the scripts as one pipeline (synthesize -> classify -> train -> evaluate -> plot) modelled
+as a DAG of stages. A stage names the function it calls, its keyword arguments, the files it
+reads and the files it writes; an edge runs from the stage writing a file to every stage reading
+it. Each stage is fingerprinted from the content of its input files, its arguments, extra
+inputs such as model IDs and prompt template text, and the source of the script it calls and of
+every project module that script imports, directly or indirectly. A
+stage whose fingerprint matches the last successful run and whose outputs are unchanged is
+skipped, so only stages downstream of a change are re-run. Stages whose inputs are ready run in
+parallel worker processes.
+
+File hashes are cached by (size, modification time), so an up-to-date pipeline is checked
+without re-reading its datasets or model checkpoints.
+"""
+
+import ast
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+DEFAULT_STATE_DIR = "cache/pipeline"
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Args:
+        name (str): Unique stage name
+        target (str): "module:function" to call, e.g. "data_classifier:classify_dataset"
+        kwargs (dict): Keyword arguments of the call; must be JSON-serialisable
+        inputs (list): Files or directories the stage reads
+        outputs (list): Files or directories the stage writes
+        extra (dict): Further fingerprint inputs, e.g. resolved model IDs or template text
+    """
+
+    def __init__(self, name, target, kwargs=None, inputs=None, outputs=None, extra=None):
+        self.name = name
+        self.target = target
+        self.kwargs = kwargs or {}
+        self.inputs = list(inputs or [])
+        self.outputs = list(outputs or [])
+        self.extra = extra or {}
+
+    def source_paths(self):
+        """Source files of the target's module and of the project modules it imports."""
+        return project_module_paths(self.target.split(":")[0])
+
+
+def project_module_paths(module_name):
+    """
+    Source files of a module and of every project module it imports, directly or indirectly
+    (including imports inside functions), found by parsing the sources without importing them.
+    Project modules are the top-level modules next to the module's own file; the standard
+    library and installed packages are left out.
+
+    Args:
+        module_name (str): Top-level module, e.g. "input_instruction_retrieval"
+
+    Returns:
+        dict: Module name to source path, empty if the module cannot be found
+    """
+    spec = importlib.util.find_spec(module_name)
+    if spec is None or not spec.origin or not spec.origin.endswith(".py"):
+        return {}
+    project_directory = os.path.dirname(os.path.abspath(spec.origin))
+    paths = {}
+    pending = [module_name]
+    while pending:
+        name = pending.pop()
+        path = os.path.join(project_directory, f"{name}.py")
+        if name in paths or not os.path.isfile(path):
+            continue
+        paths[name] = path
+        with open(path, "r", encoding="utf-8") as source_file:
+            tree = ast.parse(source_file.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name.split(".")[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                pending.append(node.module.split(".")[0])
+    return paths
+
+
+def _run_stage(target, kwargs):
+    # Runs in a worker process; stage modules are only imported there
+    module_name, function_name = target.split(":")
+    function = getattr(importlib.import_module(module_name), function_name)
+    start = time.perf_counter()
+    function(**kwargs)
+    return time.perf_counter() - start
+
+
+class FileHashCache:
+    """
+    SHA-256 digests of files and directories, cached by path, size and modification time in a
+    JSON file so that unchanged files are not read again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as cache_file:
+                self.entries = json.load(cache_file)
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as input_file:
+            for block in iter(lambda: input_file.read(1 << 20), b""):
+                digest.update(block)
+        self.entries[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def digest(self, path):
+        """
+        Digest of a file, or of the relative paths and digests of all files in a directory;
+        None if the path does not exist.
+        """
+        if os.path.isfile(path):
+            return self.file_digest(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for directory, subdirectories, files in os.walk(path):
+            subdirectories.sort()
+            for name in sorted(files):
+                file_path = os.path.join(directory, name)
+                digest.update(f"{os.path.relpath(file_path, path)}\n{self.file_digest(file_path)}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as cache_file:
+            json.dump(self.entries, cache_file)
+        os.replace(temporary_path, self.path)
+
+
+class Pipeline:
+    """
+    A DAG of stages with the state of their last successful runs under state_dir.
+    """
+
+    def __init__(self, stages, state_dir=DEFAULT_STATE_DIR):
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique.")
+        self.state_dir = state_dir
+        self.hashes = FileHashCache(os.path.join(state_dir, "file_hashes.json"))
+
+        self.producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"{output} is written by both {self.producers[output]} and {stage.name}.")
+                self.producers[output] = stage.name
+        self.dependencies = {
+            stage.name: sorted({self.producers[path] for path in stage.inputs if path in self.producers})
+            for stage in stages
+        }
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"The pipeline has a cycle through stage {name}.")
+            visiting.add(name)
+            for dependency in self.dependencies[name]:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def fingerprint(self, stage):
+        """
+        Hash of everything the stage's outputs depend on. Inputs written by other stages must exist.
+        """
+        description = {
+            "target": stage.target,
+            "kwargs": stage.kwargs,
+            "extra": stage.extra,
+            "source": {name: self.hashes.digest(path) for name, path in stage.source_paths().items()},
+            "inputs": {path: self.hashes.digest(path) for path in stage.inputs}
+        }
+        # Inputs not written by any stage may name remote datasets; those are keyed by name only
+        missing = [path for path, digest in description["inputs"].items() if digest is None and path in self.producers]
+        if missing:
+            raise FileNotFoundError(f"Inputs of stage {stage.name} do not exist: {', '.join(missing)}")
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _state_path(self, stage):
+        return os.path.join(self.state_dir, "stages", f"{stage.name}.json")
+
+    def is_up_to_date(self, stage, fingerprint):
+        """
+        True if the last successful run had this fingerprint and its outputs are unchanged.
+        """
+        state_path = self._state_path(stage)
+        if not os.path.exists(state_path):
+            return False
+        with open(state_path, "r", encoding="utf-8") as state_file:
+            state = json.load(state_file)
+        if state["fingerprint"] != fingerprint:
+            return False
+        return all(self.hashes.digest(path) == state["outputs"].get(path) for path in stage.outputs)
+
+    def _record(self, stage, fingerprint, seconds):
+        missing = [path for path in stage.outputs if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"Stage {stage.name} did not write: {', '.join(missing)}")
+        state = {
+            "fingerprint": fingerprint,
+            "outputs": {path: self.hashes.digest(path) for path in stage.outputs},
+            "seconds": seconds,
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        os.makedirs(os.path.dirname(self._state_path(stage)), exist_ok=True)
+        with open(self._state_path(stage), "w", encoding="utf-8") as state_file:
+            json.dump(state, state_file, indent=2)
+
+    def run(self, max_workers=None, force=(), dry_run=False):
+        """
+        Runs every stage that is not up to date, each as soon as the stages writing its inputs
+        have finished, on up to max_workers worker processes.
+
+        With dry_run=True nothing is run; stages that would run are reported as "stale" and
+        stages depending on them as "waiting".
+
+        Args:
+            max_workers (int): Worker processes, os.cpu_count() if None
+            force (list): Names of stages to run even if up to date
+            dry_run (bool): Only report what would run
+
+        Returns:
+            dict: Stage name to {"status": "ran" | "skipped" | "failed" | "blocked" | "stale" |
+                "waiting", "seconds": ...}
+        """
+        start = time.perf_counter()
+        report = {}
+        pending = list(self.stages)
+        running = {}
+
+        def finished(name):
+            return report.get(name, {}).get("status") in ("ran", "skipped")
+
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=get_context("spawn")) as pool:
+            while pending or running:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    dependencies = self.dependencies[name]
+                    if any(report.get(dependency, {}).get("status") in ("failed", "blocked", "stale", "waiting") for dependency in dependencies):
+                        blocked_status = "waiting" if dry_run else "blocked"
+                        report[name] = {"status": blocked_status, "seconds": 0.0}
+                        pending.remove(name)
+                    elif all(finished(dependency) for dependency in dependencies):
+                        pending.remove(name)
+                        fingerprint = self.fingerprint(stage)
+                        if name not in force and self.is_up_to_date(stage, fingerprint):
+                            report[name] = {"status": "skipped", "seconds": 0.0}
+                        elif dry_run:
+                            report[name] = {"status": "stale", "seconds": 0.0}
+                        else:
+                            print(f"Running stage {name}...")
+                            running[pool.submit(_run_stage, stage.target, stage.kwargs)] = (name, fingerprint)
+                if not running:
+                    # Stages skipped in this pass may have unblocked others
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, fingerprint = running.pop(future)
+                    try:
+                        seconds = future.result()
+                        self._record(self.stages[name], fingerprint, seconds)
+                        report[name] = {"status": "ran", "seconds": seconds}
+                        print(f"Stage {name} finished in {seconds:.1f}s.")
+                    except Exception as error:
+                        report[name] = {"status": "failed", "seconds": 0.0, "error": repr(error)}
+                        print(f"Stage {name} failed: {error!r}")
+                # Outputs of finished stages are hashed now, while their sizes and times are fresh
+                self.hashes.save()
+
+        self.hashes.save()
+        counts = {}
+        for entry in report.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        print(
+            f"Pipeline finished in {time.perf_counter() - start:.1f}s: "
+            + ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+        )
+        return report
+
+
+def build_default_pipeline(
+    work_directory,
+    personas_path,
+    template_type="instruction",
+    num_samples=0,
+    base_model_name="all-mpnet-base-v2",
+    evaluation_models=("all-mpnet-base-v2",),
+    classification_model_name="all-mpnet-base-v2",
+    plot_model_name=None,
+    instruction_prefix="Instruct:",
+    input_prefix="Persona:",
+    training_parameters=None,
+    cache_path=None,
+    encode_backend="torch"
+):
+    """
+    The synthesize -> convert -> classify -> train -> evaluate -> plot pipeline of this repository.
+
+    Retrieval is evaluated for every model in evaluation_models and for the fine-tuned model;
+    both plots use plot_model_name (the fine-tuned model if None). Classification, retrieval and
+    plots encode on encode_backend. All artifacts are written below work_directory.
+
+    Returns:
+        list: Stages for Pipeline
+    """
+    from model_mappings import resolve_model_id
+    from prompt_templates import get_template_by_name
+
+    synthetic_path = f"{work_directory}/synthetic/{template_type}.jsonl"
+    pairs_path = f"{work_directory}/pairs/{template_type}.jsonl"
+    classified_path = f"{work_directory}/classified/{template_type}.jsonl"
+    training_directory = f"{work_directory}/training"
+    fine_tuned_model = f"{training_directory}/final_model"
+    training_parameters = {"epochs": 1, "batch_size": 64, "learning_rate": 2e-5, **(training_parameters or {})}
+
+    # Only passed when not the default, so fingerprints of existing runs stay valid
+    backend_kwargs = {"encode_backend": encode_backend} if encode_backend != "torch" else {}
+
+    def model_inputs(model_name):
+        # A local checkpoint is fingerprinted by content, a hub model by its resolved ID
+        return [model_name] if model_name == fine_tuned_model else []
+
+    stages = [
+        Stage(
+            "synthesize",
+            "openai_synthesize:synthesize_data",
+            kwargs={
+                "template_type": template_type,
+                "num_samples": num_samples,
+                "output_file": synthetic_path,
+                "personas_path": personas_path,
+                # A changed stage starts over; the response cache makes repeated requests free
+                "resume": False,
+                "cache_path": cache_path
+            },
+            inputs=[personas_path],
+            outputs=[synthetic_path],
+            extra={"template": get_template_by_name(template_type)}
+        ),
+        # Synthesized records hold input_persona/synthesized_text (or dialogs); the later
+        # stages read instruction/input columns
+        Stage(
+            "to_pairs",
+            "openai_synthesize:synthetic_to_pairs",
+            kwargs={"source_path": synthetic_path, "destination_path": pairs_path},
+            inputs=[synthetic_path],
+            outputs=[pairs_path]
+        ),
+        Stage(
+            "classify",
+            "data_classifier:classify_dataset",
+            kwargs={
+                "source_path": pairs_path,
+                "destination_path": classified_path,
+                "mode": "embedding",
+                "embedding_model_name": classification_model_name,
+                **backend_kwargs
+            },
+            inputs=[pairs_path],
+            outputs=[classified_path],
+            extra={"model_id": resolve_model_id(classification_model_name)}
+        ),
+        Stage(
+            "train",
+            "train_sbert_v3:fine_tune_sentence_model",
+            kwargs={
+                "base_model_name": base_model_name,
+                "train_data_path": classified_path,
+                "validation_data_path": None,
+                "output_directory": training_directory,
+                "instruction_prefix": instruction_prefix,
+                "input_prefix": input_prefix,
+                **training_parameters
+            },
+            inputs=[classified_path],
+            outputs=[fine_tuned_model],
+            extra={"model_id": resolve_model_id(base_model_name)}
+        ),
+    ]
+
+    for model_name in list(evaluation_models) + [fine_tuned_model]:
+        label = "fine_tuned" if model_name == fine_tuned_model else model_name
+        results_directory = f"{work_directory}/retrieval/{label}"
+        stages.append(Stage(
+            f"retrieval[{label}]",
+            "input_instruction_retrieval:perform_retrieval_analysis",
+            kwargs={
+                "instruction_model_name": model_name,
+                "input_model_name": model_name,
+                "dataset_path": classified_path,
+                "output_directory": results_directory,
+                **backend_kwargs
+            },
+            inputs=[classified_path] + model_inputs(model_name),
+            outputs=[f"{results_directory}/retrieval_analysis_summary.json"],
+            extra={"model_id": resolve_model_id(model_name)}
+        ))
+
+    plot_model_name = plot_model_name or fine_tuned_model
+    plot_directory = f"{work_directory}/plots"
+    stages += [
+        Stage(
+            "tsne_plot",
+            "tsne_plot_embeddings:create_tsne_visualization",
+            kwargs={
+                "dataset_path": classified_path,
+                "model_name": plot_model_name,
+                "output_directory": f"{plot_directory}/tsne",
+                "instruction_prefix": instruction_prefix,
+                "input_prefix": input_prefix,
+                "show_class_colors": True,
+                "scalable": True,
+                "max_points": 200000,
+                "render": "density",
+                **backend_kwargs
+            },
+            inputs=[classified_path] + model_inputs(plot_model_name),
+            outputs=[f"{plot_directory}/tsne/tsne_visualization.png"],
+            extra={"model_id": resolve_model_id(plot_model_name)}
+        ),
+        Stage(
+            "umap_plot",
+            "umap_plot_embeddings:create_umap_visualization",
+            kwargs={
+                "dataset_path": classified_path,
+                "model_name": plot_model_name,
+                "output_directory": f"{plot_directory}/umap",
+                "show_class_colors": True,
+                "render": "density",
+                **backend_kwargs
+            },
+            inputs=[classified_path] + model_inputs(plot_model_name),
+            outputs=[f"{plot_directory}/umap/umap_visualization.png"],
+            extra={"model_id": resolve_model_id(plot_model_name)}
+        ),
+    ]
+    return stages
+
+
+def main():
+    """
+    Runs the full pipeline with predefined parameters.
+    """
+    # Configuration
+    work_directory = "runs/default"
+    personas_path = "path/to/persona/dataset"
+    evaluation_models = ["all-mpnet-base-v2", "all-MiniLM-L6-v2", "bge-large-en-v1.5"]
+    max_workers = 4  # Independent stages (retrieval per model, both plots) run in parallel
+    encode_backend = "torch"  # "onnx-int8" to encode with the quantized ONNX Runtime backend
+
+    stages = build_default_pipeline(
+        work_directory,
+        personas_path,
+        evaluation_models=evaluation_models,
+        cache_path=f"{work_directory}/response_cache.sqlite",
+        encode_backend=encode_backend
+    )
+    Pipeline(stages, state_dir=f"{work_directory}/.pipeline").run(max_workers=max_workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Pretokenized Data
+
+Tokenizes the instruction and input columns once into memory-mapped token arrays, keyed by
+tokenizer, prefix and column content, and batches training pairs by length so that padding is
+kept small while every contrastive batch stays valid (no positive appears twice in a batch).
+"""
+
+import hashlib
+import json
+import os
+import random
+
+import numpy as np
+import torch
+
+DEFAULT_CACHE_DIR = "cache/tokens"
+
+
+class TokenizedColumn:
+    """
+    Token ids of one text column stored as a flat raw int32 file plus an array of row offsets.
+
+    Row i is tokens[offsets[i]:offsets[i + 1]]. Both arrays are memory-mapped, so opening a
+    column costs no tokenization and almost no memory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        num_tokens = int(self.offsets[-1])
+        tokens_path = os.path.join(directory, "tokens.i32")
+        self.tokens = np.memmap(tokens_path, dtype=np.int32, mode="r", shape=(num_tokens,)) if num_tokens else np.empty(0, np.int32)
+        self.lengths = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
+
+
+def column_cache_key(texts, tokenizer_name, prefix, max_length):
+    """
+    Hash of tokenizer name, prefix, max_length and column content identifying a tokenized column.
+    """
+    digest = hashlib.sha256(json.dumps([tokenizer_name, prefix, max_length]).encode("utf-8"))
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:24]
+
+
+def pretokenize_column(texts, tokenizer, prefix="", max_length=256, cache_dir=DEFAULT_CACHE_DIR, batch_size=10000):
+    """
+    Tokenizes a column once and returns its memory-mapped tokens, reusing an earlier run's
+    arrays when tokenizer, prefix, max_length and texts are unchanged.
+
+    Args:
+        texts (list): Texts without the prefix
+        tokenizer: Hugging Face style tokenizer (callable returning "input_ids")
+        prefix (str): Prefix prepended to every text before tokenization
+        max_length (int): Truncation length in tokens
+        cache_dir (str): Root directory of the token cache
+        batch_size (int): Texts tokenized per call
+
+    Returns:
+        TokenizedColumn: Memory-mapped token ids
+    """
+    tokenizer_name = getattr(tokenizer, "name_or_path", type(tokenizer).__name__)
+    directory = os.path.join(cache_dir, column_cache_key(texts, tokenizer_name, prefix, max_length))
+    if os.path.exists(os.path.join(directory, "offsets.npy")):
+        return TokenizedColumn(directory)
+
+    os.makedirs(directory, exist_ok=True)
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    with open(os.path.join(directory, "tokens.i32"), "wb") as tokens_file:
+        for start in range(0, len(texts), batch_size):
+            batch = [f"{prefix}{text}" for text in texts[start:start + batch_size]]
+            encoded = tokenizer(batch, truncation=True, max_length=max_length)["input_ids"]
+            lengths = [len(ids) for ids in encoded]
+            offsets[start + 1:start + 1 + len(batch)] = offsets[start] + np.cumsum(lengths)
+            tokens_file.write(np.fromiter((i for ids in encoded for i in ids), dtype=np.int32, count=sum(lengths)).tobytes())
+
+    # offsets.npy is written last and marks the column as complete
+    np.save(os.path.join(directory, "offsets.npy"), offsets)
+    return TokenizedColumn(directory)
+
+
+def length_bucketed_batches(lengths, batch_size, positive_keys=None, bucket_multiplier=50, seed=0):
+    """
+    Groups row indices into batches of similar length.
+
+    Rows are shuffled, cut into pools of batch_size * bucket_multiplier rows, sorted by length
+    within each pool and split into batches, and the batches are shuffled again. A row whose
+    positive key is already in the current batch is deferred to a later batch, so each batch has
+    distinct positives and in-batch negatives are never copies of the positive.
+
+    Args:
+        lengths (np.ndarray): Length of every row (e.g. max of anchor and positive tokens)
+        batch_size (int): Rows per batch
+        positive_keys (np.ndarray): Identifier of every row's positive, e.g. a text hash
+        bucket_multiplier (int): Number of batches sorted together
+        seed (int): Shuffling seed
+
+    Returns:
+        list: Lists of row indices
+    """
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(lengths))
+    pool_size = batch_size * bucket_multiplier
+    batches = []
+    deferred = []
+
+    for pool_start in range(0, len(order), pool_size):
+        pool = np.concatenate([np.asarray(deferred, dtype=np.int64), order[pool_start:pool_start + pool_size]])
+        pool = pool[np.argsort(lengths[pool], kind="stable")]
+        deferred = []
+        batch, keys = [], set()
+        for index in pool:
+            key = positive_keys[index] if positive_keys is not None else index
+            if key in keys:
+                deferred.append(index)
+                continue
+            batch.append(int(index))
+            keys.add(key)
+            if len(batch) == batch_size:
+                batches.append(batch)
+                batch, keys = [], set()
+        if batch:
+            batches.append(batch)
+
+    # Rows still deferred at the end get batches of their own, again without duplicates
+    while deferred:
+        batch, keys, remaining = [], set(), []
+        for index in deferred:
+            key = positive_keys[index] if positive_keys is not None else index
+            if key in keys or len(batch) == batch_size:
+                remaining.append(index)
+            else:
+                batch.append(int(index))
+                keys.add(key)
+        batches.append(batch)
+        deferred = remaining
+
+    random.Random(seed).shuffle(batches)
+    return batches
+
+
+class LengthBucketedBatchSampler:
+    """
+    Batch sampler drawing a new length-bucketed batch order every epoch.
+
+    Epoch e uses seed + e. The trainer may call set_epoch; otherwise every new iteration is the
+    next epoch, so rows meet different in-batch negatives from one epoch to the next.
+    """
+
+    def __init__(self, lengths, batch_size, positive_keys=None, seed=0):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.positive_keys = positive_keys
+        self.seed = seed
+        self.epoch = 0
+        self._num_batches = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        batches = length_bucketed_batches(self.lengths, self.batch_size, self.positive_keys, seed=self.seed + self.epoch)
+        self._num_batches = len(batches)
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        # Deferred duplicates can add batches, so the count comes from an actual draw
+        if self._num_batches is None:
+            self._num_batches = len(length_bucketed_batches(self.lengths, self.batch_size, self.positive_keys, seed=self.seed))
+        return self._num_batches
+
+
+def random_batches(num_rows, batch_size, seed=0):
+    """
+    Plain shuffled batches, as used without length bucketing.
+    """
+    order = np.random.default_rng(seed).permutation(num_rows)
+    return [order[start:start + batch_size].tolist() for start in range(0, num_rows, batch_size)]
+
+
+def pad_batch(column, indices, pad_token_id=0):
+    """
+    Returns padded (input_ids, attention_mask) int arrays for the given rows of a column.
+    """
+    lengths = column.lengths[indices]
+    input_ids = np.full((len(indices), int(lengths.max())), pad_token_id, dtype=np.int64)
+    attention_mask = np.zeros_like(input_ids)
+    for row, index in enumerate(indices):
+        input_ids[row, :lengths[row]] = column[index]
+        attention_mask[row, :lengths[row]] = 1
+    return input_ids, attention_mask
+
+
+def padding_ratio(batches, *length_arrays):
+    """
+    Fraction of padded positions over all batches and columns.
+    """
+    padded = real = 0
+    for lengths in length_arrays:
+        for batch in batches:
+            batch_lengths = lengths[batch]
+            padded += int(batch_lengths.max()) * len(batch)
+            real += int(batch_lengths.sum())
+    return 1.0 - real / padded if padded else 0.0
+
+
+class PretokenizedPairs:
+    """
+    (instruction, input) training pairs backed by two TokenizedColumns, with a length-bucketed
+    batch order and a collate function producing padded model features.
+    """
+
+    def __init__(self, instructions, inputs, positive_keys=None, pad_token_id=0):
+        self.instructions = instructions
+        self.inputs = inputs
+        self.positive_keys = positive_keys
+        self.pad_token_id = pad_token_id
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def batches(self, batch_size, seed=0):
+        """
+        One length-bucketed batch order, as lists of row indices.
+        """
+        lengths = np.maximum(self.instructions.lengths, self.inputs.lengths)
+        return length_bucketed_batches(lengths, batch_size, self.positive_keys, seed=seed)
+
+    def batch_sampler(self, batch_size, seed=0):
+        """
+        Batch sampler for training, reshuffled every epoch (see LengthBucketedBatchSampler).
+        """
+        lengths = np.maximum(self.instructions.lengths, self.inputs.lengths)
+        return LengthBucketedBatchSampler(lengths, batch_size, self.positive_keys, seed=seed)
+
+    def collate(self, indices):
+        """
+        Returns [anchor features, positive features] for a batch of row indices, as torch tensors.
+        """
+        features = []
+        for column in (self.instructions, self.inputs):
+            input_ids, attention_mask = pad_batch(column, indices, self.pad_token_id)
+            features.append({"input_ids": torch.from_numpy(input_ids), "attention_mask": torch.from_numpy(attention_mask)})
+        return features
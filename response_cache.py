@@ -0,0 +1,210 @@
+"""
+Response Cache
+
+Persistent, content-addressed cache for language model responses. Entries are keyed by a hash
+of the model, template name, rendered prompt (or dialog history) and sampling parameters, stored
+in a SQLite file and evicted least-recently-used once the cache exceeds its size budget.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def make_cache_key(model, template_name, request, params):
+    """
+    Content hash identifying one language model request.
+
+    Args:
+        model (str): Model name, or None for the API default
+        template_name (str): Name of the template the prompt was rendered from
+        request (str or list): Rendered prompt, or the dialog history for conversation calls
+        params (dict): Sampling parameters passed to the API
+
+    Returns:
+        str: Hex SHA-256 of the canonical JSON encoding of the request
+    """
+    payload = json.dumps([model, template_name, request, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def sample_api(api, sample_index=None, template_name=None):
+    """
+    Returns the API to use for one of several samples of the same request, or for a prompt
+    rendered from template_name: a separate cache view for a CachedLanguageModelAPI, the API
+    itself otherwise.
+    """
+    if isinstance(api, CachedLanguageModelAPI) and (sample_index is not None or template_name is not None):
+        return api.variant(sample_index, template_name)
+    return api
+
+
+class ResponseCache:
+    """
+    Size-bounded LRU cache of responses stored in a SQLite database.
+
+    Safe to share between threads. hits and misses count lookups since the cache was opened.
+    """
+
+    def __init__(self, path, max_size_bytes=1024 ** 3):
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        self._connection.commit()
+        self._size_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        """
+        Returns the cached response for the key, or None on a miss.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+            return json.loads(row[0])
+
+    def put(self, key, response):
+        """Store a response, evicting the least recently used entries if over budget."""
+        value = json.dumps(response, ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if previous:
+                self._size_bytes -= previous[0]
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self._size_bytes += size
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        while self._size_bytes > self.max_size_bytes:
+            rows = self._connection.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._size_bytes <= self.max_size_bytes:
+                    break
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size_bytes -= size
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the current cache size.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size_bytes": self._size_bytes
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class CachedLanguageModelAPI:
+    """
+    Drop-in wrapper around a language model API module that answers repeated requests from a
+    ResponseCache and only forwards misses to the wrapped API.
+
+    template_name namespaces the entries by the template the prompts were rendered from; model
+    is folded into the key when the API is not told the model explicitly through a `model`
+    keyword argument.
+    """
+
+    def __init__(self, api, cache, model=None, template_name=None, sample_index=None):
+        self.api = api
+        self.cache = cache
+        self.model = model
+        self.template_name = template_name
+        self.sample_index = sample_index
+
+    def variant(self, sample_index=None, template_name=None):
+        """
+        Returns a view on the same cache whose entries are kept apart from other samples, so
+        repeated identical requests meant to give different outputs (e.g. the opening prompt
+        of several dialogs for one persona) are not collapsed into a single response.
+
+        template_name, if given, replaces the template name for prompts rendered from another
+        template than the run's (e.g. dialog_start and dialog_continue of dialog runs).
+        """
+        return CachedLanguageModelAPI(
+            self.api,
+            self.cache,
+            self.model,
+            self.template_name if template_name is None else template_name,
+            self.sample_index if sample_index is None else sample_index
+        )
+
+    def lookup(self, method, request, kwargs):
+        """
+        Looks a request up without calling the wrapped API.
+
+        Args:
+            method (str): "generate_response" or "generate_conversation_response"
+            request (str or list): Prompt, or dialog history
+            kwargs (dict): Keyword arguments of the call
+
+        Returns:
+            tuple: (cache key, cached response or None)
+        """
+        params = dict(kwargs)
+        model = params.pop("model", self.model)
+        if self.sample_index is not None:
+            params["sample_index"] = self.sample_index
+        key = make_cache_key(model, self.template_name, request if isinstance(request, str) else list(request), params)
+        return key, self.cache.get(key)
+
+    def fetch(self, method, key, request, kwargs):
+        """
+        Calls the wrapped API for a request that missed the cache and stores the response.
+        """
+        response = getattr(self.api, method)(request, **kwargs)
+        self.cache.put(key, response)
+        return response
+
+    def _cached(self, method, request, kwargs):
+        key, response = self.lookup(method, request, kwargs)
+        if response is not None:
+            return response
+        return self.fetch(method, key, request, kwargs)
+
+    def generate_response(self, prompt, **kwargs):
+        """
+        Cached counterpart of language_model_api.generate_response.
+        """
+        return self._cached("generate_response", prompt, kwargs)
+
+    def generate_conversation_response(self, dialog_history, **kwargs):
+        """
+        Cached counterpart of language_model_api.generate_conversation_response.
+        """
+        return self._cached("generate_conversation_response", dialog_history, kwargs)
@@ -0,0 +1,120 @@
+"""
+Retrieval Ranking
+
+Blocked, vectorised ranking of paired query/corpus embeddings. Query i is paired with corpus
+entry i; the rank of that gold entry is found by counting how many corpus entries score higher,
+so no row is ever sorted and memory stays bounded by the size of one score block.
+"""
+
+import numpy as np
+
+
+def normalize_embeddings(embeddings):
+    """
+    L2-normalise embeddings so that dot products are cosine similarities.
+
+    Args:
+        embeddings (array-like): Matrix of shape (n, dim)
+
+    Returns:
+        np.ndarray: float32 matrix of unit-length rows
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def block_rows_for_budget(num_columns, max_block_bytes):
+    """
+    Number of query rows whose float32 scores against num_columns entries fit into the budget.
+    """
+    return max(1, max_block_bytes // (4 * max(1, num_columns)))
+
+
+def rank_gold_blocked(query_embeddings, corpus_embeddings, top_k=5, max_block_bytes=256 * 1024 ** 2, corpus_chunk_size=None):
+    """
+    Computes the 1-based rank of the paired corpus entry for every query, plus the top-k entries.
+
+    Queries are processed in row blocks and, if corpus_chunk_size is given, the corpus in column
+    chunks; ranks are accumulated as counts of strictly higher scores and the top-k lists are
+    merged across chunks with argpartition. Both inputs must already be normalised.
+
+    The gold score is read from the same score matrix product it is compared against, so an
+    entry tied with the gold entry (e.g. an exact duplicate persona) is never counted as higher:
+    ties are ranked in favour of the gold entry.
+
+    Args:
+        query_embeddings (np.ndarray): Matrix of shape (n, dim)
+        corpus_embeddings (np.ndarray): Matrix of shape (m, dim) with m >= n
+        top_k (int): Number of best corpus entries to keep per query (0 to skip)
+        max_block_bytes (int): Upper bound on the size of one block of scores
+        corpus_chunk_size (int): Corpus entries scored at once, None for the whole corpus
+
+    Returns:
+        tuple: (ranks, top_k_indices) with shapes (n,) and (n, top_k)
+    """
+    num_queries = len(query_embeddings)
+    num_corpus = len(corpus_embeddings)
+    chunk_size = corpus_chunk_size or num_corpus
+    block_size = block_rows_for_budget(min(chunk_size, num_corpus), max_block_bytes)
+    top_k = min(top_k, num_corpus)
+
+    ranks = np.empty(num_queries, dtype=np.int64)
+    top_k_indices = np.empty((num_queries, top_k), dtype=np.int64)
+    chunk_starts = list(range(0, num_corpus, chunk_size))
+    # Row blocks never straddle a corpus chunk boundary, so all gold entries of a block are in one chunk
+    block_starts = [
+        start
+        for chunk_start in range(0, num_queries, chunk_size)
+        for start in range(chunk_start, min(chunk_start + chunk_size, num_queries), block_size)
+    ]
+
+    for start in block_starts:
+        end = min(start + block_size, (start // chunk_size + 1) * chunk_size, num_queries)
+        queries = query_embeddings[start:end]
+        rows = np.arange(end - start)
+        gold_chunk_start = start // chunk_size * chunk_size
+
+        higher = np.zeros(end - start, dtype=np.int64)
+        best_scores = np.full((end - start, 0), -np.inf, dtype=np.float32)
+        best_indices = np.empty((end - start, 0), dtype=np.int64)
+
+        # The chunk holding the gold entries comes first and provides the gold scores
+        for chunk_start in [gold_chunk_start] + [c for c in chunk_starts if c != gold_chunk_start]:
+            chunk_end = min(chunk_start + chunk_size, num_corpus)
+            scores = queries @ corpus_embeddings[chunk_start:chunk_end].T
+            if chunk_start == gold_chunk_start:
+                gold_scores = scores[rows, np.arange(start, end) - chunk_start]
+            higher += np.count_nonzero(scores > gold_scores[:, None], axis=1)
+
+            if top_k:
+                # Merge this chunk's candidates with the best entries found so far
+                chunk_k = min(top_k, chunk_end - chunk_start)
+                candidates = np.argpartition(-scores, chunk_k - 1, axis=1)[:, :chunk_k]
+                best_scores = np.concatenate([best_scores, scores[rows[:, None], candidates]], axis=1)
+                best_indices = np.concatenate([best_indices, candidates + chunk_start], axis=1)
+                if best_scores.shape[1] > top_k:
+                    keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                    best_scores = best_scores[rows[:, None], keep]
+                    best_indices = best_indices[rows[:, None], keep]
+
+        ranks[start:end] = higher + 1
+        if top_k:
+            order = np.argsort(-best_scores, axis=1, kind="stable")
+            top_k_indices[start:end] = best_indices[rows[:, None], order]
+
+    return ranks, top_k_indices
+
+
+def calculate_accuracy(ranks, top_k):
+    """
+    Fraction of queries whose gold entry is ranked within the top k.
+    """
+    return float(np.mean(np.asarray(ranks) <= top_k))
+
+
+def calculate_mrr(ranks):
+    """
+    Mean reciprocal rank of the gold entries.
+    """
+    return float(np.mean(1.0 / np.asarray(ranks, dtype=np.float64)))
@@ -0,0 +1,383 @@
+"""
+Retrieval Server
+
+Online instruction-to-persona lookup over HTTP, using the same encode + cosine similarity path as
+input_instruction_retrieval. Persona embeddings are computed once (through the embedding store)
+and held in memory as a nearest-neighbour index. Concurrent requests are coalesced into dynamic
+micro-batches: a batch is encoded as soon as it reaches max_batch_size or its oldest request has
+waited max_wait_ms, so the model sees batches instead of one text per call. Requests arriving
+while a batch is being encoded queue up and form the next batch.
+
+The server uses asyncio streams and a minimal HTTP/1.1 implementation (keep-alive, JSON bodies):
+
+    POST /search   {"query": "...", "k": 5}  ->  {"results": [{"index", "score", "persona"}, ...]}
+    GET  /metrics  request count, throughput, p50/p99 latency and batch sizes
+    POST /metrics/reset
+    GET  /health
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import model_loader
+import dataset_loader
+from ann_index import create_index, load_index
+from embedding_store import DEFAULT_STORE_DIR, encode_with_store, lazy_encoder
+from model_mappings import load_model
+from retrieval_ranking import normalize_embeddings
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class ServingMetrics:
+    """
+    Request latencies over a sliding window, plus request, batch and throughput counters.
+    """
+
+    def __init__(self, window=10000):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.latencies = deque(maxlen=self.window)
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.max_batch_size = 0
+        self.first_request_time = None
+        self.last_request_time = None
+
+    def record_request(self, seconds, failed=False):
+        now = time.perf_counter()
+        if self.first_request_time is None:
+            self.first_request_time = now - seconds
+        self.last_request_time = now
+        self.requests += 1
+        self.errors += int(failed)
+        self.latencies.append(seconds)
+
+    def record_batch(self, size):
+        self.batches += 1
+        self.batched_requests += size
+        self.max_batch_size = max(self.max_batch_size, size)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Counters, requests per second between the first and last request, and latency
+                percentiles in milliseconds over the window
+        """
+        latencies_ms = np.array(self.latencies) * 1000
+        elapsed = (self.last_request_time - self.first_request_time) if self.requests else 0.0
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "requests_per_second": self.requests / elapsed if elapsed else 0.0,
+            "latency_p50_ms": float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else 0.0,
+            "latency_p99_ms": float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else 0.0,
+            "latency_mean_ms": float(latencies_ms.mean()) if len(latencies_ms) else 0.0,
+            "batches": self.batches,
+            "mean_batch_size": self.batched_requests / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size
+        }
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrently submitted items into batches for a blocking batch function.
+
+    The batch function runs on a single worker thread, so the event loop keeps accepting requests
+    while a batch is processed, and the model is never called from two threads at once.
+
+    Args:
+        process_batch (callable): Maps a list of items to a list of results of the same length
+        max_batch_size (int): Largest batch passed to process_batch
+        max_wait_ms (float): Longest time the first item of a batch waits for more items
+        metrics (ServingMetrics): Optional metrics receiving the batch sizes
+    """
+
+    def __init__(self, process_batch, max_batch_size=64, max_wait_ms=5.0, metrics=None):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = metrics
+        self._queue = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped."))
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, item):
+        """
+        Queues an item and waits for its result.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Items already queued join without waiting; then wait for more until the deadline
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            items = [item for item, _ in batch]
+            if self.metrics is not None:
+                self.metrics.record_batch(len(items))
+            try:
+                results = await loop.run_in_executor(self._executor, self.process_batch, items)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class PersonaRetriever:
+    """
+    Encodes queries and returns the top-k personas from an in-memory index.
+
+    Args:
+        encode (callable): Maps a list of prefixed texts to embeddings
+        personas (list): Persona texts, in index order
+        index (VectorIndex): Index over the normalised persona embeddings
+        query_prefix (str): Prefix prepended to every query before encoding
+    """
+
+    def __init__(self, encode, personas, index, query_prefix="Instruct: "):
+        self.encode = encode
+        self.personas = personas
+        self.index = index
+        self.query_prefix = query_prefix
+
+    def search_batch(self, requests):
+        """
+        Args:
+            requests (list): (query, k) pairs
+
+        Returns:
+            list: For each request, up to k {"index", "score", "persona"} dicts, best first;
+                padding of indices that find fewer than k candidates (id -1, score -inf) is dropped
+        """
+        queries = normalize_embeddings(np.asarray(
+            self.encode([f"{self.query_prefix}{query}" for query, _ in requests]), dtype=np.float32
+        ))
+        # One search for the whole batch at the largest requested k
+        scores, ids = self.index.search(queries, max(k for _, k in requests))
+        return [
+            [
+                {"index": int(persona_id), "score": float(score), "persona": self.personas[persona_id]}
+                for score, persona_id in zip(scores[row, :k], ids[row, :k])
+                if persona_id >= 0 and np.isfinite(score)
+            ]
+            for row, (_, k) in enumerate(requests)
+        ]
+
+
+def build_retriever(
+    model_name,
+    dataset_path,
+    store_dir=DEFAULT_STORE_DIR,
+    index_backend="flat",
+    index_options=None,
+    index_path=None,
+    query_prefix="Instruct: ",
+    persona_prefix="Persona: ",
+    encode_backend="torch"
+):
+    """
+    Loads the model and the distinct personas of a dataset and builds a PersonaRetriever.
+
+    Persona embeddings come from the embedding store, so a restart only encodes new personas.
+    With index_path, the index is loaded from that file instead of built; it must have been
+    built over the same distinct personas in the same order. encode_backend="onnx-int8" serves
+    from the quantized ONNX Runtime export of the model.
+    """
+    dataset = dataset_loader.load(dataset_path)
+    personas = list(dict.fromkeys(dataset.get_column("input")))
+    encode = lazy_encoder(lambda: load_model(model_name, model_loader.load, encode_backend))
+
+    if index_path:
+        index = load_index(index_path)
+    else:
+        persona_embeddings = normalize_embeddings(
+            encode_with_store(personas, model_name, encode, persona_prefix, store_dir, encode_backend)
+        )
+        index = create_index(index_backend, **(index_options or {})).build(persona_embeddings)
+    # Load the model now rather than in the first request
+    encode([query_prefix])
+    print(f"Serving {len(personas)} personas with {model_name}.")
+    return PersonaRetriever(encode, personas, index, query_prefix)
+
+
+class RetrievalServer:
+    """
+    HTTP front end of a PersonaRetriever with micro-batched encoding.
+
+    Args:
+        retriever (PersonaRetriever): Encoder and persona index
+        host (str): Interface to bind
+        port (int): Port to bind, 0 for any free port (see self.port after start)
+        max_batch_size (int): Largest micro-batch
+        max_wait_ms (float): Longest wait of a request for its batch to fill
+        default_k (int): Personas returned when a request does not set k
+        max_k (int): Largest k a request may ask for
+    """
+
+    def __init__(self, retriever, host="127.0.0.1", port=8080, max_batch_size=64, max_wait_ms=5.0, default_k=5, max_k=100):
+        self.retriever = retriever
+        self.host = host
+        self.port = port
+        self.default_k = default_k
+        self.max_k = max_k
+        self.metrics = ServingMetrics()
+        self.batcher = MicroBatcher(retriever.search_batch, max_batch_size, max_wait_ms, self.metrics)
+        self._server = None
+
+    async def start(self):
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"Retrieval server listening on http://{self.host}:{self.port}")
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def search(self, query, k=None):
+        """
+        Top-k personas for one query; concurrent calls share micro-batches.
+        """
+        start = time.perf_counter()
+        try:
+            results = await self.batcher.submit((query, min(k or self.default_k, self.max_k)))
+        except Exception:
+            self.metrics.record_request(time.perf_counter() - start, failed=True)
+            raise
+        self.metrics.record_request(time.perf_counter() - start)
+        return results
+
+    async def _route(self, method, path, body):
+        if path == "/search":
+            if method != "POST":
+                return 405, {"error": "Use POST."}
+            try:
+                request = json.loads(body or b"{}")
+                query = request["query"]
+                k = int(request.get("k", self.default_k))
+            except (ValueError, KeyError, TypeError) as error:
+                return 400, {"error": f"Expected a JSON body with a query: {error!r}"}
+            if not isinstance(query, str) or k < 1:
+                return 400, {"error": "query must be a string and k positive."}
+            return 200, {"results": await self.search(query, k)}
+        if path == "/metrics" and method == "GET":
+            return 200, self.metrics.snapshot()
+        if path == "/metrics/reset" and method == "POST":
+            self.metrics.reset()
+            return 200, {"status": "reset"}
+        if path == "/health" and method == "GET":
+            return 200, {"status": "ok", "personas": len(self.retriever.personas)}
+        return 404, {"error": f"No route for {method} {path}."}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                try:
+                    status, payload = await self._route(method, path.split("?", 1)[0], body)
+                except Exception as error:
+                    status, payload = 500, {"error": repr(error)}
+                keep_alive = headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def main():
+    """
+    Starts the retrieval server with predefined parameters.
+    """
+    # Configuration for the server
+    model_name = "path/to/instruction_model"
+    dataset_location = "path/to/dataset"
+    host = "0.0.0.0"
+    port = 8080
+    max_batch_size = 64  # Queries encoded per model call at most
+    max_wait_ms = 5.0  # Longest a query waits for its batch to fill
+    encode_backend = "torch"  # "onnx-int8" to encode with the quantized ONNX Runtime backend
+
+    retriever = build_retriever(model_name, dataset_location, encode_backend=encode_backend)
+    server = RetrievalServer(retriever, host, port, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    asyncio.run(server.serve_forever())
+
+if __name__ == "__main__":
+    main()
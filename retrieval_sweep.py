@@ -0,0 +1,267 @@
+"""
+Retrieval Sweep
+
+Runs the instruction-to-persona retrieval evaluation of input_instruction_retrieval for many
+embedding models in one go. The dataset is loaded once, its text columns are placed in shared
+memory, and worker processes (one fresh process per model) evaluate models concurrently,
+largest first, within an optional memory budget estimated from parameter counts. The results
+are written as a single leaderboard with Top-1/Top-5 accuracy, MRR, encode throughput and peak
+memory per model, so a full sweep takes about as long as its slowest model rather than the sum
+of all of them.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+import model_loader
+import dataset_loader
+import analysis_reporter
+from embedding_store import DEFAULT_STORE_DIR, encode_with_store
+from instrumentation import peak_rss_mib, profile_run, span
+from model_mappings import MODEL_MAPPINGS, estimate_model_bytes, load_model, resolve_model_id
+from retrieval_ranking import calculate_accuracy, calculate_mrr, normalize_embeddings, rank_gold_blocked
+
+
+class SharedTexts:
+    """
+    A list of strings in one shared memory block: int64 end offsets followed by the UTF-8 bytes
+    of all texts. Workers attach by handle instead of receiving a pickled copy of the list.
+    """
+
+    def __init__(self, block, count, data_bytes, owner):
+        self.block = block
+        self.count = count
+        self.data_bytes = data_bytes
+        self.owner = owner
+
+    @classmethod
+    def create(cls, texts):
+        encoded = [text.encode("utf-8") for text in texts]
+        ends = np.cumsum([len(text) for text in encoded], dtype=np.int64)
+        data_bytes = int(ends[-1]) if len(ends) else 0
+        block = shared_memory.SharedMemory(create=True, size=max(ends.nbytes + data_bytes, 1))
+        block.buf[:ends.nbytes] = ends.tobytes()
+        block.buf[ends.nbytes:ends.nbytes + data_bytes] = b"".join(encoded)
+        return cls(block, len(encoded), data_bytes, owner=True)
+
+    @property
+    def handle(self):
+        """Picklable reference for attach."""
+        return self.block.name, self.count, self.data_bytes
+
+    @classmethod
+    def attach(cls, handle):
+        name, count, data_bytes = handle
+        # Spawned workers share the creating process's resource tracker, which unlinks the block
+        # only if that process dies without closing it
+        return cls(shared_memory.SharedMemory(name=name), count, data_bytes, owner=False)
+
+    def __len__(self):
+        return self.count
+
+    def to_list(self):
+        ends = np.ndarray((self.count,), dtype=np.int64, buffer=self.block.buf)
+        data = bytes(self.block.buf[ends.nbytes:ends.nbytes + self.data_bytes])
+        starts = np.concatenate([[0], ends[:-1]]) if self.count else ends
+        return [data[start:end].decode("utf-8") for start, end in zip(starts.tolist(), ends.tolist())]
+
+    def close(self):
+        self.block.close()
+        if self.owner:
+            self.block.unlink()
+
+
+def _evaluate_model(model_name, instruction_handle, input_handle, store_dir, max_block_bytes, loader, encode_backend="torch"):
+    """
+    Evaluates one model in a worker process; the model serves both instructions and inputs.
+    """
+    start = time.perf_counter()
+    stats = {"load_seconds": 0.0, "encode_seconds": 0.0, "texts_encoded": 0}
+    model = []
+
+    def encode(texts):
+        if not model:
+            load_start = time.perf_counter()
+            model.append(load_model(model_name, loader or model_loader.load, encode_backend))
+            stats["load_seconds"] = time.perf_counter() - load_start
+        encode_start = time.perf_counter()
+        vectors = model[0].encode(texts)
+        stats["encode_seconds"] += time.perf_counter() - encode_start
+        stats["texts_encoded"] += len(texts)
+        return vectors
+
+    instruction_texts = SharedTexts.attach(instruction_handle)
+    input_texts = SharedTexts.attach(input_handle)
+    try:
+        instructions = instruction_texts.to_list()
+        inputs = input_texts.to_list()
+    finally:
+        instruction_texts.close()
+        input_texts.close()
+
+    instruction_embeddings = normalize_embeddings(
+        encode_with_store(instructions, model_name, encode, "Instruct: ", store_dir, encode_backend)
+    )
+    input_embeddings = normalize_embeddings(encode_with_store(inputs, model_name, encode, "Persona: ", store_dir, encode_backend))
+    rank_start = time.perf_counter()
+    ranks, _ = rank_gold_blocked(instruction_embeddings, input_embeddings, max_block_bytes=max_block_bytes)
+    rank_seconds = time.perf_counter() - rank_start
+
+    return {
+        "model": model_name,
+        "model_id": resolve_model_id(model_name),
+        "Top-1 Accuracy": calculate_accuracy(ranks, top_k=1),
+        "Top-5 Accuracy": calculate_accuracy(ranks, top_k=5),
+        "Mean Reciprocal Rank (MRR)": calculate_mrr(ranks),
+        "texts_encoded": stats["texts_encoded"],
+        "encode_seconds": stats["encode_seconds"],
+        "encode_texts_per_second": stats["texts_encoded"] / stats["encode_seconds"] if stats["encode_seconds"] else 0.0,
+        "load_seconds": stats["load_seconds"],
+        "rank_seconds": rank_seconds,
+        "total_seconds": time.perf_counter() - start,
+        "peak_rss_mib": peak_rss_mib()
+    }
+
+
+def perform_retrieval_sweep(
+    model_names,
+    dataset_path,
+    output_directory,
+    max_workers=2,
+    memory_budget_bytes=None,
+    store_dir=DEFAULT_STORE_DIR,
+    max_block_bytes=256 * 1024 ** 2,
+    loader=None,
+    encode_backend="torch",
+    instrument=False
+):
+    """
+    Evaluates instruction-to-persona retrieval for every model and writes one leaderboard.
+
+    Models are started largest first (by estimate_model_bytes) on up to max_workers processes.
+    With memory_budget_bytes set, a model only starts while the estimated sizes of the running
+    models leave room for it; a model larger than the budget runs on its own. Each model runs in
+    a fresh process, so its peak RSS is its own. Embeddings go through the embedding store, so a
+    repeated sweep only encodes new texts.
+
+    Args:
+        model_names (list): Short names, model IDs or local paths
+        dataset_path (str): Dataset with instruction and input columns
+        output_directory (str): Directory receiving retrieval_sweep_leaderboard.json
+        max_workers (int): Models evaluated at the same time
+        memory_budget_bytes (int): Budget for the estimated sizes of concurrently loaded models
+        store_dir (str): Embedding store directory
+        max_block_bytes (int): Similarity block size of the ranking
+        loader (callable): Picklable model loader, model_loader.load if None
+        encode_backend (str): "torch", or "onnx"/"onnx-int8" to encode on ONNX Runtime
+        instrument (bool): Write retrieval_sweep_spans.json with per-stage timings
+
+    Returns:
+        list: Leaderboard rows, best MRR first
+    """
+    with profile_run("retrieval_sweep", f"{output_directory}/retrieval_sweep_spans.json", instrument):
+        # The dataset is loaded and encoded to bytes once for all models
+        with span("load_dataset") as load_span:
+            dataset = dataset_loader.load(dataset_path)
+            instruction_texts = SharedTexts.create(list(dataset.get_column("instruction")))
+            input_texts = SharedTexts.create(list(dataset.get_column("input")))
+            load_span.add_items(len(instruction_texts))
+
+        sizes = {model_name: estimate_model_bytes(model_name) for model_name in model_names}
+        queue = sorted(model_names, key=lambda model_name: -sizes[model_name])
+        rows = []
+        running = {}
+        start = time.perf_counter()
+        try:
+            # A fresh process per model, so memory is returned and peak RSS is per model
+            pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn"), max_tasks_per_child=1)
+            with span("evaluate_models", items=len(queue)), pool:
+                while queue or running:
+                    # Start the largest waiting models that fit next to the running ones
+                    for model_name in list(queue):
+                        if len(running) >= max_workers:
+                            break
+                        running_bytes = sum(sizes[name] for name in running.values())
+                        if memory_budget_bytes is None or not running or running_bytes + sizes[model_name] <= memory_budget_bytes:
+                            queue.remove(model_name)
+                            future = pool.submit(
+                                _evaluate_model, model_name, instruction_texts.handle, input_texts.handle,
+                                store_dir, max_block_bytes, loader, encode_backend
+                            )
+                            running[future] = model_name
+                            print(f"Evaluating {model_name} (~{sizes[model_name] / 1024 ** 3:.1f} GiB)...")
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        model_name = running.pop(future)
+                        try:
+                            row = future.result()
+                            print(f"{model_name}: MRR {row['Mean Reciprocal Rank (MRR)']:.4f} in {row['total_seconds']:.1f}s.")
+                        except Exception as error:
+                            row = {"model": model_name, "model_id": resolve_model_id(model_name), "error": repr(error)}
+                            print(f"{model_name} failed: {error!r}")
+                        row["estimated_model_bytes"] = sizes[model_name]
+                        rows.append(row)
+        finally:
+            instruction_texts.close()
+            input_texts.close()
+        wall_seconds = time.perf_counter() - start
+
+        rows.sort(key=lambda row: -row.get("Mean Reciprocal Rank (MRR)", -1.0))
+        leaderboard = {
+            "leaderboard": rows,
+            "dataset": dataset_path,
+            "num_pairs": len(instruction_texts),
+            "wall_seconds": wall_seconds,
+            "sum_of_model_seconds": sum(row.get("total_seconds", 0.0) for row in rows),
+            "max_workers": max_workers,
+            "memory_budget_bytes": memory_budget_bytes,
+            "encode_backend": encode_backend
+        }
+        analysis_reporter.save_results(leaderboard, output_directory, "retrieval_sweep_leaderboard.json")
+
+    print_leaderboard(rows)
+    print(f"Sweep of {len(rows)} models took {wall_seconds:.1f}s ({leaderboard['sum_of_model_seconds']:.1f}s summed over models).")
+    return rows
+
+
+def print_leaderboard(rows):
+    """Prints the leaderboard rows as a table."""
+    print(f"{'Model':<36} | {'Top-1':>6} | {'Top-5':>6} | {'MRR':>6} | {'Texts/s':>8} | {'Peak MiB':>8}")
+    print("-" * 86)
+    for row in rows:
+        if "error" in row:
+            print(f"{row['model']:<36} | failed: {row['error']}")
+            continue
+        print(
+            f"{row['model']:<36} | {row['Top-1 Accuracy']:>6.3f} | {row['Top-5 Accuracy']:>6.3f} | "
+            f"{row['Mean Reciprocal Rank (MRR)']:>6.3f} | {row['encode_texts_per_second']:>8.0f} | {row['peak_rss_mib']:>8.0f}"
+        )
+
+
+def main():
+    """
+    Runs the retrieval sweep over all mapped models with predefined parameters.
+    """
+    # Configuration for the sweep
+    dataset_location = "path/to/dataset"
+    results_directory = "results/retrieval_sweep"
+    model_names = list(MODEL_MAPPINGS)
+    max_workers = 2  # Models evaluated concurrently
+    memory_budget_bytes = 48 * 1024 ** 3  # Estimated weights of concurrently loaded models
+    encode_backend = "torch"  # "onnx-int8" to encode with the quantized ONNX Runtime backend
+
+    perform_retrieval_sweep(
+        model_names,
+        dataset_location,
+        results_directory,
+        max_workers=max_workers,
+        memory_budget_bytes=memory_budget_bytes,
+        encode_backend=encode_backend
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Scalable t-SNE
+
+t-SNE for corpora far beyond what exact-gradient t-SNE on raw embeddings can handle. Embeddings
+are first reduced to ~50 dimensions with PCA. Affinities then come from approximate nearest
+neighbours, gradients are computed with FFT interpolation (or Barnes-Hut), and everything runs on
+all cores. Optionally only a class-stratified subsample is embedded; the remaining points are
+placed next to their nearest embedded neighbours.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from ann_index import create_index
+from instrumentation import span
+from retrieval_ranking import normalize_embeddings
+
+
+def pca_reduce(embeddings, num_components=50, sample_size=100000, block_size=65536, seed=0):
+    """
+    Projects embeddings onto their top principal components.
+
+    Components are fitted on a random sample and the projection is applied block by block, so
+    memory-mapped inputs are never fully loaded.
+
+    Args:
+        embeddings (np.ndarray): Matrix of shape (n, dim)
+        num_components (int): Output dimensionality
+        sample_size (int): Rows used to fit the components
+        block_size (int): Rows projected at a time
+        seed (int): Sampling seed
+
+    Returns:
+        np.ndarray: float32 matrix of shape (n, min(num_components, dim))
+    """
+    num_components = min(num_components, embeddings.shape[1])
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(len(embeddings), min(len(embeddings), sample_size), replace=False))
+    sample = np.asarray(embeddings[sample_rows], dtype=np.float32)
+    mean = sample.mean(axis=0)
+    _, _, components = np.linalg.svd(sample - mean, full_matrices=False)
+    components = components[:num_components].T
+
+    reduced = np.empty((len(embeddings), num_components), dtype=np.float32)
+    for start in range(0, len(embeddings), block_size):
+        block = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+        reduced[start:start + block_size] = (block - mean) @ components
+    return reduced
+
+
+def stratified_sample(labels, max_points, seed=0):
+    """
+    Row indices of a subsample of at most max_points rows with the class proportions of labels.
+
+    Every class keeps at least one row, so rare classes still appear in the embedding.
+    """
+    labels = np.asarray(labels)
+    if len(labels) <= max_points:
+        return np.arange(len(labels))
+    rng = np.random.default_rng(seed)
+    classes, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    quotas = np.maximum(1, np.floor(counts * max_points / len(labels)).astype(np.int64))
+    selected = [
+        rng.choice(np.flatnonzero(inverse == class_id), min(quota, count), replace=False)
+        for class_id, (quota, count) in enumerate(zip(quotas, counts))
+    ]
+    return np.sort(np.concatenate(selected))
+
+
+def place_out_of_sample(reference_features, reference_coordinates, features, num_neighbors=10, batch_size=8192):
+    """
+    Places new points at the inverse-distance weighted mean of their nearest embedded neighbours.
+
+    Args:
+        reference_features (np.ndarray): PCA features of the embedded points
+        reference_coordinates (np.ndarray): Their t-SNE coordinates, shape (m, 2)
+        features (np.ndarray): PCA features of the points to place
+        num_neighbors (int): Neighbours averaged per point
+        batch_size (int): Points searched at a time
+
+    Returns:
+        np.ndarray: Coordinates of shape (len(features), 2)
+    """
+    # Neighbours by cosine similarity of the PCA features; an IVF index keeps large reference
+    # sets from making placement cost quadratic
+    if len(reference_features) > 20000:
+        index = create_index("ivf_flat", num_lists=int(4 * np.sqrt(len(reference_features))), nprobe=8)
+    else:
+        index = create_index("flat")
+    index.build(normalize_embeddings(reference_features))
+    coordinates = np.empty((len(features), reference_coordinates.shape[1]), dtype=np.float32)
+    for start in range(0, len(features), batch_size):
+        similarities, neighbors = index.search(normalize_embeddings(features[start:start + batch_size]), num_neighbors)
+        distances = np.sqrt(np.maximum(2.0 - 2.0 * similarities, 0.0))
+        weights = 1.0 / (distances + 1e-6)
+        weights /= weights.sum(axis=1, keepdims=True)
+        coordinates[start:start + batch_size] = np.einsum("nk,nkd->nd", weights, reference_coordinates[neighbors])
+    return coordinates
+
+
+def perplexity_neighbors(perplexity=30.0):
+    """
+    Neighbours per point that perplexity-calibrated t-SNE affinities need (three times the
+    perplexity, as in openTSNE).
+    """
+    return int(3 * perplexity)
+
+
+def run_tsne(features, perplexity=30.0, num_threads=-1, gradient_method="fft", seed=0, knn_graph=None):
+    """
+    Embeds features in two dimensions with an accelerated t-SNE.
+
+    Uses openTSNE (approximate kNN affinities, FFT-interpolated or Barnes-Hut gradients) when it
+    is installed and falls back to scikit-learn's Barnes-Hut t-SNE otherwise. A precomputed
+    knn_graph (e.g. from the knn_graph cache) replaces the neighbour search, with the same
+    perplexity-calibrated affinities; a graph with fewer than perplexity_neighbors(perplexity)
+    neighbours per point is ignored, so the result does not depend on which graphs are cached.
+
+    Args:
+        features (np.ndarray): Reduced features, shape (n, d)
+        perplexity (float): t-SNE perplexity
+        num_threads (int): Worker threads, -1 for all cores
+        gradient_method (str): "fft" or "bh" (openTSNE only; scikit-learn always uses Barnes-Hut)
+        seed (int): Random seed
+        knn_graph (tuple): Optional (indices, distances) of shape (n, k), openTSNE only
+
+    Returns:
+        np.ndarray: float32 coordinates of shape (n, 2)
+    """
+    num_threads = os.cpu_count() if num_threads == -1 else num_threads
+    num_neighbors = min(len(features) - 1, perplexity_neighbors(perplexity))
+    if knn_graph is not None and knn_graph[0].shape[1] < num_neighbors:
+        knn_graph = None
+    try:
+        from openTSNE import TSNE, affinity, initialization
+        from openTSNE.nearest_neighbors import PrecomputedNeighbors
+    except ImportError:
+        from sklearn.manifold import TSNE
+        reducer = TSNE(n_components=2, perplexity=perplexity, method="barnes_hut", init="pca", n_jobs=num_threads, random_state=seed)
+        return reducer.fit_transform(features).astype(np.float32)
+
+    reducer = TSNE(
+        n_components=2,
+        perplexity=perplexity,
+        negative_gradient_method=gradient_method,
+        neighbors="auto",
+        n_jobs=num_threads,
+        random_state=seed
+    )
+    if knn_graph is None:
+        return np.asarray(reducer.fit(features), dtype=np.float32)
+
+    indices, distances = knn_graph
+    affinities = affinity.PerplexityBasedNN(
+        perplexity=perplexity,
+        knn_index=PrecomputedNeighbors(
+            np.ascontiguousarray(indices[:, :num_neighbors]), np.ascontiguousarray(distances[:, :num_neighbors])
+        ),
+        n_jobs=num_threads,
+        random_state=seed
+    )
+    return np.asarray(reducer.fit(affinities=affinities, initialization=initialization.pca(features, random_state=seed)), dtype=np.float32)
+
+
+def scalable_tsne(
+    embeddings,
+    labels=None,
+    max_points=None,
+    num_components=50,
+    perplexity=30.0,
+    num_threads=-1,
+    gradient_method="fft",
+    seed=0,
+    knn_graph=None
+):
+    """
+    Two-dimensional t-SNE coordinates for every row of embeddings, with per-stage timings.
+
+    With max_points set, only a subsample of that size (stratified by labels if given) is run
+    through t-SNE and the other rows are placed out of sample. A knn_graph over all rows of
+    embeddings (see run_tsne) is only used when every row is embedded.
+
+    Args:
+        embeddings (np.ndarray): Matrix of shape (n, dim), may be memory-mapped
+        labels (list): Optional class of every row, used for stratification
+        max_points (int): Maximum number of rows embedded by t-SNE itself
+        num_components (int): PCA dimensionality before t-SNE
+        perplexity (float): t-SNE perplexity
+        num_threads (int): Worker threads, -1 for all cores
+        gradient_method (str): "fft" or "bh"
+        seed (int): Random seed
+        knn_graph (tuple): Optional (indices, distances) of the embeddings' kNN graph
+
+    Returns:
+        tuple: (coordinates of shape (n, 2), dict of stage seconds)
+    """
+    timings = {}
+    with span("pca", items=len(embeddings)):
+        start = time.perf_counter()
+        features = pca_reduce(embeddings, num_components, seed=seed)
+        timings["pca_seconds"] = time.perf_counter() - start
+
+    if max_points and len(features) > max_points:
+        sampled = stratified_sample(labels if labels is not None else np.zeros(len(features)), max_points, seed)
+    else:
+        sampled = np.arange(len(features))
+    if len(sampled) < len(features):
+        knn_graph = None
+
+    with span("tsne", items=len(sampled)):
+        start = time.perf_counter()
+        sample_coordinates = run_tsne(features[sampled], perplexity, num_threads, gradient_method, seed, knn_graph)
+        timings["tsne_seconds"] = time.perf_counter() - start
+
+    coordinates = np.empty((len(features), 2), dtype=np.float32)
+    coordinates[sampled] = sample_coordinates
+    remaining = np.setdiff1d(np.arange(len(features)), sampled)
+    with span("place_out_of_sample", items=len(remaining)):
+        start = time.perf_counter()
+        if len(remaining):
+            coordinates[remaining] = place_out_of_sample(features[sampled], sample_coordinates, features[remaining])
+        timings["placement_seconds"] = time.perf_counter() - start
+    return coordinates, timings
@@ -0,0 +1,215 @@
+"""
+Streaming Output
+
+Incremental JSONL writer with a sidecar progress manifest, so long synthesis runs keep memory
+flat, survive crashes and can be resumed by skipping the records that were already written.
+"""
+
+import hashlib
+import json
+import os
+
+
+def persona_hash(persona_text):
+    """
+    Short content hash identifying a persona in the progress manifest.
+
+    Args:
+        persona_text (str): Persona text
+
+    Returns:
+        str: First 16 hex digits of the SHA-1 of the text
+    """
+    return hashlib.sha1(persona_text.encode("utf-8")).hexdigest()[:16]
+
+
+class ProgressManifest:
+    """
+    Append-only record of the persona indices (and their hashes) already written to an output.
+
+    Each line of the manifest file holds "<index>\\t<hash>\\t<end offset>", the end offset being the
+    byte size of the output once the record was written. Only the indices, hashes and offsets are
+    kept in memory, never the generated records.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        self.entries = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as manifest_file:
+                for line in manifest_file:
+                    parts = line.rstrip("\n").split("\t")
+                    # A torn last line from a crash is simply ignored
+                    if len(parts) in (2, 3) and parts[0].isdigit():
+                        end_offset = int(parts[2]) if len(parts) == 3 and parts[2].isdigit() else None
+                        self.entries.append((int(parts[0]), parts[1], end_offset))
+                        self.completed[int(parts[0])] = parts[1]
+        self._file = open(path, "a", encoding="utf-8")
+
+    @property
+    def end_offset(self):
+        """
+        Byte size of the output up to the last listed record, or None for manifests written
+        without offsets.
+        """
+        if not self.entries:
+            return 0
+        if any(end_offset is None for _, _, end_offset in self.entries):
+            return None
+        return self.entries[-1][2]
+
+    def discard_beyond(self, size):
+        """
+        Drops the entries of records ending beyond size bytes, i.e. listed but never flushed to the
+        output, and rewrites the manifest without them.
+        """
+        kept = [entry for entry in self.entries if entry[2] is None or entry[2] <= size]
+        if len(kept) == len(self.entries):
+            return
+        self._file.close()
+        with open(self.path, "w", encoding="utf-8") as manifest_file:
+            manifest_file.writelines(
+                f"{index}\t{digest}\n" if end_offset is None else f"{index}\t{digest}\t{end_offset}\n"
+                for index, digest, end_offset in kept
+            )
+        self.entries = kept
+        self.completed = {index: digest for index, digest, _ in kept}
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def is_done(self, index, persona_text):
+        """
+        Whether the persona at this index was already written with the same content.
+        """
+        return self.completed.get(index) == persona_hash(persona_text)
+
+    def mark_done(self, index, persona_text, end_offset):
+        """Record that the persona at this index has been written, ending at end_offset."""
+        digest = persona_hash(persona_text)
+        self.completed[index] = digest
+        self.entries.append((index, digest, end_offset))
+        self._file.write(f"{index}\t{digest}\t{end_offset}\n")
+
+    def flush(self):
+        self._file.flush()
+
+    def fsync(self):
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class StreamingJsonlWriter:
+    """
+    Writes records to a JSONL file one at a time and tracks them in a progress manifest.
+
+    Records are flushed every flush_every writes and fsynced every fsync_every writes. The output
+    is synced before the manifest, and since the output's buffer may still reach the disk first,
+    resuming truncates the output to the end of the last record the manifest lists (and drops
+    listed records the output does not hold), so a killed run is never left with duplicates.
+    Use as a context manager, or call close() when done.
+    """
+
+    def __init__(self, output_file, resume=True, flush_every=100, fsync_every=1000):
+        self.output_file = output_file
+        self.manifest_file = f"{output_file}.progress"
+        self.flush_every = flush_every
+        self.fsync_every = fsync_every
+        self.records_written = 0
+
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        if not resume:
+            for path in (output_file, self.manifest_file):
+                if os.path.exists(path):
+                    os.remove(path)
+        elif os.path.exists(output_file) and not os.path.exists(self.manifest_file):
+            raise ValueError(
+                f"'{output_file}' exists without a progress manifest; pass resume=False to overwrite it."
+            )
+
+        self.manifest = ProgressManifest(self.manifest_file)
+        self._restore_output()
+        self._file = open(output_file, "ab")
+        self._offset = self._file.tell()
+
+    def _restore_output(self):
+        if not os.path.exists(self.output_file):
+            self.manifest.discard_beyond(0)
+            return
+        self.manifest.discard_beyond(os.path.getsize(self.output_file))
+        end_offset = self.manifest.end_offset
+        if end_offset is None:
+            # Manifests without offsets only allow dropping a torn last line
+            self._truncate_torn_record()
+            return
+        with open(self.output_file, "rb+") as output:
+            output.truncate(end_offset)
+
+    def _truncate_torn_record(self):
+        # Drop a partially written last line left behind by a crash
+        if not os.path.exists(self.output_file):
+            return
+        with open(self.output_file, "rb+") as output:
+            output.seek(0, os.SEEK_END)
+            size = output.tell()
+            if size == 0:
+                return
+            output.seek(size - 1)
+            if output.read(1) == b"\n":
+                return
+            position = size - 1
+            while position > 0:
+                chunk_start = max(0, position - 65536)
+                output.seek(chunk_start)
+                newline = output.read(position - chunk_start).rfind(b"\n")
+                if newline >= 0:
+                    output.truncate(chunk_start + newline + 1)
+                    return
+                position = chunk_start
+            output.truncate(0)
+
+    @property
+    def num_completed(self):
+        return len(self.manifest.completed)
+
+    def is_done(self, index, persona_text):
+        """
+        Whether the record for the persona at this index is already in the output.
+        """
+        return self.manifest.is_done(index, persona_text)
+
+    def write(self, index, persona_text, record):
+        """
+        Append one record and mark its persona as done.
+        """
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self._file.write(line)
+        self._offset += len(line)
+        self.manifest.mark_done(index, persona_text, self._offset)
+        self.records_written += 1
+        if self.records_written % self.fsync_every == 0:
+            self.sync()
+        elif self.records_written % self.flush_every == 0:
+            self._file.flush()
+            self.manifest.flush()
+
+    def sync(self):
+        """Flush and fsync the output, then the manifest."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.manifest.flush()
+        self.manifest.fsync()
+
+    def close(self):
+        self.sync()
+        self._file.close()
+        self.manifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
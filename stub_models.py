@@ -0,0 +1,272 @@
+"""
+Stub Models
+
+Deterministic stand-ins for the remote language model API, used to exercise and benchmark
+the pipelines offline. They expose the same call signatures as the real modules.
+"""
+
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+import types
+import zlib
+
+import numpy as np
+
+
+# Project helper modules the scripts import at module level that are not part of this repository
+EXTERNAL_MODULES = (
+    "analysis_reporter",
+    "data_loader",
+    "dataset_loader",
+    "dimensionality_reducer",
+    "embedding_generator",
+    "language_model_api",
+    "model_loader",
+    "model_trainer",
+    "plot_generator",
+)
+
+def install_stub_modules():
+    """
+    Registers an empty module in sys.modules for every module of EXTERNAL_MODULES that cannot be
+    imported, so the scripts can be imported offline and have those attributes patched. Modules
+    that are installed are left alone.
+
+    Returns:
+        list: Names of the modules that were stubbed
+    """
+    stubbed = []
+    for name in EXTERNAL_MODULES:
+        if name not in sys.modules and importlib.util.find_spec(name) is None:
+            sys.modules[name] = types.ModuleType(name)
+            stubbed.append(name)
+    return stubbed
+
+class StubLanguageModelAPI:
+    """
+    Local stand-in for language_model_api with artificial latency and optional failures.
+
+    Responses are derived from the prompt, so identical prompts always produce identical text.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _simulate_request(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        time.sleep(delay)
+        if fail:
+            raise ConnectionError("Stub language model request failed.")
+
+    def generate_response(self, prompt, **kwargs):
+        """
+        Returns a deterministic message derived from the prompt.
+        """
+        self._simulate_request()
+        return f"Stub response {zlib.crc32(prompt.encode('utf-8')) % 100000}"
+
+    def generate_conversation_response(self, dialog_history, **kwargs):
+        """
+        Returns a deterministic assistant message for the given dialog history.
+        """
+        self._simulate_request()
+        return f"Stub reply to turn {len(dialog_history)}"
+
+
+class StubEmbeddingModel:
+    """
+    Local stand-in for a sentence embedding model.
+
+    Each text maps to a deterministic pseudo-random unit vector, so equal texts always get equal
+    embeddings. Every encode call costs latency plus per_text_latency per text, mimicking the
+    fixed overhead and per-item cost of a real forward pass.
+    """
+
+    def __init__(self, dimension=64, latency=0.005, per_text_latency=0.0002):
+        self.dimension = dimension
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.calls = 0
+        self.texts_encoded = 0
+        self._lock = threading.Lock()
+
+    def encode(self, texts, **kwargs):
+        """
+        Returns a (len(texts), dimension) float32 array of embeddings.
+        """
+        with self._lock:
+            self.calls += 1
+            self.texts_encoded += len(texts)
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            embeddings[i] = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self.dimension)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+class StubClassificationModel:
+    """
+    Local stand-in for a generative classifier answering one prompt at a time.
+    """
+
+    def __init__(self, labels, latency=0.02):
+        self.labels = list(labels)
+        self.latency = latency
+        self.calls = 0
+
+    def predict(self, prompt):
+        """
+        Returns a label chosen deterministically from the prompt.
+        """
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.labels[zlib.crc32(prompt.encode("utf-8")) % len(self.labels)]
+
+
+class StubTokenizer:
+    """
+    Whitespace tokenizer with the call signature of a Hugging Face tokenizer.
+
+    Words map to ids by hash; every sequence is wrapped in start/end ids and optionally padded
+    to the longest sequence of the call.
+    """
+
+    name_or_path = "stub-whitespace-tokenizer"
+
+    def __init__(self, vocab_size=30000, start_id=1, end_id=2, pad_id=0):
+        self.vocab_size = vocab_size
+        self.start_id = start_id
+        self.end_id = end_id
+        self.pad_token_id = pad_id
+
+    def __call__(self, texts, truncation=False, max_length=None, padding=False, **kwargs):
+        input_ids = []
+        for text in texts:
+            ids = [self.start_id] + [3 + zlib.crc32(word.encode("utf-8")) % (self.vocab_size - 3) for word in text.split()] + [self.end_id]
+            if truncation and max_length:
+                ids = ids[:max_length - 1] + [self.end_id] if len(ids) > max_length else ids
+            input_ids.append(ids)
+        if padding:
+            longest = max((len(ids) for ids in input_ids), default=0)
+            attention_mask = [[1] * len(ids) + [0] * (longest - len(ids)) for ids in input_ids]
+            input_ids = [ids + [self.pad_token_id] * (longest - len(ids)) for ids in input_ids]
+            return {"input_ids": input_ids, "attention_mask": attention_mask}
+        return {"input_ids": input_ids}
+
+
+class StubDataset:
+    """
+    In-memory column dataset with the subset of the dataset interface the scripts use
+    (get_column, select, add_column, save, iteration over row dicts).
+    """
+
+    def __init__(self, columns):
+        self.columns = {name: list(values) for name, values in columns.items()}
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), []))
+
+    def __iter__(self):
+        names = list(self.columns)
+        for values in zip(*(self.columns[name] for name in names)):
+            yield dict(zip(names, values))
+
+    def get_column(self, name):
+        return self.columns[name]
+
+    def select(self, indices):
+        indices = list(indices)
+        return StubDataset({name: [values[i] for i in indices] for name, values in self.columns.items()})
+
+    def add_column(self, name, values):
+        self.columns[name] = list(values)
+
+    def save(self, path):
+        """
+        Writes the rows as JSONL.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as output_file:
+            for row in self:
+                output_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def make_synthetic_corpus(num_rows, num_classes=12, duplicate_ratio=0.2, seed=0):
+    """
+    Synthetic persona/instruction dataset of num_rows rows.
+
+    Instructions are built from words of their persona, so retrieval is learnable, and about
+    duplicate_ratio of the personas repeat an earlier one. Columns: input and text (the persona),
+    instruction, input_class and instruction_class.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    topics = [f"Topic {i}" for i in range(num_classes)]
+    personas, instructions, persona_classes, instruction_classes = [], [], [], []
+    for row in range(num_rows):
+        if personas and rng.random() < duplicate_ratio:
+            source = rng.randrange(len(personas))
+            persona, persona_class = personas[source], persona_classes[source]
+        else:
+            persona_class = rng.choice(topics)
+            persona = f"A person interested in {persona_class.lower()}: " + " ".join(rng.choices(vocabulary, k=rng.randint(15, 40)))
+        words = persona.split(": ", 1)[1].split()
+        instruction = "Tell me about " + " ".join(rng.sample(words, min(len(words), 6)))
+        personas.append(persona)
+        persona_classes.append(persona_class)
+        instructions.append(instruction)
+        instruction_classes.append(persona_class if rng.random() < 0.8 else rng.choice(topics))
+    return StubDataset({
+        "input": personas,
+        "text": personas,
+        "instruction": instructions,
+        "input_class": persona_classes,
+        "instruction_class": instruction_classes
+    })
+
+
+class StubBagOfWordsEncoder(StubEmbeddingModel):
+    """
+    StubEmbeddingModel whose embeddings are normalised sums of per-word random vectors, so texts
+    sharing words are similar and retrieval metrics on synthetic corpora are meaningful.
+    """
+
+    def __init__(self, dimension=64, latency=0.0, per_text_latency=0.0):
+        super().__init__(dimension, latency, per_text_latency)
+        self._word_vectors = {}
+
+    def _word_vector(self, word):
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            vector = np.random.default_rng(zlib.crc32(word.encode("utf-8"))).standard_normal(self.dimension).astype(np.float32)
+            self._word_vectors[word] = vector
+        return vector
+
+    def encode(self, texts, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.texts_encoded += len(texts)
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                embeddings[i] += self._word_vector(word)
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from user_embeddings import DialogUserEncoder, UserEmbeddingStore
+
+VECTORS = {"a": [1.0, 0.0, 0.0], "b": [0.0, 1.0, 0.0], "c": [0.0, 0.0, 1.0], "d": [1.0, 1.0, 0.0]}
+
+
+def encode(texts):
+    return np.array([VECTORS[text] for text in texts], dtype=np.float32)
+
+
+def turns(*messages):
+    dialog = []
+    for message in messages:
+        dialog += [{"speaker": "user", "message": message}, {"speaker": "assistant", "message": "ok"}]
+    return dialog
+
+
+def test_all_dialogs_of_a_user_are_pooled():
+    store = UserEmbeddingStore(3)
+    encoder = DialogUserEncoder(encode, store)
+
+    assert encoder.consume([("u", "d1", turns("a", "b"))]) == 2
+    assert encoder.consume([("u", "d2", turns("c", "d"))]) == 2
+    # Growing a dialog embeds only its new turn
+    assert encoder.consume([("u", "d1", turns("a", "b", "c"))]) == 1
+
+    assert store.turn_counts[store.user_rows["u"]] == 5
+    expected = encode(["a", "b", "c", "d", "c"])
+    expected = (expected / np.linalg.norm(expected, axis=1, keepdims=True)).mean(axis=0)
+    np.testing.assert_allclose(store.get(["u"])[0], expected / np.linalg.norm(expected), rtol=1e-6)
+
+
+def test_dialog_turns_survive_save_and_load(tmp_path):
+    store = UserEmbeddingStore(3)
+    DialogUserEncoder(encode, store).consume([("u", "d1", turns("a")), ("u", "d2", turns("b"))])
+    store.save(tmp_path)
+
+    encoder = DialogUserEncoder(encode, UserEmbeddingStore.load(tmp_path))
+    assert encoder.consume([("u", "d1", turns("a", "c")), ("u", "d2", turns("b"))]) == 1
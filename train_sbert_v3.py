@@ -1,6 +1,17 @@
+import math
+import time
+
+import torch
+from transformers import get_linear_schedule_with_warmup
+
 import model_loader
 import data_loader
 import model_trainer
+from gradient_cached_loss import GradientCachedContrastiveLoss
+from embedding_store import text_hashes
+from hard_negative_mining import mine_hard_negatives
+from instrumentation import profile_run, span
+from pretokenized_data import PretokenizedPairs, pretokenize_column
 
 def fine_tune_sentence_model(
     base_model_name,
@@ -11,61 +22,150 @@ def fine_tune_sentence_model(
     batch_size,
     learning_rate,
     instruction_prefix,
-    input_prefix
+    input_prefix,
+    gradient_cache_mini_batch_size=None,
+    hard_negative_refresh_steps=None,
+    hard_negative_rounds=None,
+    num_hard_negatives=1,
+    pretokenized_cache_dir=None,
+    max_seq_length=256,
+    instrument=False
 ):
     """
     Fine-tunes a Sentence Transformer model using a contrastive loss function.
+
+    With gradient_cache_mini_batch_size set, the in-batch-negative loss is computed with gradient
+    caching, so batch_size is no longer limited by activation memory: only that many rows are
+    encoded with an autograd graph at a time.
+
+    With hard_negative_refresh_steps set, training runs in hard_negative_rounds rounds: each round
+    mines (anchor, positive, hard negative) triplets with the current checkpoint and then trains
+    on them for that many steps. If hard_negative_rounds is None, enough rounds are run to cover
+    epochs passes over the triplets. One optimizer and one linear learning rate schedule over all
+    rounds are kept across the refreshes.
+
+    With pretokenized_cache_dir set, the instruction and input columns are tokenized once into
+    memory-mapped arrays under that directory (reused by later runs with the same tokenizer and
+    prefixes), and batches are drawn by length bucket with distinct positives per batch.
+
+    With instrument=True (or PIPELINE_INSTRUMENTATION set), per-stage timings and memory are
+    written to output_directory/training_spans.json.
     """
     
-    # Load the pre-trained sentence transformer model
-    model = model_loader.load_sentence_transformer(base_model_name)
-    
-    # --- Data Preparation ---
-    train_dataset = data_loader.load_dataset(train_data_path)
-    validation_dataset = data_loader.load_dataset(validation_data_path) if validation_data_path else None
-    
-    def format_for_contrastive_loss(dataset):
-        return dataset.map_to_pairs(
-            instruction_col='instruction', 
-            input_col='input', 
-            instruction_prefix=instruction_prefix, 
-            input_prefix=input_prefix
-        )
+    with profile_run("fine_tune", f"{output_directory}/training_spans.json", instrument):
+        # Load the pre-trained sentence transformer model
+        with span("load_model"):
+            model = model_loader.load_sentence_transformer(base_model_name)
+        
+        # --- Data Preparation ---
+        with span("load_data"):
+            train_dataset = data_loader.load_dataset(train_data_path)
+            validation_dataset = data_loader.load_dataset(validation_data_path) if validation_data_path else None
+        
+        def format_for_contrastive_loss(dataset):
+            return dataset.map_to_pairs(
+                instruction_col='instruction', 
+                input_col='input', 
+                instruction_prefix=instruction_prefix, 
+                input_prefix=input_prefix
+            )
 
-    formatted_train_data = format_for_contrastive_loss(train_dataset)
-    formatted_validation_data = format_for_contrastive_loss(validation_dataset) if validation_dataset else None
-    
-    training_loss = model_trainer.create_contrastive_loss(model)
-    
-    training_parameters = {
-        "epochs": epochs,
-        "batch_size": batch_size,
-        "learning_rate": learning_rate,
-        "output_dir": output_directory,
-        "evaluation_strategy": "steps" if formatted_validation_data else "no",
-        "save_strategy": "steps",
-        "logging_steps": 100,
-        "save_steps": 500
-    }
-    
-    # --- Model Training ---
-    trainer = model_trainer.initialize(
-        model=model,
-        train_dataset=formatted_train_data,
-        eval_dataset=formatted_validation_data,
-        loss_function=training_loss,
-        training_args=training_parameters
-    )
-    
-    # Start the training process
-    print("Starting model fine-tuning...")
-    trainer.train()
-    print("Training complete.")
-    
-    # Save the final, fine-tuned model to the specified path
-    final_model_path = f"{output_directory}/final_model"
-    model.save(final_model_path)
-    print(f"Final model saved to {final_model_path}.")
+        def pretokenize_for_contrastive_loss(dataset):
+            instructions = list(dataset.get_column("instruction"))
+            inputs = list(dataset.get_column("input"))
+            return PretokenizedPairs(
+                pretokenize_column(instructions, model.tokenizer, instruction_prefix, max_seq_length, pretokenized_cache_dir),
+                pretokenize_column(inputs, model.tokenizer, input_prefix, max_seq_length, pretokenized_cache_dir),
+                positive_keys=text_hashes(inputs),
+                pad_token_id=model.tokenizer.pad_token_id
+            )
+
+        with span("prepare_data", items=len(train_dataset)):
+            pretokenized_train_data = None
+            if pretokenized_cache_dir:
+                pretokenized_train_data = pretokenize_for_contrastive_loss(train_dataset)
+                formatted_train_data = pretokenized_train_data
+            else:
+                formatted_train_data = format_for_contrastive_loss(train_dataset)
+            formatted_validation_data = format_for_contrastive_loss(validation_dataset) if validation_dataset else None
+        
+        if gradient_cache_mini_batch_size:
+            training_loss = GradientCachedContrastiveLoss(model, mini_batch_size=gradient_cache_mini_batch_size)
+        else:
+            training_loss = model_trainer.create_contrastive_loss(model)
+        
+        training_parameters = {
+            "epochs": epochs,
+            "batch_size": batch_size,
+            "learning_rate": learning_rate,
+            "output_dir": output_directory,
+            "evaluation_strategy": "steps" if formatted_validation_data else "no",
+            "save_strategy": "steps",
+            "logging_steps": 100,
+            "save_steps": 500
+        }
+        pair_training_parameters = dict(training_parameters)
+        if pretokenized_train_data is not None:
+            # Length-bucketed batch order and padding straight from the token memmaps
+            pair_training_parameters["batch_sampler"] = pretokenized_train_data.batch_sampler(batch_size)
+            pair_training_parameters["data_collator"] = pretokenized_train_data.collate
+        
+        # --- Model Training ---
+        def train(train_data, training_args, optimizers=None):
+            # optimizers=(optimizer, scheduler) carries optimizer and schedule state across trainers
+            trainer = model_trainer.initialize(
+                model=model,
+                train_dataset=train_data,
+                eval_dataset=formatted_validation_data,
+                loss_function=training_loss,
+                training_args=training_args,
+                **({"optimizers": optimizers} if optimizers else {})
+            )
+            with span("train"):
+                start = time.perf_counter()
+                trainer.train()
+                return time.perf_counter() - start
+        
+        # Start the training process
+        print("Starting model fine-tuning...")
+        if hard_negative_refresh_steps:
+            mining_seconds = 0.0
+            training_seconds = 0.0
+            instructions = list(train_dataset.get_column("instruction"))
+            personas = list(train_dataset.get_column("input"))
+            num_rounds = hard_negative_rounds or max(1, math.ceil(
+                epochs * math.ceil(len(instructions) * num_hard_negatives / batch_size) / hard_negative_refresh_steps
+            ))
+            # Triplets are plain rows, so the pair sampler and collator of pretokenized data do not apply
+            triplet_training_parameters = {**training_parameters, "max_steps": hard_negative_refresh_steps}
+            optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
+            scheduler = get_linear_schedule_with_warmup(optimizer, 0, num_rounds * hard_negative_refresh_steps)
+            for round_index in range(num_rounds):
+                # Negatives are re-mined with the latest weights at the start of every round
+                triplets_path = f"{output_directory}/hard_negatives/round_{round_index}.jsonl"
+                with span("mine_hard_negatives", items=len(instructions)):
+                    mining_stats = mine_hard_negatives(
+                        model.encode,
+                        instructions,
+                        personas,
+                        triplets_path,
+                        instruction_prefix=instruction_prefix,
+                        input_prefix=input_prefix,
+                        num_negatives=num_hard_negatives
+                    )
+                mining_seconds += mining_stats["mining_seconds"]
+                triplets = data_loader.load_dataset(triplets_path)
+                training_seconds += train(triplets, triplet_training_parameters, (optimizer, scheduler))
+            print(f"Training complete (mining {mining_seconds:.1f}s, training {training_seconds:.1f}s).")
+        else:
+            training_seconds = train(formatted_train_data, pair_training_parameters)
+            print(f"Training complete ({training_seconds:.1f}s).")
+        
+        # Save the final, fine-tuned model to the specified path
+        final_model_path = f"{output_directory}/final_model"
+        with span("save_model"):
+            model.save(final_model_path)
+        print(f"Final model saved to {final_model_path}.")
 
 def main():
     """
@@ -82,7 +182,14 @@ def main():
         batch_size=args.batch_size,
         learning_rate=args.learning_rate,
         instruction_prefix=args.instruction_prefix,
-        input_prefix=args.input_prefix
+        input_prefix=args.input_prefix,
+        gradient_cache_mini_batch_size=args.gradient_cache_mini_batch_size,
+        hard_negative_refresh_steps=args.hard_negative_refresh_steps,
+        hard_negative_rounds=args.hard_negative_rounds,
+        num_hard_negatives=args.num_hard_negatives,
+        pretokenized_cache_dir=args.pretokenized_cache_dir,
+        max_seq_length=args.max_seq_length,
+        instrument=args.instrument
     )
 
 if __name__ == "__main__":
@@ -1,7 +1,28 @@
+import numpy as np
+
 import data_loader
 import embedding_generator
 import dimensionality_reducer
 import plot_generator
+from density_plot import encode_categories, render_density_plot
+from embedding_store import DEFAULT_STORE_DIR, encode_with_store, lazy_encoder
+from instrumentation import profile_run, span
+from knn_graph import DEFAULT_GRAPH_DIR, embeddings_fingerprint, load_knn_graph
+from model_mappings import load_model
+from scalable_tsne import perplexity_neighbors, scalable_tsne
+
+def combine_embeddings(instruction_embeddings, persona_embeddings):
+    """
+    Stacks instruction and persona rows into one array, instructions first. Point types and
+    classes are built in the same order.
+    """
+    return np.concatenate([np.asarray(instruction_embeddings), np.asarray(persona_embeddings)])
+
+def split_results(results, num_instructions):
+    """
+    Splits rows combined by combine_embeddings back into (instructions, personas).
+    """
+    return results[:num_instructions], results[num_instructions:]
 
 def create_tsne_visualization(
     dataset_path,
@@ -10,69 +31,129 @@ def create_tsne_visualization(
     instruction_prefix,
     input_prefix,
     show_class_colors=False,
-    apply_text_formatting=False
+    apply_text_formatting=False,
+    store_dir=DEFAULT_STORE_DIR,
+    scalable=False,
+    max_points=None,
+    num_threads=-1,
+    graph_dir=DEFAULT_GRAPH_DIR,
+    render="scatter",
+    encode_backend="torch",
+    instrument=False
 ):
     """
     Generates a t-SNE plot to visualize instruction and persona embeddings.
+
+    With scalable=True, t-SNE runs on a 50-dimensional PCA projection with approximate
+    neighbours and FFT gradients on num_threads threads. With max_points also set, only a
+    subsample of that size, stratified by type and class, is embedded; the remaining points are
+    placed next to their nearest embedded neighbours. If the UMAP script has cached a kNN graph
+    of the same embeddings in graph_dir, the scalable mode uses it instead of searching again.
+
+    render="density" draws a category-coloured density raster instead of one marker per point,
+    which stays fast and readable at millions of points.
+
+    encode_backend="onnx" or "onnx-int8" embeds on ONNX Runtime instead of the model itself.
+
+    With instrument=True (or PIPELINE_INSTRUMENTATION set), per-stage timings and memory are
+    written to output_directory/tsne_spans.json.
     """
     
-    # Load the dataset containing text and optional class information
-    dataset = data_loader.load(dataset_path)
-    
-    # --- Text and Embedding Preparation ---
-    # Extract instruction and persona texts from the dataset
-    instructions = dataset.get_column("instruction")
-    personas = dataset.get_column("input")
-    
-    # Optionally, add prefixes to the texts to simulate formatted model input
-    if apply_text_formatting:
-        instructions = [f"{instruction_prefix} {text}" for text in instructions]
-        personas = [f"{input_prefix} {text}" for text in personas]
+    with profile_run("tsne_visualization", f"{output_directory}/tsne_spans.json", instrument):
+        # Load the dataset containing text and optional class information
+        with span("load_dataset"):
+            dataset = data_loader.load(dataset_path)
         
-    # Generate embeddings for both sets of texts using a specified model
-    model = embedding_generator.load_model(model_name)
-    instruction_embeddings = model.encode(instructions)
-    persona_embeddings = model.encode(personas)
-    
-    # Combine embeddings for joint t-SNE processing
-    all_embeddings = combine_embeddings(instruction_embeddings, persona_embeddings)
-    
-    # --- t-SNE and Plotting ---
-    print("Running t-SNE...")
-    
-    # Apply t-SNE to reduce the embeddings to two dimensions
-    tsne_results = dimensionality_reducer.reduce_with_tsne(all_embeddings, dimensions=2)
-    
-    # Separate the 2D results back into instructions and personas
-    tsne_instructions, tsne_personas = split_results(tsne_results, len(instructions))
-    
-    # Prepare data for plotting, including labels and colors
-    plot_data = {
-        "x_coords": tsne_results[:, 0],
-        "y_coords": tsne_results[:, 1],
-        "type": ["Persona"] * len(personas) + ["Instruction"] * len(instructions)
-    }
-    
-    if show_class_colors:
-        # If class information is available, add it to the plot data
-        instruction_classes = dataset.get_column("instruction_class")
-        persona_classes = dataset.get_column("input_class")
-        plot_data["class"] = persona_classes + instruction_classes
-    
-    # Generate the t-SNE scatter plot
-    tsne_plot = plot_generator.create_scatterplot_from_data(
-        data=plot_data,
-        x_col="x_coords",
-        y_col="y_coords",
-        style_col="type",  # Different markers for personas vs. instructions
-        color_col="class" if show_class_colors else None,
-        title=f"t-SNE Visualization for {model_name}"
-    )
-    
-    # Save the plot to a file
-    plot_generator.save_plot(tsne_plot, output_directory, "tsne_visualization.png")
-    
-    print(f"t-SNE plot saved to {output_directory}.")
+        # --- Text and Embedding Preparation ---
+        # Extract instruction and persona texts from the dataset
+        instructions = dataset.get_column("instruction")
+        personas = dataset.get_column("input")
+        
+        # Optionally, add prefixes to the texts to simulate formatted model input
+        instruction_text_prefix = f"{instruction_prefix} " if apply_text_formatting else ""
+        persona_text_prefix = f"{input_prefix} " if apply_text_formatting else ""
+            
+        # Generate embeddings for both sets of texts, reusing the ones already in the embedding store
+        encode = lazy_encoder(lambda: load_model(model_name, embedding_generator.load_model, encode_backend))
+        with span("embed_instructions", items=len(instructions)):
+            instruction_embeddings = encode_with_store(
+                instructions, model_name, encode, instruction_text_prefix, store_dir, encode_backend
+            )
+        with span("embed_personas", items=len(personas)):
+            persona_embeddings = encode_with_store(personas, model_name, encode, persona_text_prefix, store_dir, encode_backend)
+        
+        # Combine embeddings for joint t-SNE processing
+        all_embeddings = combine_embeddings(instruction_embeddings, persona_embeddings)
+        
+        # --- t-SNE and Plotting ---
+        print("Running t-SNE...")
+        
+        # Point types and classes as integer codes, in the order of all_embeddings (instructions first)
+        type_names = ["Instruction", "Persona"]
+        type_codes = np.repeat(np.arange(2, dtype=np.int32), [len(instructions), len(personas)])
+        if show_class_colors:
+            instruction_classes = dataset.get_column("instruction_class")
+            persona_classes = dataset.get_column("input_class")
+            class_codes, class_names = encode_categories(instruction_classes, persona_classes)
+        
+        # Apply t-SNE to reduce the embeddings to two dimensions
+        with span("reduce", items=len(all_embeddings)):
+            if scalable:
+                # Subsample strata: point type, and class when available
+                strata = type_codes * len(class_names) + class_codes if show_class_colors else type_codes
+                knn_graph = (
+                    load_knn_graph(embeddings_fingerprint(all_embeddings), perplexity_neighbors(), graph_dir) if graph_dir else None
+                )
+                tsne_results, timings = scalable_tsne(
+                    all_embeddings, labels=strata, max_points=max_points, num_threads=num_threads, knn_graph=knn_graph
+                )
+                print("t-SNE timings: " + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in timings.items()))
+            else:
+                tsne_results = dimensionality_reducer.reduce_with_tsne(all_embeddings, dimensions=2)
+        
+        # Separate the 2D results back into instructions and personas
+        tsne_instructions, tsne_personas = split_results(tsne_results, len(instructions))
+        
+        if render == "density":
+            codes, names = (class_codes, class_names) if show_class_colors else (type_codes, type_names)
+            with span("render", items=len(tsne_results)):
+                render_density_plot(
+                    tsne_results[:, 0],
+                    tsne_results[:, 1],
+                    codes,
+                    names,
+                    f"{output_directory}/tsne_visualization.png",
+                    title=f"t-SNE Visualization for {model_name}"
+                )
+            print(f"t-SNE density plot saved to {output_directory}.")
+            return
+        
+        # Prepare data for plotting, including labels and colors
+        plot_data = {
+            "x_coords": tsne_results[:, 0],
+            "y_coords": tsne_results[:, 1],
+            "type": [type_names[code] for code in type_codes]
+        }
+        
+        if show_class_colors:
+            # If class information is available, add it to the plot data
+            plot_data["class"] = [str(class_names[code]) for code in class_codes]
+        
+        with span("render", items=len(tsne_results)):
+            # Generate the t-SNE scatter plot
+            tsne_plot = plot_generator.create_scatterplot_from_data(
+                data=plot_data,
+                x_col="x_coords",
+                y_col="y_coords",
+                style_col="type",  # Different markers for personas vs. instructions
+                color_col="class" if show_class_colors else None,
+                title=f"t-SNE Visualization for {model_name}"
+            )
+            
+            # Save the plot to a file
+            plot_generator.save_plot(tsne_plot, output_directory, "tsne_visualization.png")
+        
+        print(f"t-SNE plot saved to {output_directory}.")
 
 def main():
     """
@@ -86,7 +167,11 @@ def main():
         instruction_prefix=args.instruction_prefix,
         input_prefix=args.input_prefix,
         output_directory=args.output_dir,
-        show_class_colors=True
+        show_class_colors=True,
+        scalable=True,
+        max_points=200000,
+        render="density",
+        encode_backend=args.encode_backend
     )
 
 if __name__ == "__main__":
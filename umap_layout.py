@@ -0,0 +1,122 @@
+"""
+UMAP Layout
+
+Persistent UMAP layouts. The fitted reducer (including its kNN graph and search index) is
+pickled next to the plot together with the coordinates and text hashes of every point it has
+placed, so a later run only projects the embeddings that are new, with `transform`, into the
+existing layout instead of refitting on everything. The reducer's kNN graph is also published
+to the shared knn_graph cache, together with a graph wide enough for the t-SNE script's
+perplexity-calibrated affinities.
+"""
+
+import os
+import pickle
+import time
+
+import numpy as np
+
+from knn_graph import DEFAULT_GRAPH_DIR, drop_self, embeddings_fingerprint, get_knn_graph, save_knn_graph
+from scalable_tsne import perplexity_neighbors
+
+
+class UmapLayout:
+    """
+    A fitted UMAP reducer plus the 2D coordinates of all points placed so far, keyed by uint64
+    text hash. fit_seconds and transform_seconds accumulate the time spent in UMAP.
+    """
+
+    def __init__(self, reducer, keys, coordinates):
+        self.reducer = reducer
+        self.keys = np.asarray(keys, dtype=np.uint64)
+        self.coordinates = np.asarray(coordinates, dtype=np.float32)
+        self.fit_seconds = 0.0
+        self.transform_seconds = 0.0
+
+    @classmethod
+    def fit(cls, embeddings, keys, num_neighbors=15, min_dist=0.1, metric="cosine", seed=None, graph_dir=DEFAULT_GRAPH_DIR,
+            tsne_perplexity=30.0):
+        """
+        Fits UMAP on the embeddings and publishes kNN graphs to graph_dir (None to skip).
+
+        UMAP's own graph has too few neighbours for t-SNE, so a graph with
+        perplexity_neighbors(tsne_perplexity) neighbours is cached alongside it.
+
+        Args:
+            embeddings (np.ndarray): Matrix of shape (n, dim)
+            keys (np.ndarray): Text hash of every row
+            num_neighbors (int): UMAP n_neighbors
+            min_dist (float): UMAP min_dist
+            metric (str): UMAP metric
+            seed (int): Random seed; None allows UMAP to run multi-threaded
+            graph_dir (str): kNN graph cache directory
+            tsne_perplexity (float): Perplexity the t-SNE graph is sized for
+
+        Returns:
+            UmapLayout: The fitted layout
+        """
+        import umap
+
+        reducer = umap.UMAP(n_components=2, n_neighbors=num_neighbors, min_dist=min_dist, metric=metric, random_state=seed)
+        start = time.perf_counter()
+        coordinates = reducer.fit_transform(embeddings)
+        layout = cls(reducer, keys, coordinates)
+        layout.fit_seconds = time.perf_counter() - start
+
+        if graph_dir and metric == "cosine" and getattr(reducer, "_knn_indices", None) is not None:
+            indices, distances = drop_self(reducer._knn_indices, reducer._knn_dists)
+            save_knn_graph(embeddings_fingerprint(embeddings), indices, distances, graph_dir)
+        if graph_dir and metric == "cosine":
+            get_knn_graph(embeddings, min(len(embeddings) - 1, perplexity_neighbors(tsne_perplexity)), graph_dir)
+        return layout
+
+    def update(self, embeddings, keys):
+        """
+        Returns coordinates for the given rows, projecting only rows whose key is not in the
+        layout yet and adding them to it.
+
+        Args:
+            embeddings (np.ndarray): Matrix of shape (n, dim)
+            keys (np.ndarray): Text hash of every row
+
+        Returns:
+            tuple: (coordinates of shape (n, 2), number of newly projected rows)
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        order = np.argsort(self.keys, kind="stable")
+        positions = np.clip(np.searchsorted(self.keys[order], keys), 0, max(len(order) - 1, 0))
+        known = (self.keys[order][positions] == keys) if len(order) else np.zeros(len(keys), dtype=bool)
+
+        coordinates = np.empty((len(keys), 2), dtype=np.float32)
+        coordinates[known] = self.coordinates[order[positions[known]]]
+
+        new_rows = np.flatnonzero(~known)
+        if len(new_rows):
+            # Duplicated new texts are projected once
+            new_keys, first_rows, inverse = np.unique(keys[new_rows], return_index=True, return_inverse=True)
+            start = time.perf_counter()
+            projected = self.reducer.transform(np.asarray(embeddings[new_rows[first_rows]]))
+            self.transform_seconds += time.perf_counter() - start
+            coordinates[new_rows] = projected[inverse]
+            self.keys = np.concatenate([self.keys, new_keys])
+            self.coordinates = np.concatenate([self.coordinates, projected.astype(np.float32)])
+        return coordinates, len(new_rows)
+
+    def save(self, directory):
+        """
+        Writes reducer.pkl and layout.npz into directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "reducer.pkl"), "wb") as reducer_file:
+            pickle.dump(self.reducer, reducer_file, protocol=pickle.HIGHEST_PROTOCOL)
+        np.savez(os.path.join(directory, "layout.npz"), keys=self.keys, coordinates=self.coordinates)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "reducer.pkl"), "rb") as reducer_file:
+            reducer = pickle.load(reducer_file)
+        with np.load(os.path.join(directory, "layout.npz")) as data:
+            return cls(reducer, data["keys"], data["coordinates"])
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "reducer.pkl")) and os.path.exists(os.path.join(directory, "layout.npz"))
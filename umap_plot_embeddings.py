@@ -1,73 +1,147 @@
+import numpy as np
+
 import data_loader
 import embedding_generator
-import dimensionality_reducer
 import plot_generator
+from density_plot import encode_categories, render_density_plot
+from embedding_store import DEFAULT_STORE_DIR, encode_with_store, lazy_encoder, text_hashes
+from instrumentation import profile_run, span
+from knn_graph import DEFAULT_GRAPH_DIR
+from model_mappings import load_model
+from umap_layout import UmapLayout
+
+def combine_embeddings(instruction_embeddings, persona_embeddings):
+    """
+    Stacks instruction and persona rows into one array, instructions first. Point types and
+    classes are built in the same order.
+    """
+    return np.concatenate([np.asarray(instruction_embeddings), np.asarray(persona_embeddings)])
 
 def create_umap_visualization(
     dataset_path,
     model_name,
     output_directory,
     show_class_colors=False,
-    apply_text_formatting=False
+    apply_text_formatting=False,
+    store_dir=DEFAULT_STORE_DIR,
+    reuse_layout=False,
+    graph_dir=DEFAULT_GRAPH_DIR,
+    render="scatter",
+    encode_backend="torch",
+    instrument=False
 ):
     """
     Generates a UMAP plot to visualize instruction and persona embeddings.
+
+    The fitted reducer and the coordinates of all points are saved to output_directory/umap_layout.
+    With reuse_layout=True and a saved layout present, the reducer is not refitted: points already
+    in the layout keep their coordinates and only new texts are projected with transform. After a
+    fit, the reducer's kNN graph and a graph sized for t-SNE are cached in graph_dir for the t-SNE script.
+
+    render="density" draws a category-coloured density raster instead of one marker per point.
+
+    encode_backend="onnx" or "onnx-int8" embeds on ONNX Runtime instead of the model itself.
+
+    With instrument=True (or PIPELINE_INSTRUMENTATION set), per-stage timings and memory are
+    written to output_directory/umap_spans.json.
     """
     
-    # Load the dataset with text and optional class information
-    dataset = data_loader.load(dataset_path)
-    
-    # --- Text and Embedding Preparation ---
-    # Extract texts for instructions and personas
-    instructions = dataset.get_column("instruction")
-    personas = dataset.get_column("input")
-    
-    # Optionally format texts with prefixes
-    if apply_text_formatting:
-        instructions = [f"Query: {text}" for text in instructions]
-        personas = [f"Persona: {text}" for text in personas]
+    with profile_run("umap_visualization", f"{output_directory}/umap_spans.json", instrument):
+        # Load the dataset with text and optional class information
+        with span("load_dataset"):
+            dataset = data_loader.load(dataset_path)
         
-    # Generate embeddings using the specified model
-    model = embedding_generator.load_model(model_name)
-    instruction_embeddings = model.encode(instructions)
-    persona_embeddings = model.encode(personas)
-    
-    # Combine embeddings for UMAP processing
-    all_embeddings = combine_embeddings(instruction_embeddings, persona_embeddings)
-    
-    # --- UMAP and Plotting ---
-    print("Running UMAP...")
-    
-    # Apply UMAP to reduce embeddings to two dimensions
-    umap_results = dimensionality_reducer.reduce_with_umap(all_embeddings, dimensions=2)
-    
-    # Prepare data for plotting
-    plot_data = {
-        "x_coords": umap_results[:, 0],
-        "y_coords": umap_results[:, 1],
-        "type": ["Persona"] * len(personas) + ["Instruction"] * len(instructions)
-    }
-    
-    if show_class_colors:
-        # Add class information if available for color-coding
-        instruction_classes = dataset.get_column("instruction_class")
-        persona_classes = dataset.get_column("input_class")
-        plot_data["class"] = persona_classes + instruction_classes
-    
-    # Create the UMAP scatter plot
-    umap_plot = plot_generator.create_scatterplot_from_data(
-        data=plot_data,
-        x_col="x_coords",
-        y_col="y_coords",
-        style_col="type",  # Use different markers for types
-        color_col="class" if show_class_colors else None,
-        title=f"UMAP Visualization for {model_name}"
-    )
-    
-    # Save the plot
-    plot_generator.save_plot(umap_plot, output_directory, "umap_visualization.png")
-    
-    print(f"UMAP plot saved to {output_directory}.")
+        # --- Text and Embedding Preparation ---
+        # Extract texts for instructions and personas
+        instructions = dataset.get_column("instruction")
+        personas = dataset.get_column("input")
+        
+        # Optionally format texts with prefixes
+        instruction_text_prefix = "Query: " if apply_text_formatting else ""
+        persona_text_prefix = "Persona: " if apply_text_formatting else ""
+            
+        # Generate embeddings using the specified model, reusing the ones already in the embedding store
+        encode = lazy_encoder(lambda: load_model(model_name, embedding_generator.load_model, encode_backend))
+        with span("embed_instructions", items=len(instructions)):
+            instruction_embeddings = encode_with_store(
+                instructions, model_name, encode, instruction_text_prefix, store_dir, encode_backend
+            )
+        with span("embed_personas", items=len(personas)):
+            persona_embeddings = encode_with_store(personas, model_name, encode, persona_text_prefix, store_dir, encode_backend)
+        
+        # Combine embeddings for UMAP processing
+        all_embeddings = combine_embeddings(instruction_embeddings, persona_embeddings)
+        
+        # Texts identify points in the saved layout, in the same order as all_embeddings
+        all_keys = combine_embeddings(
+            text_hashes([f"{instruction_text_prefix}{text}" for text in instructions]),
+            text_hashes([f"{persona_text_prefix}{text}" for text in personas])
+        )
+        
+        # --- UMAP and Plotting ---
+        layout_directory = f"{output_directory}/umap_layout"
+        with span("reduce", items=len(all_embeddings)):
+            if reuse_layout and UmapLayout.exists(layout_directory):
+                print("Projecting new embeddings into the saved UMAP layout...")
+                layout = UmapLayout.load(layout_directory)
+                umap_results, num_new = layout.update(all_embeddings, all_keys)
+                print(f"Projected {num_new} new points in {layout.transform_seconds:.1f}s.")
+            else:
+                print("Running UMAP...")
+                # Apply UMAP to reduce embeddings to two dimensions
+                layout = UmapLayout.fit(all_embeddings, all_keys, graph_dir=graph_dir)
+                umap_results = layout.coordinates
+                print(f"Fitted UMAP on {len(umap_results)} points in {layout.fit_seconds:.1f}s.")
+        with span("save_layout"):
+            layout.save(layout_directory)
+        
+        if render == "density":
+            # Categories as integer codes, in the order of all_embeddings (instructions first)
+            if show_class_colors:
+                codes, names = encode_categories(dataset.get_column("instruction_class"), dataset.get_column("input_class"))
+            else:
+                codes = np.repeat(np.arange(2, dtype=np.int32), [len(instructions), len(personas)])
+                names = ["Instruction", "Persona"]
+            with span("render", items=len(umap_results)):
+                render_density_plot(
+                    umap_results[:, 0],
+                    umap_results[:, 1],
+                    codes,
+                    names,
+                    f"{output_directory}/umap_visualization.png",
+                    title=f"UMAP Visualization for {model_name}"
+                )
+            print(f"UMAP density plot saved to {output_directory}.")
+            return
+        
+        # Prepare data for plotting
+        plot_data = {
+            "x_coords": umap_results[:, 0],
+            "y_coords": umap_results[:, 1],
+            "type": ["Instruction"] * len(instructions) + ["Persona"] * len(personas)
+        }
+        
+        if show_class_colors:
+            # Add class information if available for color-coding
+            instruction_classes = dataset.get_column("instruction_class")
+            persona_classes = dataset.get_column("input_class")
+            plot_data["class"] = list(instruction_classes) + list(persona_classes)
+        
+        with span("render", items=len(umap_results)):
+            # Create the UMAP scatter plot
+            umap_plot = plot_generator.create_scatterplot_from_data(
+                data=plot_data,
+                x_col="x_coords",
+                y_col="y_coords",
+                style_col="type",  # Use different markers for types
+                color_col="class" if show_class_colors else None,
+                title=f"UMAP Visualization for {model_name}"
+            )
+            
+            # Save the plot
+            plot_generator.save_plot(umap_plot, output_directory, "umap_visualization.png")
+        
+        print(f"UMAP plot saved to {output_directory}.")
 
 def main():
     """
@@ -77,13 +151,17 @@ def main():
     dataset_file_path = "path/to/classified/dataset"
     embedding_model = "some-sentence-transformer-model"
     output_dir = "results/umap_plots"
+    encode_backend = "torch"  # "onnx-int8" to embed with the quantized ONNX Runtime backend
     
     # Execute visualization
     create_umap_visualization(
         dataset_path=dataset_file_path,
         model_name=embedding_model,
         output_directory=output_dir,
-        show_class_colors=True
+        show_class_colors=True,
+        reuse_layout=True,
+        render="density",
+        encode_backend=encode_backend
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+"""
+User Embeddings
+
+Online user modelling from streaming dialogs. Dialogs arrive in the {"speaker", "message"} turn
+format of openai_synthesize.generate_dialogs_for_persona, keyed by user and dialog; only user
+turns that have not been seen before in their dialog are embedded, and each user's embedding is a running pool of their turn embeddings
+kept in preallocated arrays. Updating a user therefore costs one encode of the new turn and
+O(dim) arithmetic, independent of the length of their history.
+
+Pooling is a decayed weighted mean: with decay d, the pooled vector after turns e_1..e_t is
+sum(d^(t-i) w_i e_i) / sum(d^(t-i) w_i), where w_i is the turn weight (1 by default). d=1 gives
+the plain mean over all turns, d<1 favours recent turns, and d=0 keeps only the latest turn.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from retrieval_ranking import normalize_embeddings
+
+
+class UserEmbeddingStore:
+    """
+    Running pooled embeddings of users, keyed by user ID, in arrays that grow by doubling.
+
+    Per user the store keeps the decayed sum of weighted turn embeddings, the decayed sum of
+    weights and the number of pooled turns, so memory is (dim * itemsize + 12) bytes per user.
+    dialog_turns counts the user turns pooled from every (user ID, dialog ID), for
+    DialogUserEncoder.
+
+    Args:
+        dimension (int): Embedding dimension
+        decay (float): Weight kept by the pool per new turn, in [0, 1]
+        dtype: Dtype of the pooled sums, float32 or float16
+        capacity (int): Initially allocated users
+    """
+
+    def __init__(self, dimension, decay=1.0, dtype=np.float32, capacity=1024):
+        if not 0.0 <= decay <= 1.0:
+            raise ValueError(f"decay must be in [0, 1], got {decay}.")
+        self.dimension = dimension
+        self.decay = decay
+        self.user_rows = {}
+        self.user_ids = []
+        self.sums = np.zeros((capacity, dimension), dtype=dtype)
+        self.weights = np.zeros(capacity, dtype=np.float32)
+        self.turn_counts = np.zeros(capacity, dtype=np.int32)
+        self.dialog_turns = {}
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @property
+    def memory_bytes(self):
+        """Bytes of the arrays in use (the allocated capacity may be up to twice as large)."""
+        per_user = self.sums.itemsize * self.dimension + self.weights.itemsize + self.turn_counts.itemsize
+        return len(self) * per_user
+
+    def _grow(self, size):
+        capacity = len(self.weights)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ("sums", "weights", "turn_counts"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def rows(self, user_ids, create=True):
+        """
+        Row of every user ID; unknown users get a new row, or -1 with create=False.
+        """
+        rows = np.empty(len(user_ids), dtype=np.int64)
+        for i, user_id in enumerate(user_ids):
+            row = self.user_rows.get(user_id)
+            if row is None:
+                if not create:
+                    rows[i] = -1
+                    continue
+                row = len(self.user_ids)
+                self.user_rows[user_id] = row
+                self.user_ids.append(user_id)
+            rows[i] = row
+        self._grow(len(self.user_ids))
+        return rows
+
+    def update(self, user_ids, embeddings, weights=None):
+        """
+        Pools one new turn embedding into each listed user, in order.
+
+        Args:
+            user_ids (list): User of every embedding; a user may appear several times
+            embeddings (np.ndarray): (len(user_ids), dim) turn embeddings
+            weights (np.ndarray): Optional weight of every turn
+        """
+        rows = self.rows(user_ids)
+        embeddings = normalize_embeddings(np.asarray(embeddings, dtype=np.float32))
+        weights = np.ones(len(rows), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+
+        # Turns of the same user are applied in order: the k-th turn of every user goes in round k
+        order = np.argsort(rows, kind="stable")
+        sorted_rows = rows[order]
+        starts = np.flatnonzero(np.r_[True, sorted_rows[1:] != sorted_rows[:-1]])
+        occurrence = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+        for round_index in range(int(occurrence.max()) + 1 if len(rows) else 0):
+            selected = order[occurrence == round_index]
+            round_rows = rows[selected]
+            round_weights = weights[selected]
+            self.sums[round_rows] = (
+                self.decay * self.sums[round_rows].astype(np.float32) + round_weights[:, None] * embeddings[selected]
+            ).astype(self.sums.dtype)
+            self.weights[round_rows] = self.decay * self.weights[round_rows] + round_weights
+            self.turn_counts[round_rows] += 1
+
+    def get(self, user_ids):
+        """
+        Pooled, L2-normalised embeddings of the given users; zero vectors for unknown users.
+        """
+        rows = self.rows(user_ids, create=False)
+        known = rows >= 0
+        pooled = np.zeros((len(rows), self.dimension), dtype=np.float32)
+        pooled[known] = self.sums[rows[known]].astype(np.float32) / np.maximum(self.weights[rows[known]], 1e-12)[:, None]
+        return normalize_embeddings(pooled)
+
+    def all_embeddings(self):
+        """Pooled embeddings of all users, in the order of user_ids."""
+        count = len(self)
+        return normalize_embeddings(self.sums[:count].astype(np.float32) / np.maximum(self.weights[:count], 1e-12)[:, None])
+
+    def save(self, directory):
+        """
+        Writes users.json and pools.npz into directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        count = len(self)
+        np.savez(
+            os.path.join(directory, "pools.npz"),
+            sums=self.sums[:count], weights=self.weights[:count], turn_counts=self.turn_counts[:count]
+        )
+        with open(os.path.join(directory, "users.json"), "w", encoding="utf-8") as users_file:
+            json.dump({
+                "user_ids": self.user_ids,
+                "decay": self.decay,
+                "dialog_turns": [[user_id, dialog_id, count] for (user_id, dialog_id), count in self.dialog_turns.items()]
+            }, users_file)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "users.json"), "r", encoding="utf-8") as users_file:
+            users = json.load(users_file)
+        with np.load(os.path.join(directory, "pools.npz")) as data:
+            sums = data["sums"]
+            store = cls(sums.shape[1], users["decay"], sums.dtype, capacity=max(len(sums), 1))
+            store.sums[:len(sums)] = sums
+            store.weights[:len(sums)] = data["weights"]
+            store.turn_counts[:len(sums)] = data["turn_counts"]
+        store.user_ids = list(users["user_ids"])
+        store.user_rows = {user_id: row for row, user_id in enumerate(store.user_ids)}
+        store.dialog_turns = {(user_id, dialog_id): count for user_id, dialog_id, count in users.get("dialog_turns", [])}
+        return store
+
+
+class DialogUserEncoder:
+    """
+    Feeds dialogs into a UserEmbeddingStore, embedding only user turns not consumed before.
+
+    A dialog may be passed again as it grows (the full turn list each time); turns up to the
+    number already pooled from that dialog are skipped. A user's other dialogs are tracked
+    separately, so all of them are pooled into the user's embedding. New turns of many users are
+    embedded in one encode call.
+
+    Args:
+        encode (callable): Maps a list of texts to (n, dim) embeddings
+        store (UserEmbeddingStore): Store receiving the pooled embeddings
+        speaker (str): Speaker whose turns describe the user
+        prefix (str): Prefix prepended to each message before encoding
+        turn_weight (callable): Optional weight of a message, e.g. by length
+    """
+
+    def __init__(self, encode, store, speaker="user", prefix="", turn_weight=None):
+        self.encode = encode
+        self.store = store
+        self.speaker = speaker
+        self.prefix = prefix
+        self.turn_weight = turn_weight
+        self.turns_encoded = 0
+
+    def consume(self, dialogs):
+        """
+        Pools the unseen user turns of the given dialogs.
+
+        Args:
+            dialogs (list): (user ID, dialog ID, turns) triples, turns as {"speaker", "message"} dicts
+
+        Returns:
+            int: Number of turns embedded
+        """
+        user_ids, messages = [], []
+        for user_id, dialog_id, turns in dialogs:
+            user_messages = [turn["message"] for turn in turns if turn["speaker"] == self.speaker]
+            # Counted when queued, so a dialog passed twice in one call is embedded once
+            seen = self.store.dialog_turns.get((user_id, dialog_id), 0)
+            new_messages = user_messages[seen:]
+            self.store.dialog_turns[(user_id, dialog_id)] = seen + len(new_messages)
+            for message in new_messages:
+                user_ids.append(user_id)
+                messages.append(message)
+        if not messages:
+            return 0
+
+        embeddings = self.encode([f"{self.prefix}{message}" for message in messages])
+        weights = [self.turn_weight(message) for message in messages] if self.turn_weight else None
+        self.store.update(user_ids, embeddings, weights)
+        self.turns_encoded += len(messages)
+        return len(messages)